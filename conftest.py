@@ -25,8 +25,10 @@ from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
 import trackhubs
+import trackhubs.translator
 from thr.settings import BASE_DIR
 from trackhubs.models import Trackdb
+from trackhubs import reference_data
 
 
 def _create_hub(  # pylint: disable=too-many-arguments
@@ -138,12 +140,16 @@ def urlopen_mock(monkeypatch):
         def __init__(self, code=200, body=b""):
             self._code = code
             self._body = body
+            self.headers = {}
 
         def getcode(self):
             return self._code
 
-        def read(self):
-            return self._body
+        def read(self, amt=None):
+            return self._body if amt is None else self._body[:amt]
+
+        def __iter__(self):
+            return iter(self._body.splitlines(keepends=True))
 
         def __enter__(self):
             return self
@@ -233,9 +239,13 @@ def urlopen_mock(monkeypatch):
 
         return _Resp(200)
 
+    def _fake_ftp_probe(url, *args, **kwargs):
+        with _fake_urlopen(url):
+            return {'content_length': None, 'last_modified': None}
+
     # We route both track status checks and parser downloads through the same stubbed urlopen.
-    monkeypatch.setattr("trackhubs.tracks_status.urllib.request.urlopen", _fake_urlopen)
-    monkeypatch.setattr("trackhubs.parser.urllib.request.urlopen", _fake_urlopen)
+    monkeypatch.setattr("trackhubs.http_client.urlopen", _fake_urlopen)
+    monkeypatch.setattr("trackhubs.http_client.ftp_probe", _fake_ftp_probe)
 
 
 @pytest.fixture(autouse=True)
@@ -300,12 +310,53 @@ def search_trackdb_document_mock(monkeypatch):
 @pytest.fixture(autouse=True)
 def disable_trackdb_es_updates(monkeypatch):
     """
-    Disable Trackdb.update_trackdb_document ES updates during tests.
+    Disable Trackdb.update_trackdb_document and Trackdb.partial_update_trackdb_document ES updates during tests.
     """
     def _noop(*args, **kwargs):
         return None
 
     monkeypatch.setattr("trackhubs.models.Trackdb.update_trackdb_document", _noop)
+    monkeypatch.setattr("trackhubs.models.Trackdb.partial_update_trackdb_document", _noop)
+
+
+@pytest.fixture(autouse=True)
+def clear_reference_data_cache():
+    """
+    The DataType/FileType/Visibility maps are shared by the whole process,
+    rows created by a test are rolled back so they shouldn't be seen by the next one
+    """
+    reference_data.clear_cache()
+    yield
+    reference_data.clear_cache()
+
+
+@pytest.fixture(autouse=True)
+def clear_assembly_info_cache():
+    """
+    The resolved genome assemblies are memoized per process, each test has its own genome_assembly_dump rows
+    """
+    trackhubs.translator.clear_assembly_info_cache()
+    yield
+    trackhubs.translator.clear_assembly_info_cache()
+
+
+@pytest.fixture(autouse=True)
+def reset_host_breakers(monkeypatch):
+    """
+    The per host circuit breakers and slots are shared by the whole process, a host failing in one test
+    shouldn't be skipped in the next one, and its slots follow the STATUS_CHECK_MAX_PER_HOST setting of the test
+    """
+    monkeypatch.setattr("trackhubs.tracks_status._host_breakers", {})
+    monkeypatch.setattr("trackhubs.tracks_status._host_slots", {})
+
+
+@pytest.fixture(autouse=True)
+def reset_es_client(monkeypatch):
+    """
+    The Elasticsearch client is shared by the whole process, each test gets a new one
+    so that it's created with the mocked Elasticsearch class of the test
+    """
+    monkeypatch.setattr("trackhubs.es_client._client", None)
 
 
 @pytest.fixture(autouse=True)
@@ -12,7 +12,6 @@
    limitations under the License.
 """
 import django
-import elasticsearch
 from django.conf import settings
 from rest_framework import status
 from rest_framework.pagination import LimitOffsetPagination
@@ -28,7 +27,7 @@ from info.serializers import (
     AssembliesInfoResponseSerializer,
     CountResponseSerializer,
 )
-from thr.settings import ELASTICSEARCH_DSL
+from trackhubs.es_client import get_es_client
 from trackhubs.models import Species, Assembly, Trackdb, Track, Hub
 
 
@@ -54,12 +53,7 @@ class PingInfoView(APIView):
         If the request is successful, the response is a hash with one key, ping.
         If it's value is 1 the service is available.
         """
-        es_instance = elasticsearch.Elasticsearch(
-            [ELASTICSEARCH_DSL['default']['hosts']],
-            verify_certs=True
-        )
-
-        if es_instance.ping():
+        if get_es_client().ping():
             return Response({'ping': 1}, status=status.HTTP_200_OK)
         return Response({'message': 'Error: Service Unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
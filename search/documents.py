@@ -155,6 +155,7 @@ class TrackdbDocument(Document):
             'version',
             'created',
             'updated',
+            'status_updated',
         ]
 
     # Meta is used to set dynamic mapping to false to avoid mapping explosion
@@ -172,6 +172,21 @@ ELASTICSEARCH_INDEX_NAMES = {
     'search.documents': os.environ.get('ES_INDEX', 'trackhubs'),
 }
 
+# Elasticsearch client shared by the whole process (see trackhubs/es_client.py): timeout (in seconds) of the
+# requests, except the document updates which can take up to ES_WRITE_TIMEOUT seconds on a busy cluster,
+# number of retries and maximum number of connections kept open per node
+ES_CLIENT_TIMEOUT = int(os.environ.get('ES_CLIENT_TIMEOUT', 30))
+ES_WRITE_TIMEOUT = int(os.environ.get('ES_WRITE_TIMEOUT', 600))
+ES_CLIENT_MAX_RETRIES = int(os.environ.get('ES_CLIENT_MAX_RETRIES', 3))
+ES_CLIENT_MAXSIZE = int(os.environ.get('ES_CLIENT_MAXSIZE', 10))
+
+# Bulk indexing of the trackdb documents (see trackhubs/es_bulk.py): maximum number of documents and size
+# (in bytes) of one bulk request, and number of retries of the documents rejected with 429 or 5xx errors
+ES_BULK_BATCH_SIZE = int(os.environ.get('ES_BULK_BATCH_SIZE', 500))
+ES_BULK_MAX_BYTES = int(os.environ.get('ES_BULK_MAX_BYTES', 10 * 1024 * 1024))
+ES_BULK_MAX_RETRIES = int(os.environ.get('ES_BULK_MAX_RETRIES', 3))
+ES_BULK_BACKOFF = float(os.environ.get('ES_BULK_BACKOFF', 2))
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -281,5 +296,83 @@ BACKEND_URL = os.environ.get('BACKEND_URL', 'localhost:8000')
 # and Hub facets can be controlled using FACETS_LENGHT
 FACETS_LENGHT = 30
 
+# The worker of a running hub submission job renews its lease every SUBMISSION_JOB_LEASE / 3 seconds,
+# a job whose lease has expired has lost its worker and is processed again, up to SUBMISSION_JOB_MAX_ATTEMPTS times
+# (see trackhubs/jobs.py)
+SUBMISSION_JOB_LEASE = int(os.environ.get('SUBMISSION_JOB_LEASE', 60 * 60))
+SUBMISSION_JOB_MAX_ATTEMPTS = int(os.environ.get('SUBMISSION_JOB_MAX_ATTEMPTS', 3))
+
+# How long (in seconds) a process serves the DataType, FileType and Visibility ids it has loaded
+# before reading them again, so that the changes made by the other processes are picked up
+REFERENCE_DATA_CACHE_TTL = int(os.environ.get('REFERENCE_DATA_CACHE_TTL', 300))
+
+# Number of track rows written per INSERT/UPDATE query when ingesting a trackDb
+TRACKS_BULK_BATCH_SIZE = int(os.environ.get('TRACKS_BULK_BATCH_SIZE', 1000))
+
+# Remote hub files and bigDataUrl checks (see trackhubs/http_client.py)
+# timeouts are in seconds, pools are kept per host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 50))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 20))
+
+# On-disk cache of the hub.txt, genomes.txt and trackDb.txt files (see trackhubs/hub_files_cache.py)
+# set HUB_FILES_CACHE_DIR to an empty string to disable it
+HUB_FILES_CACHE_DIR = os.environ.get('HUB_FILES_CACHE_DIR', str(BASE_DIR.parent / 'cache' / 'hub_files'))
+HUB_FILES_CACHE_MAX_SIZE = int(os.environ.get('HUB_FILES_CACHE_MAX_SIZE', 1024 * 1024 * 1024))
+
+# Maximum size (in bytes) of a hub, genomes or trackDb file and of one object (stanza) in it
+PARSER_MAX_FILE_SIZE = int(os.environ.get('PARSER_MAX_FILE_SIZE', 1024 * 1024 * 1024))
+PARSER_MAX_STANZA_SIZE = int(os.environ.get('PARSER_MAX_STANZA_SIZE', 1024 * 1024))
+
+# bigDataUrl checks (see trackhubs/tracks_status.py): maximum number of URLs checked at the same time
+# by the whole process and per host, and the timeout (in seconds) of each check
+STATUS_CHECK_MAX_WORKERS = int(os.environ.get('STATUS_CHECK_MAX_WORKERS', 32))
+STATUS_CHECK_MAX_PER_HOST = int(os.environ.get('STATUS_CHECK_MAX_PER_HOST', 4))
+STATUS_CHECK_TIMEOUT = float(os.environ.get('STATUS_CHECK_TIMEOUT', 30))
+
+# After STATUS_CHECK_BREAKER_THRESHOLD consecutive connection failures, the other bigDataUrls of the host
+# are reported as unreachable without being checked, the host is tried again STATUS_CHECK_BREAKER_RESET seconds later
+STATUS_CHECK_BREAKER_THRESHOLD = int(os.environ.get('STATUS_CHECK_BREAKER_THRESHOLD', 5))
+STATUS_CHECK_BREAKER_RESET = int(os.environ.get('STATUS_CHECK_BREAKER_RESET', 300))
+
+# bigDataUrl check results are reused for URL_CHECK_CACHE_TTL seconds by all the trackdbs
+# pointing to the same file (see trackhubs/url_check_cache.py), set it to 0 to disable the cache
+# the expired results are deleted and the table is capped at URL_CHECK_CACHE_MAX_ENTRIES after each status refresh
+URL_CHECK_CACHE_TTL = int(os.environ.get('URL_CHECK_CACHE_TTL', 6 * 60 * 60))
+URL_CHECK_CACHE_MAX_ENTRIES = int(os.environ.get('URL_CHECK_CACHE_MAX_ENTRIES', 1000000))
+
+# Status refresh scheduler (see trackdbs/scheduler.py): how often (in seconds) the trackdbs are checked
+# depending on the check_interval of their owner, broken trackdbs are checked twice as often (but not more
+# often than STATUS_CHECK_MIN_INTERVAL) and trackdbs unchanged for STATUS_CHECK_STABLE_AFTER seconds half as often
+STATUS_CHECK_INTERVALS = {
+    'automatic': int(os.environ.get('STATUS_CHECK_AUTOMATIC_INTERVAL', 24 * 60 * 60)),
+    'weekly': 7 * 24 * 60 * 60,
+    'monthly': 30 * 24 * 60 * 60,
+}
+STATUS_CHECK_MIN_INTERVAL = int(os.environ.get('STATUS_CHECK_MIN_INTERVAL', 6 * 60 * 60))
+STATUS_CHECK_STABLE_AFTER = int(os.environ.get('STATUS_CHECK_STABLE_AFTER', 90 * 24 * 60 * 60))
+# The due trackdbs are claimed by update_due_trackdbs() for STATUS_CHECK_CLAIM_LEASE seconds so that
+# overlapping cron runs don't check them twice, they are due again if the run dies before checking them
+STATUS_CHECK_CLAIM_LEASE = int(os.environ.get('STATUS_CHECK_CLAIM_LEASE', 60 * 60))
+
+# Maximum number of trackDb files fetched, parsed and checked at the same time when submitting a hub
+GENOMES_MAX_WORKERS = int(os.environ.get('GENOMES_MAX_WORKERS', 8))
+
+# How often (in seconds) a process checks if 'import_assemblies' has reloaded the genome_assembly_dump table
+# and drops the genome assemblies it has already resolved
+GENOME_ASSEMBLY_CACHE_TTL = int(os.environ.get('GENOME_ASSEMBLY_CACHE_TTL', 300))
+
+# Maximum number of hubCheck processes running at the same time (the others wait for a free slot)
+# and how long (in seconds) one run can take before it's killed
+HUBCHECK_MAX_PROCESSES = int(os.environ.get('HUBCHECK_MAX_PROCESSES', 4))
+HUBCHECK_TIMEOUT = int(os.environ.get('HUBCHECK_TIMEOUT', 300))
+
+# How long (in seconds) a successful hubCheck result is reused for a hub whose content hasn't changed,
+# the expired results are deleted by the 'purge_hub_check_cache' management command
+HUBCHECK_CACHE_TTL = int(os.environ.get('HUBCHECK_CACHE_TTL', 7 * 24 * 60 * 60))
+
 # Whether to append trailing slashes to URLs.
 APPEND_SLASH = False
@@ -0,0 +1,150 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+import trackhubs
+from trackdbs.update_trackdb import REFRESH_BATCH_SIZE, refresh_trackdbs
+from trackhubs import url_check_cache
+
+logger = logging.getLogger(__name__)
+
+# number of schedule rows inserted per query
+BATCH_SIZE = 1000
+
+
+def get_check_interval(check_interval, failing, last_change, now):
+    """
+    :param check_interval: the owner's check_interval ('automatic', 'weekly' or 'monthly')
+    :param failing: True if some tracks of the trackdb are broken
+    :param last_change: the last time the trackdb was submitted (or created)
+    :param now: current time
+    :returns: number of seconds until the next check of the trackdb
+    """
+    interval = settings.STATUS_CHECK_INTERVALS.get(
+        (check_interval or '').lower(), settings.STATUS_CHECK_INTERVALS['automatic']
+    )
+    if failing:
+        # broken trackdbs are followed more closely
+        return max(interval // 2, settings.STATUS_CHECK_MIN_INTERVAL)
+    if last_change is not None and now - last_change > settings.STATUS_CHECK_STABLE_AFTER:
+        return interval * 2
+    return interval
+
+
+def sync_schedule():
+    """
+    Add the trackdbs that aren't in the queue yet, they are due straight away
+    The trackdbs deleted in the meantime are removed from the queue by the database (on delete cascade)
+    :returns: the number of added trackdbs
+    """
+    new_trackdb_ids = trackhubs.models.Trackdb.objects.filter(
+        trackdbschedule__isnull=True
+    ).values_list('trackdb_id', flat=True)
+    new_schedules = [
+        trackhubs.models.TrackdbSchedule(trackdb_id=trackdb_id, next_check=0)
+        for trackdb_id in new_trackdb_ids.iterator()
+    ]
+    trackhubs.models.TrackdbSchedule.objects.bulk_create(new_schedules, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return len(new_schedules)
+
+
+def schedule_next_check(trackdb_id, checked_at, check_failed=False):
+    """
+    Compute when the trackdb should be checked again
+    :param trackdb_id: the trackdb that has just been checked
+    :param checked_at: time of the check
+    :param check_failed: True if the check itself failed (e.g. the trackDb file couldn't be read)
+    :returns: the time of the next check
+    """
+    trackdb = trackhubs.models.Trackdb.objects.filter(trackdb_id=trackdb_id).values(
+        'created', 'updated', 'hub__owner__check_interval'
+    ).first()
+    if trackdb is None:
+        return None
+    failing = check_failed or trackhubs.models.TrackStatus.objects.filter(
+        track__trackdb_id=trackdb_id, consecutive_failures__gt=0
+    ).exists()
+    next_check = checked_at + get_check_interval(
+        trackdb['hub__owner__check_interval'], failing, trackdb['updated'] or trackdb['created'], checked_at
+    )
+    trackhubs.models.TrackdbSchedule.objects.update_or_create(
+        trackdb_id=trackdb_id, defaults={'next_check': next_check, 'last_checked': checked_at}
+    )
+    return next_check
+
+
+def claim_due_trackdbs(due_before, limit):
+    """
+    Take the most overdue trackdbs out of the queue for STATUS_CHECK_CLAIM_LEASE seconds,
+    the rows locked by another run are skipped
+    :param due_before: only claim the trackdbs due before this time
+    :param limit: maximum number of claimed trackdbs
+    :returns: list of the claimed trackdb ids
+    """
+    with transaction.atomic():
+        trackdb_ids = list(
+            trackhubs.models.TrackdbSchedule.objects.select_for_update(skip_locked=True).filter(
+                next_check__lte=due_before
+            ).order_by('next_check').values_list('trackdb_id', flat=True)[:limit]
+        )
+        trackhubs.models.TrackdbSchedule.objects.filter(trackdb_id__in=trackdb_ids).update(
+            next_check=int(time.time()) + settings.STATUS_CHECK_CLAIM_LEASE
+        )
+    return trackdb_ids
+
+
+def update_due_trackdbs(max_trackdbs=None, time_budget=None):
+    """
+    Check the status of the trackdbs that are due, the most overdue first,
+    and schedule their next check according to their owner's check_interval (see get_check_interval())
+    The trackdbs are claimed batch by batch (see claim_due_trackdbs()) so several runs can overlap
+    :param max_trackdbs: maximum number of trackdbs checked by this run
+    :param time_budget: stop claiming trackdbs after this number of seconds
+    :returns: dictionary with the number of 'checked' and 'failed' trackdbs (including the ones whose
+    Elasticsearch document couldn't be updated) and the number of trackdbs 'remaining' due after the run
+    """
+    started = time.time()
+    added_trackdbs = sync_schedule()
+    if added_trackdbs:
+        logger.info("{} trackdbs added to the schedule".format(added_trackdbs))
+
+    checked_trackdbs = 0
+    failed_trackdbs = 0
+    while max_trackdbs is None or checked_trackdbs < max_trackdbs:
+        if time_budget is not None and time.time() - started >= time_budget:
+            logger.info("Time budget of {} seconds used, stopping".format(time_budget))
+            break
+        batch_size = REFRESH_BATCH_SIZE
+        if max_trackdbs is not None:
+            batch_size = min(batch_size, max_trackdbs - checked_trackdbs)
+        trackdb_ids = claim_due_trackdbs(int(started), batch_size)
+        if not trackdb_ids:
+            break
+        # the documents of the batch are sent to Elasticsearch in bulk before the trackdbs are scheduled
+        for trackdb_id, outcome, _, _ in refresh_trackdbs(trackdb_ids):
+            check_failed = outcome == trackhubs.models.RefreshRunTrackdb.FAILED
+            checked_trackdbs += 1
+            failed_trackdbs += check_failed
+            schedule_next_check(trackdb_id, int(time.time()), check_failed)
+    url_check_cache.evict_cache()
+
+    return {
+        'checked': checked_trackdbs,
+        'failed': failed_trackdbs,
+        'remaining': trackhubs.models.TrackdbSchedule.objects.filter(next_check__lte=int(time.time())).count(),
+    }
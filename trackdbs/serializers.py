@@ -15,7 +15,7 @@ import time
 from datetime import datetime
 
 from rest_framework import serializers
-from trackhubs import models
+from trackhubs import models, reference_data
 
 
 class TrackdbHubSerializer(serializers.ModelSerializer):
@@ -117,7 +117,7 @@ class TrackdbSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_type(obj) -> str:
-        return models.DataType.objects.values_list('name', flat=True).get(data_type_id=obj.hub.data_type_id)
+        return reference_data.get_name(models.DataType, obj.hub.data_type_id)
 
     @staticmethod
     def get_hub(obj) -> dict:
@@ -11,52 +11,277 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import itertools
 import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+from django.db.models import Avg, Count, Max, Min
+
 import trackhubs
-from trackhubs.tracks_status import fetch_tracks_status
+from trackhubs import url_check_cache
+from trackhubs.es_bulk import BulkIndexer
+from trackhubs.tracks_status import fetch_tracks_status, save_tracks_status
 from thr.settings.base import ELASTICSEARCH_INDEX_NAMES
 
 logger = logging.getLogger(__name__)
 
+# number of trackdb ids loaded at once by update_all_trackdbs()
+TRACKDBS_CHUNK_SIZE = 1000
+# number of trackdbs updated by a worker before their documents are sent to Elasticsearch
+REFRESH_BATCH_SIZE = 50
+
+
+def parse_shard(shard):
+    """
+    :param shard: 'i/n' string, e.g. '0/4' is the first of four shards
+    :returns: (i, n) tuple
+    :raises ValueError: if the shard isn't valid
+    """
+    try:
+        shard_index, shard_count = (int(number) for number in shard.split('/'))
+    except (AttributeError, ValueError) as exp:
+        raise ValueError("shard should look like 'i/n' (e.g. '0/4'), got '{}'".format(shard)) from exp
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError("shard index should be between 0 and {}, got '{}'".format(shard_count - 1, shard))
+    return shard_index, shard_count
+
+
+def get_trackdb_id_range():
+    """
+    :returns: (min, max) tuple of the current trackdb ids, (None, None) if there is no trackdb
+    """
+    id_range = trackhubs.models.Trackdb.objects.aggregate(min_id=Min('trackdb_id'), max_id=Max('trackdb_id'))
+    return id_range['min_id'], id_range['max_id']
+
 
-def update_all_trackdbs():
+def get_trackdb_ids(shard=None, id_range=None):
+    """
+    :param shard: (i, n) tuple, the trackdb_id range is split in n equal parts and only the ith one is returned
+    :param id_range: (min, max) tuple of the trackdb_id range to split (default: the current one),
+    the trackdbs outside of it don't belong to any shard
+    :returns: queryset of the trackdb ids to update, in ascending order
+    """
+    trackdb_ids = trackhubs.models.Trackdb.objects.order_by('trackdb_id').values_list('trackdb_id', flat=True)
+    if shard is None:
+        return trackdb_ids
+    shard_index, shard_count = shard
+    min_id, max_id = id_range or get_trackdb_id_range()
+    if min_id is None:
+        return trackdb_ids
+    range_size = max_id - min_id + 1
+    start = min_id + range_size * shard_index // shard_count
+    end = min_id + range_size * (shard_index + 1) // shard_count
+    return trackdb_ids.filter(trackdb_id__gte=start, trackdb_id__lt=end)
+
+
+def iter_trackdb_ids(shard=None, after=None, chunk_size=TRACKDBS_CHUNK_SIZE, id_range=None):
+    """
+    Yield the trackdb ids in ascending order, chunk by chunk, so that the whole registry is never loaded
+    (each chunk is one indexed 'trackdb_id > last id' query)
+    :param shard: (i, n) tuple (see get_trackdb_ids())
+    :param after: only yield the ids greater than this one
+    :param chunk_size: number of ids per chunk
+    :param id_range: (min, max) tuple of the trackdb_id range split into shards (see get_trackdb_ids())
+    """
+    trackdb_ids = get_trackdb_ids(shard, id_range)
+    while True:
+        remaining_ids = trackdb_ids.filter(trackdb_id__gt=after) if after is not None else trackdb_ids
+        chunk = list(remaining_ids[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1]
+
+
+def _init_worker():
+    """
+    Forked workers must not use the database connections of the parent process,
+    new ones are opened on the first query
+    """
+    connections.close_all()
+
+
+def refresh_trackdb(trackdb_id, indexer=None):
+    """
+    Update one trackdb, errors are reported instead of stopping the whole run
+    :param indexer: es_bulk.BulkIndexer collecting the Elasticsearch update of the trackdb
+    :returns: (trackdb_id, outcome, error, duration in seconds) tuple
+    """
+    started = time.time()
+    error = None
+    try:
+        if update_one_trackdb(trackdb_id, indexer=indexer) is not None:
+            outcome = trackhubs.models.RefreshRunTrackdb.UPDATED
+        else:
+            outcome = trackhubs.models.RefreshRunTrackdb.NOT_FOUND
+    except Exception as exp:  # pylint: disable=broad-except
+        logger.exception("Failed to update trackdb {}".format(trackdb_id))
+        outcome = trackhubs.models.RefreshRunTrackdb.FAILED
+        error = repr(exp)
+    return trackdb_id, outcome, error, time.time() - started
+
+
+def refresh_trackdbs(trackdb_ids):
+    """
+    Update a batch of trackdbs, their Elasticsearch documents are sent together with the bulk API
+    :returns: list of refresh_trackdb() results, the trackdbs whose document couldn't be updated are failed
+    """
+    indexer = BulkIndexer()
+    results = [refresh_trackdb(trackdb_id, indexer) for trackdb_id in trackdb_ids]
+    failed_documents = {doc_id: error for (_, doc_id), error in indexer.flush().items()}
+    for result_number, (trackdb_id, _, _, duration) in enumerate(results):
+        if trackdb_id in failed_documents:
+            error = "Elasticsearch: {}".format(failed_documents[trackdb_id])
+            results[result_number] = (trackdb_id, trackhubs.models.RefreshRunTrackdb.FAILED, error, duration)
+    return results
+
+
+def get_refresh_run(shard=None, resume=False):
+    """
+    :param shard: (i, n) tuple of the run (see get_trackdb_ids())
+    :param resume: continue the last unfinished run of the same shard if there is one
+    :returns: the RefreshRun object
+    """
+    shard_label = '{}/{}'.format(*shard) if shard else None
+    if resume:
+        refresh_run = trackhubs.models.RefreshRun.objects.filter(
+            shard=shard_label, finished__isnull=True
+        ).order_by('-run_id').first()
+        if refresh_run is not None:
+            logger.info("Resuming refresh run {} after trackdb {}".format(
+                refresh_run.run_id, refresh_run.last_trackdb_id
+            ))
+            return refresh_run
+    return trackhubs.models.RefreshRun.objects.create(shard=shard_label, started=int(time.time()))
+
+
+def get_refresh_summary(refresh_run, slowest=5):
+    """
+    :param refresh_run: RefreshRun object
+    :param slowest: number of slowest trackdbs listed
+    :returns: dictionary with the number of trackdbs per outcome, the failures and the timings of the run
+    """
+    outcomes = trackhubs.models.RefreshRunTrackdb.objects.filter(run=refresh_run)
+    outcome_counts = dict(outcomes.values_list('outcome').annotate(total=Count('pk')).order_by())
+    finished = refresh_run.finished or int(time.time())
+    return {
+        'run_id': refresh_run.run_id,
+        'total': refresh_run.total,
+        'updated': outcome_counts.get(trackhubs.models.RefreshRunTrackdb.UPDATED, 0),
+        'not_found': outcome_counts.get(trackhubs.models.RefreshRunTrackdb.NOT_FOUND, 0),
+        'failed': list(
+            outcomes.filter(outcome=trackhubs.models.RefreshRunTrackdb.FAILED)
+            .order_by('trackdb_id').values('trackdb_id', 'error')
+        ),
+        'duration': finished - refresh_run.started,
+        'average_trackdb_duration': outcomes.aggregate(average=Avg('duration'))['average'],
+        'slowest': list(outcomes.order_by('-duration').values('trackdb_id', 'duration')[:slowest]),
+    }
+
+
+def update_all_trackdbs(workers=1, shard=None, resume=False):
     """
     This function will be executed automatically via cron.
     It checks and updates all trackdb (bigDataUrl) status
     both in ES and MySQL
+    The outcome of each trackdb is saved in the refresh_run_trackdb table as soon as it's processed
+    :param workers: number of processes updating the trackdbs at the same time
+    :param shard: (i, n) tuple, only update the ith of n shards of the trackdb_id range (see get_trackdb_ids())
+    so that several cron jobs or pods can share the work
+    :param resume: skip the trackdbs already processed by the last unfinished run of the same shard
+    :returns: the summary of the run (see get_refresh_summary())
     """
-    all_trackdbs = trackhubs.models.Trackdb.objects.all()
-    trackdbs_counter = 0
-    total_trackdbs = len(all_trackdbs)
-    for trackdb in all_trackdbs:
-        update_one_trackdb(trackdb.trackdb_id)
-        trackdbs_counter += 1
-        print(f"{trackdbs_counter}/{total_trackdbs} trackdbs enriched/processed", end='\r')
+    refresh_run = get_refresh_run(shard, resume)
+    id_range = None
+    if shard is not None:
+        # the shard boundaries are computed once, the trackdbs submitted in the meantime don't move them
+        if refresh_run.min_trackdb_id is None:
+            refresh_run.min_trackdb_id, refresh_run.max_trackdb_id = get_trackdb_id_range()
+            refresh_run.save(update_fields=['min_trackdb_id', 'max_trackdb_id'])
+        id_range = (refresh_run.min_trackdb_id, refresh_run.max_trackdb_id)
+    # the outcomes are saved in the order of the trackdb ids, so the run continues after the last saved one
+    trackdbs_counter = trackhubs.models.RefreshRunTrackdb.objects.filter(run=refresh_run).count()
+    total_trackdbs = get_trackdb_ids(shard, id_range).count()
+    refresh_run.total = total_trackdbs
+    refresh_run.save(update_fields=['total'])
+
+    if workers > 1:
+        # the connections are reopened by each worker
+        connections.close_all()
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=_init_worker
+        )
+    else:
+        executor = None
+
+    try:
+        for trackdb_ids in iter_trackdb_ids(shard, after=refresh_run.last_trackdb_id, id_range=id_range):
+            # each batch is updated by one worker and its documents are indexed with one bulk request
+            batches = [
+                trackdb_ids[start:start + REFRESH_BATCH_SIZE] for start in range(0, len(trackdb_ids), REFRESH_BATCH_SIZE)
+            ]
+            if executor is not None:
+                batches_results = executor.map(refresh_trackdbs, batches)
+            else:
+                batches_results = map(refresh_trackdbs, batches)
+            # the results come in the order of trackdb_ids
+            for trackdb_id, outcome, error, duration in itertools.chain.from_iterable(batches_results):
+                trackhubs.models.RefreshRunTrackdb.objects.create(
+                    run=refresh_run, trackdb_id=trackdb_id, outcome=outcome, error=error, duration=duration
+                )
+                refresh_run.last_trackdb_id = trackdb_id
+                refresh_run.save(update_fields=['last_trackdb_id'])
+                trackdbs_counter += 1
+                print(f"{trackdbs_counter}/{total_trackdbs} trackdbs enriched/processed", end='\r')
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    url_check_cache.evict_cache()
+    refresh_run.finished = int(time.time())
+    refresh_run.save(update_fields=['finished'])
     print(f"{total_trackdbs} trackdbs enriched")
+    refresh_summary = get_refresh_summary(refresh_run)
+    logger.info("Refresh run summary: {}".format(refresh_summary))
+    return refresh_summary
 
 
-def update_one_trackdb(trackdb_id):
+def update_one_trackdb(trackdb_id, indexer=None):
     """
     Update the status of one specific trackdb and enrich ES docs
+    :param indexer: es_bulk.BulkIndexer collecting the ES update, it's sent straight away if not provided
     """
     # Get es_index_name from settings
     es_index_name = ELASTICSEARCH_INDEX_NAMES['search.documents']
-    # Get the current trackdb object
-    one_trackdb = trackhubs.models.Trackdb.objects.filter(trackdb_id=trackdb_id).first()
+    # Get the current trackdb object, the big JSON columns (the previous status is replaced,
+    # the data and configuration aren't changed by a status check) aren't loaded
+    one_trackdb = trackhubs.models.Trackdb.objects.defer(
+        'configuration', 'data', 'status'
+    ).select_related('hub').filter(trackdb_id=trackdb_id).first()
     # Get all tracks belonging to the current trackdb object
+    # fetch_tracks_status() only reads their name and bigDataUrl, chunk by chunk
     all_tracks = trackhubs.models.Track.objects.filter(trackdb_id=trackdb_id)
 
     if one_trackdb:
         tracks_status = fetch_tracks_status(all_tracks, one_trackdb.source_url)
-        # Update the status JSON field in MySQL
-        one_trackdb.status = tracks_status
-        one_trackdb.save()
-        # Update ES document
-        one_trackdb.update_trackdb_document(
-            one_trackdb.hub, one_trackdb.data,
-            one_trackdb.configuration, tracks_status,
-            es_index_name
+        # record the result of each track, the summary is built from them
+        tracks_status = save_tracks_status(one_trackdb, tracks_status)
+        # Update the status JSON field in MySQL, with a query so that the Elasticsearch autosync
+        # doesn't load the deferred fields to index the whole document again
+        status_updated = int(time.time())
+        trackhubs.models.Trackdb.objects.filter(trackdb_id=trackdb_id).update(
+            status=tracks_status, status_updated=status_updated
         )
+        # Update ES document, its data and configuration are left as they are
+        one_trackdb.partial_update_trackdb_document({
+            **one_trackdb.hub.get_document_fields(),
+            **one_trackdb.get_extra_document_fields(),
+            'status': tracks_status,
+            'status_updated': status_updated,
+        }, es_index_name, indexer)
         logger.info("Status updated successfully: %s", tracks_status)
 
     return one_trackdb
@@ -14,13 +14,12 @@
 import elasticsearch
 from django.db import transaction
 from django.http import Http404
-from elasticsearch_dsl import connections
 from rest_framework import authentication, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from thr.settings import ELASTICSEARCH_DSL
 from trackdbs.serializers import TrackdbSerializer
+from trackhubs.es_client import get_es_client
 from trackhubs.models import Trackdb
 
 
@@ -62,10 +61,7 @@ class TrackdbDetail(APIView):
 
         if current_user_id == hub_original_owner_id:
             try:
-                es_conn = connections.Elasticsearch(
-                    [ELASTICSEARCH_DSL['default']['hosts']],
-                    verify_certs=True
-                )
+                es_conn = get_es_client()
                 es_conn.delete(index='trackhubs', id=trackdb.trackdb_id)
             except elasticsearch.exceptions.NotFoundError:
                 return Response(
@@ -17,3 +17,15 @@ from django.apps import AppConfig
 
 class TrackhubsConfig(AppConfig):
     name = 'trackhubs'
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel
+        from django.db.models.signals import post_delete, post_migrate, post_save
+        from trackhubs import reference_data
+
+        # fill DataType, FileType and Visibility once the database is migrated
+        post_migrate.connect(reference_data.seed_reference_data, sender=self)
+        # and reload their cached {name: id} maps whenever they change
+        for model, _ in reference_data.get_reference_models():
+            post_save.connect(reference_data.invalidate, sender=model)
+            post_delete.connect(reference_data.invalidate, sender=model)
@@ -0,0 +1,124 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import logging
+import time
+
+import elasticsearch
+from django.conf import settings
+from elasticsearch import helpers
+
+from trackhubs.es_client import get_es_client
+
+logger = logging.getLogger(__name__)
+
+# bulk item statuses worth retrying (the other errors, e.g. 404 document missing, won't go away)
+RETRY_STATUS_CODES = (429,)
+
+
+def is_retryable(status):
+    """
+    :param status: the status of a bulk item, it isn't a number if the whole request failed (e.g. connection error)
+    """
+    return not isinstance(status, int) or status in RETRY_STATUS_CODES or status >= 500
+
+
+class BulkIndexer:
+    """
+    Collect partial updates of trackdb documents and send them to Elasticsearch with the bulk API,
+    a request is sent every ES_BULK_BATCH_SIZE documents or ES_BULK_MAX_BYTES bytes
+
+    indexer = BulkIndexer()
+    trackdb.partial_update_trackdb_document({'status': ...}, index, indexer=indexer)
+    ...
+    failed_documents = indexer.flush()
+    """
+    def __init__(self, es_conn=None, batch_size=None, max_bytes=None):
+        self._es_conn = es_conn
+        self.batch_size = batch_size or settings.ES_BULK_BATCH_SIZE
+        self.max_bytes = max_bytes or settings.ES_BULK_MAX_BYTES
+        # (index, id) -> partial document, updates of the same document are merged
+        self._pending = {}
+        # (index, id) -> size of the merged partial document, the batch size is their sum
+        self._pending_sizes = {}
+        self._pending_bytes = 0
+        self.failed = {}
+
+    def get_connection(self):
+        return self._es_conn or get_es_client()
+
+    def add(self, index, doc_id, doc):
+        """
+        Queue a partial update of one document, the pending updates are sent if the batch is full
+        :param index: index name
+        :param doc_id: document id (the trackdb id)
+        :param doc: dictionary of the fields to update
+        """
+        key = (index, doc_id)
+        merged_doc = self._pending.setdefault(key, {})
+        merged_doc.update(doc)
+        # the merged document is what will be sent, it replaces the previous update of the same document
+        doc_size = len(json.dumps(merged_doc, default=str))
+        self._pending_bytes += doc_size - self._pending_sizes.get(key, 0)
+        self._pending_sizes[key] = doc_size
+        if len(self._pending) >= self.batch_size or self._pending_bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Send the pending updates, the documents rejected with a 429 or 5xx error (or lost with the whole request)
+        are sent again up to ES_BULK_MAX_RETRIES times with an exponential backoff
+        :returns: dictionary mapping the (index, id) of each document that couldn't be updated
+        since the indexer has been created to its error
+        """
+        pending, self._pending, self._pending_sizes, self._pending_bytes = self._pending, {}, {}, 0
+        attempt = 0
+        while pending:
+            actions = [
+                {'_op_type': 'update', '_index': index, '_id': doc_id, 'doc': doc}
+                for (index, doc_id), doc in pending.items()
+            ]
+            # the index of the results can be the real index behind an alias, so they're matched by id
+            keys_by_id = {str(doc_id): (index, doc_id) for index, doc_id in pending}
+            retry = {}
+            try:
+                results = helpers.streaming_bulk(
+                    self.get_connection(), actions,
+                    chunk_size=self.batch_size, max_chunk_bytes=self.max_bytes,
+                    raise_on_error=False, raise_on_exception=False, yield_ok=False,
+                    request_timeout=settings.ES_WRITE_TIMEOUT
+                )
+                for _, item in results:
+                    result = item['update']
+                    key = keys_by_id[str(result.get('_id'))]
+                    if is_retryable(result.get('status')) and attempt < settings.ES_BULK_MAX_RETRIES:
+                        retry[key] = pending[key]
+                    else:
+                        self.failed[key] = result.get('error')
+                        logger.error("Trackdb document {} couldn't be updated: {}".format(key[1], result.get('error')))
+            except elasticsearch.exceptions.ConnectionError as es_con_err:
+                logger.exception("There was an error while trying to connect to Elasticsearch. "
+                                 "Please make sure ES service is running and configured properly!"
+                                 " Reason: {}".format(es_con_err))
+                if attempt < settings.ES_BULK_MAX_RETRIES:
+                    retry = pending
+                else:
+                    self.failed.update({key: repr(es_con_err) for key in pending})
+
+            if retry:
+                time.sleep(settings.ES_BULK_BACKOFF * (2 ** attempt))
+                attempt += 1
+            pending = retry
+        return self.failed
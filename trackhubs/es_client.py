@@ -0,0 +1,47 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import threading
+
+import elasticsearch
+from django.conf import settings
+
+from thr.settings import ELASTICSEARCH_DSL
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_es_client():
+    """
+    Return the Elasticsearch client shared by the whole process
+    Its connections are pooled (ES_CLIENT_MAXSIZE per node) and reused by every request,
+    and the client is created again after a fork so that processes never share sockets
+    """
+    global _client, _client_pid  # pylint: disable=global-statement
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = elasticsearch.Elasticsearch(
+                    [ELASTICSEARCH_DSL['default']['hosts']],
+                    verify_certs=True,
+                    timeout=settings.ES_CLIENT_TIMEOUT,
+                    max_retries=settings.ES_CLIENT_MAX_RETRIES,
+                    retry_on_timeout=True,
+                    maxsize=settings.ES_CLIENT_MAXSIZE
+                )
+                _client_pid = os.getpid()
+    return _client
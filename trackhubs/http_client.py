@@ -0,0 +1,237 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import email.utils
+import ftplib
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# longer lines are yielded in pieces by Response
+MAX_LINE_LENGTH = 1024 * 1024
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the requests session shared by the whole process
+    Connections are kept alive and pooled per host, and the session is created again
+    after a fork so that processes never share sockets
+    """
+    global _session, _session_pid  # pylint: disable=global-statement
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                retry = Retry(
+                    total=settings.HTTP_MAX_RETRIES,
+                    backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+                    status_forcelist=RETRY_STATUS_CODES,
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                    max_retries=retry
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+                _session_pid = os.getpid()
+    return _session
+
+
+def get_timeout():
+    """
+    :returns: the (connect, read) timeout tuple used for every request
+    """
+    return settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT
+
+
+def get(url, **kwargs):
+    """
+    Send a GET request using the shared session
+    :param url: the URL to fetch
+    :param kwargs: any other requests argument (e.g. headers)
+    :returns: requests.Response object
+    """
+    kwargs.setdefault('timeout', get_timeout())
+    return get_session().get(url, **kwargs)
+
+
+class Response:
+    """
+    File like wrapper around requests.Response, it behaves like the object
+    returned by urllib.request.urlopen() (getcode(), read(), iterating over lines)
+    """
+    def __init__(self, response, chunk_size=64 * 1024, max_line_length=MAX_LINE_LENGTH):
+        self._response = response
+        self._chunk_size = chunk_size
+        self._max_line_length = max_line_length
+        self.headers = response.headers
+        self.url = response.url
+
+    def getcode(self):
+        return self._response.status_code
+
+    def read(self, amt=None):
+        if amt is None:
+            return self._response.content
+        return self._response.raw.read(amt, decode_content=True)
+
+    def __iter__(self):
+        """
+        Yield the body line by line (keeping the line endings) without loading it all in memory
+        A line longer than max_line_length is yielded in pieces without line ending (like readline(limit)),
+        so the size limits of the caller apply to the body read so far
+        """
+        pending = bytearray()
+        for chunk in self._response.iter_content(chunk_size=self._chunk_size):
+            # the pending bytes have already been searched for a line ending
+            search_start = len(pending)
+            pending += chunk
+            line_start = 0
+            line_end = pending.find(b'\n', search_start)
+            while line_end != -1:
+                yield bytes(pending[line_start:line_end + 1])
+                line_start = line_end + 1
+                line_end = pending.find(b'\n', line_start)
+            del pending[:line_start]
+            while len(pending) >= self._max_line_length:
+                yield bytes(pending[:self._max_line_length])
+                del pending[:self._max_line_length]
+        if pending:
+            yield bytes(pending)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def urlopen(url, method='GET', headers=None, timeout=None):
+    """
+    Open the given HTTP(S) or FTP URL, HTTP(S) requests go through the shared connection pool
+    Errors are raised as urllib.error.HTTPError/URLError whatever the scheme is
+    :param url: the URL to open
+    :param method: HTTP method (default: 'GET'), ignored for FTP
+    :param headers: additional HTTP headers
+    :param timeout: timeout in seconds (default: HTTP_CONNECT_TIMEOUT and HTTP_READ_TIMEOUT settings)
+    :returns: a file like response object, it should be closed (or used with 'with')
+    """
+    if not isinstance(url, str):
+        raise TypeError("url must be a string")
+
+    if url.lower().startswith('ftp://'):
+        return _ftp_open(url, timeout)
+
+    try:
+        response = get_session().request(method, url, headers=headers, stream=True, timeout=timeout or get_timeout())
+    except requests.exceptions.RequestException as exp:
+        raise urllib.error.URLError(exp) from exp
+
+    if response.status_code >= 400:
+        response.close()
+        raise urllib.error.HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return Response(response)
+
+
+def _ftp_open(url, timeout=None):
+    """
+    FTP isn't supported by requests, so urllib is used with the same timeout
+    and a bounded number of retries with exponential backoff
+    """
+    attempt = 0
+    while True:
+        try:
+            return urllib.request.urlopen(url, timeout=timeout or settings.HTTP_READ_TIMEOUT)
+        except urllib.error.URLError as exp:
+            # retry only temporary errors, e.g. not 'ftp error: 550 ...' (file not found)
+            if attempt >= settings.HTTP_MAX_RETRIES or 'error_perm' in str(exp.reason):
+                raise
+            time.sleep(settings.HTTP_BACKOFF_FACTOR * (2 ** attempt))
+            attempt += 1
+
+
+def _parse_mdtm(reply):
+    """
+    Convert an FTP MDTM reply (e.g. '213 20200101120000') to an HTTP date (e.g. 'Wed, 01 Jan 2020 12:00:00 GMT')
+    """
+    try:
+        modified = datetime.strptime(reply.split()[1][:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+    except (IndexError, ValueError):
+        return None
+    return email.utils.format_datetime(modified, usegmt=True)
+
+
+def ftp_probe(url, timeout=None):
+    """
+    Ask the FTP server for the size (SIZE) and modification time (MDTM) of a file without downloading it,
+    servers that don't support SIZE get a regular download request which is closed straight away
+    Errors are raised as urllib.error.URLError like urllib does
+    :param url: the ftp:// URL of the file
+    :param timeout: timeout in seconds (default: HTTP_READ_TIMEOUT setting)
+    :returns: dictionary with the 'content_length' and 'last_modified' (HTTP date) of the file, if known
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = urllib.parse.unquote(parts.path)
+    attempt = 0
+    while True:
+        try:
+            with ftplib.FTP(timeout=timeout or settings.HTTP_READ_TIMEOUT) as ftp:
+                ftp.connect(parts.hostname, parts.port or ftplib.FTP_PORT)
+                ftp.login(urllib.parse.unquote(parts.username or 'anonymous'), urllib.parse.unquote(parts.password or ''))
+                # SIZE is only reliable in binary mode
+                ftp.voidcmd('TYPE I')
+                content_length = ftp.size(path)
+                try:
+                    last_modified = _parse_mdtm(ftp.sendcmd('MDTM ' + path))
+                except ftplib.error_perm:
+                    last_modified = None
+                return {'content_length': content_length, 'last_modified': last_modified}
+        except ftplib.error_perm as exp:
+            if str(exp).startswith(('500', '502')):
+                # SIZE isn't supported by this server
+                with _ftp_open(url, timeout):
+                    return {'content_length': None, 'last_modified': None}
+            # e.g. '550 Failed to change directory.' (file not found), not worth retrying
+            raise urllib.error.URLError('ftp error: {!r}'.format(exp)) from exp
+        except (ftplib.Error, OSError, EOFError) as exp:
+            if attempt >= settings.HTTP_MAX_RETRIES:
+                raise urllib.error.URLError('ftp error: {!r}'.format(exp)) from exp
+            time.sleep(settings.HTTP_BACKOFF_FACTOR * (2 ** attempt))
+            attempt += 1
@@ -12,12 +12,22 @@
    limitations under the License.
 """
 
+import logging
+import os
 import subprocess
 import sys
+import threading
+import time
 from pathlib import Path
 
+import requests
 from django.conf import settings
 
+from trackhubs import http_client
+from trackhubs.models import HubCheckResult
+
+logger = logging.getLogger(__name__)
+
 
 HUBCHECK_PATH = settings.BASE_DIR.parent / "tools" / "hubCheck"
 HUBCHECK_DOWNLOAD_URLS = {
@@ -40,15 +50,101 @@ def _ensure_hubcheck_binary():
         return {"error": "hubCheck is not available for platform '{}'".format(sys.platform)}
 
     hubcheck.parent.mkdir(parents=True, exist_ok=True)
+    # the binary is written next to its final path then moved, so that a process never runs a partial download
+    partial_download = hubcheck.with_name('{}.{}.part'.format(hubcheck.name, os.getpid()))
     try:
-        subprocess.run(["curl", "-L", "-o", str(hubcheck), download_url], check=True)
-        hubcheck.chmod(0o700)
-    except (OSError, subprocess.CalledProcessError) as exc:
+        with http_client.get(download_url, stream=True) as response:
+            response.raise_for_status()
+            with open(partial_download, 'wb') as hubcheck_file:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    hubcheck_file.write(chunk)
+        partial_download.chmod(0o700)
+        os.replace(partial_download, hubcheck)
+    except (OSError, requests.exceptions.RequestException) as exc:
+        partial_download.unlink(missing_ok=True)
         return {"error": "Couldn't download hubCheck: {}".format(exc)}
 
     return None
 
 
+# hubCheck processes are limited to HUBCHECK_MAX_PROCESSES slots shared by the whole process
+_slots = None
+_slots_key = None
+_metrics_lock = threading.Lock()
+_metrics = {
+    'waiting': 0,
+    'running': 0,
+    'runs': 0,
+    'timeouts': 0,
+    'total_run_time': 0.0,
+    'max_run_time': 0.0,
+}
+
+
+def _get_slots():
+    """
+    Return the semaphore limiting the number of hubCheck processes, it's created again
+    after a fork or if HUBCHECK_MAX_PROCESSES setting has changed
+    """
+    global _slots, _slots_key  # pylint: disable=global-statement
+    slots_key = (os.getpid(), settings.HUBCHECK_MAX_PROCESSES)
+    with _metrics_lock:
+        if _slots is None or _slots_key != slots_key:
+            _slots = threading.BoundedSemaphore(settings.HUBCHECK_MAX_PROCESSES)
+            _slots_key = slots_key
+        return _slots
+
+
+def _update_metrics(**increments):
+    with _metrics_lock:
+        for name, increment in increments.items():
+            _metrics[name] += increment
+
+
+def get_hub_check_metrics():
+    """
+    :returns: dictionary with the number of hubCheck runs 'waiting' for a free slot (queue depth),
+    'running', done ('runs') and killed ('timeouts') plus their 'total_run_time',
+    'max_run_time' and 'average_run_time' in seconds
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics['average_run_time'] = metrics['total_run_time'] / metrics['runs'] if metrics['runs'] else 0.0
+    return metrics
+
+
+def run_hubcheck_process(hub_url):
+    """
+    Run the hubCheck binary once a slot is free, the process is killed if it takes more than
+    HUBCHECK_TIMEOUT seconds
+    :param hub_url: the hub url provided by the submitter
+    :returns: the completed process
+    :raises subprocess.TimeoutExpired: if the process has been killed
+    """
+    slots = _get_slots()
+    _update_metrics(waiting=1)
+    with slots:
+        _update_metrics(waiting=-1, running=1)
+        start = time.monotonic()
+        try:
+            return subprocess.run(
+                [str(HUBCHECK_PATH), "-noTracks", hub_url],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                timeout=settings.HUBCHECK_TIMEOUT,
+            )
+        finally:
+            run_time = time.monotonic() - start
+            with _metrics_lock:
+                _metrics['running'] -= 1
+                _metrics['runs'] += 1
+                _metrics['total_run_time'] += run_time
+                _metrics['max_run_time'] = max(_metrics['max_run_time'], run_time)
+            logger.info("hubCheck on {} took {:.2f} seconds ({} waiting for a slot)".format(
+                hub_url, run_time, _metrics['waiting']))
+
+
 def hub_check(hub_url):
     """
     Runs the UCSC hubCheck tool on the submitted hub
@@ -62,12 +158,13 @@ def hub_check(hub_url):
 
     print("[INFO] Checking " + hub_url + "...")
     try:
-        hub_check_result = subprocess.run(
-            [str(HUBCHECK_PATH), "-noTracks", hub_url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        )
+        hub_check_result = run_hubcheck_process(hub_url)
+    except subprocess.TimeoutExpired:
+        _update_metrics(timeouts=1)
+        return {
+            'error': 'hubCheck timed out after {} seconds on hub {}'.format(settings.HUBCHECK_TIMEOUT, hub_url),
+            'details': [],
+        }
     except OSError as exc:
         return {"error": "Couldn't run hubCheck: {}".format(exc)}
 
@@ -101,3 +198,44 @@ def hub_check(hub_url):
     return {
         'success': 'hubCheck done! Nothing to report!'
     }
+
+
+def get_cached_hub_check(hub_url, checksum):
+    """
+    :param hub_url: the hub url provided by the submitter
+    :param checksum: checksum of the hub, genomes and trackDb files content
+    :returns: the cached hubCheck result of this exact content or None if it has to be checked
+    """
+    cached_result = HubCheckResult.objects.filter(
+        hub_url=hub_url, checksum=checksum, created__gte=int(time.time()) - settings.HUBCHECK_CACHE_TTL
+    ).first()
+    return cached_result.result if cached_result else None
+
+
+def cache_hub_check(hub_url, checksum, result):
+    """
+    Keep the hubCheck result of the given content, errors aren't cached since they can be temporary
+    (e.g. the remote server is down)
+    :param hub_url: the hub url provided by the submitter
+    :param checksum: checksum of the hub, genomes and trackDb files content
+    :param result: the result returned by hub_check()
+    """
+    if 'error' in result:
+        return
+    HubCheckResult.objects.update_or_create(
+        hub_url=hub_url, checksum=checksum,
+        defaults={'result': result, 'created': int(time.time())}
+    )
+    # the results of the previous contents of the hub won't be used again
+    HubCheckResult.objects.filter(hub_url=hub_url).exclude(checksum=checksum).delete()
+
+
+def purge_hub_check_cache(expired_only=True):
+    """
+    :param expired_only: delete only the results older than HUBCHECK_CACHE_TTL, otherwise delete them all
+    :returns: the number of deleted results
+    """
+    results = HubCheckResult.objects.all()
+    if expired_only:
+        results = results.filter(created__lt=int(time.time()) - settings.HUBCHECK_CACHE_TTL)
+    return results.delete()[0]
@@ -0,0 +1,190 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from trackhubs import http_client
+
+logger = logging.getLogger(__name__)
+
+# Each cached file starts with one JSON line holding the URL, ETag and Last-Modified
+# followed by the body, so metadata and body are always replaced together
+
+
+def get_cache_path(url):
+    """
+    :returns: the path of the cached copy of the given url
+    """
+    return Path(settings.HUB_FILES_CACHE_DIR) / hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def read_cache_metadata(cache_path):
+    """
+    :returns: the metadata stored in the cached file or None if there isn't a valid one
+    """
+    try:
+        with open(cache_path, 'rb') as cached_file:
+            return json.loads(cached_file.readline())
+    except (OSError, ValueError):
+        return None
+
+
+class CachedFile:
+    """
+    File like object reading the body of a cached file (the metadata line is skipped)
+    """
+    def __init__(self, cache_path):
+        self._file = open(cache_path, 'rb')  # pylint: disable=consider-using-with
+        self._file.readline()
+
+    def getcode(self):
+        return 200
+
+    def read(self, amt=None):
+        return self._file.read() if amt is None else self._file.read(amt)
+
+    def readline(self, limit=-1):
+        return self._file.readline(limit)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class CachingResponse:
+    """
+    Wrap a remote response and write its body to the cache while it's being read
+    The cached copy is kept only if the whole body has been read
+    """
+    def __init__(self, response, cache_path, metadata):
+        self._response = response
+        self._cache_path = cache_path
+        self._metadata = metadata
+
+    def getcode(self):
+        return self._response.getcode()
+
+    def __iter__(self):
+        cache_dir = self._cache_path.parent
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                tmp_file.write(json.dumps(self._metadata).encode('utf-8') + b'\n')
+                for line in self._response:
+                    tmp_file.write(line)
+                    yield line
+            os.replace(tmp_path, self._cache_path)
+            evict_cache()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def read(self, amt=None):
+        return b''.join(self) if amt is None else self._response.read(amt)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def urlopen(url):
+    """
+    Open a hub, genomes or trackDb file, reusing the cached copy if the remote
+    server answers '304 Not Modified' to a conditional request
+    FTP files and responses without ETag or Last-Modified headers aren't cached
+    :param url: the file url
+    :returns: a file like response object
+    """
+    if not settings.HUB_FILES_CACHE_DIR or not isinstance(url, str) or url.lower().startswith('ftp://'):
+        return http_client.urlopen(url)
+
+    cache_path = get_cache_path(url)
+    metadata = read_cache_metadata(cache_path)
+    headers = {}
+    if metadata and metadata.get('url') == url:
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    response = http_client.urlopen(url, headers=headers or None)
+    if response.getcode() == 304 and headers:
+        response.close()
+        logger.debug("'{}' not modified, using the cached copy".format(url))
+        try:
+            # the modification time is used to evict the least recently used files
+            os.utime(cache_path)
+            return CachedFile(cache_path)
+        except OSError:
+            # the cached copy has been evicted in the meantime
+            return http_client.urlopen(url)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return response
+    return CachingResponse(response, cache_path, {'url': url, 'etag': etag, 'last_modified': last_modified})
+
+
+def evict_cache(max_size=None):
+    """
+    Delete the least recently used cached files until the cache directory
+    is smaller than max_size bytes
+    :param max_size: maximum size of the cache (default: HUB_FILES_CACHE_MAX_SIZE setting)
+    :returns: the number of deleted files
+    """
+    max_size = max_size or settings.HUB_FILES_CACHE_MAX_SIZE
+    cached_files = []
+    for cache_path in Path(settings.HUB_FILES_CACHE_DIR).glob('[!.]*'):
+        try:
+            stat = cache_path.stat()
+        except OSError:
+            continue
+        cached_files.append((stat.st_mtime, stat.st_size, cache_path))
+
+    total_size = sum(size for _, size, _ in cached_files)
+    deleted_files = 0
+    for _, size, cache_path in sorted(cached_files):
+        if total_size <= max_size:
+            break
+        try:
+            cache_path.unlink()
+        except OSError:
+            continue
+        total_size -= size
+        deleted_files += 1
+    return deleted_files
@@ -0,0 +1,193 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+import trackhubs.translator
+from trackhubs.hub_check import get_hub_check_metrics
+from trackhubs.models import Hub, SubmissionJob
+
+logger = logging.getLogger(__name__)
+
+
+def submit_hub(hub_url, data_type, current_user, run_hubcheck=True, refresh_status=False):
+    """
+    Queue a hub submission, the hub is processed later on by the
+    'process_submissions' management command
+    If the same user has already submitted the hub and the job isn't done yet, that job is returned instead
+    so that the hub is never processed twice at the same time, a pending job takes the parameters
+    of the latest submission
+    :param hub_url: the hub url provided by the submitter
+    :param data_type: the data type provided by the user (if any, default is 'genomics')
+    :param current_user: the submitter (current user)
+    :param run_hubcheck: run hubCheck utility or not (default is True)
+    :param refresh_status: check the tracks status of the unchanged trackDb files too (default is False)
+    :returns: the new created job or the job already queued for the hub
+    """
+    with transaction.atomic():
+        job = (
+            SubmissionJob.objects.select_for_update()
+            .filter(hub_url=hub_url, owner=current_user, status__in=[SubmissionJob.PENDING, SubmissionJob.RUNNING])
+            .order_by('job_id')
+            .first()
+        )
+        if job is None:
+            return SubmissionJob.objects.create(
+                hub_url=hub_url,
+                data_type=data_type,
+                run_hubcheck=run_hubcheck,
+                refresh_status=refresh_status,
+                owner=current_user,
+                created=int(time.time()),
+                updated=int(time.time())
+            )
+        if job.status == SubmissionJob.PENDING:
+            job.data_type = data_type
+            job.run_hubcheck = run_hubcheck
+            job.refresh_status = refresh_status
+            job.save(update_fields=['data_type', 'run_hubcheck', 'refresh_status'])
+        logger.info("Hub {} is already queued as job {}".format(hub_url, job.job_id))
+        return job
+
+
+def claim_next_job():
+    """
+    Take the oldest pending job and mark it as running, the row is locked (and skipped by
+    the other workers) so the same job is never processed twice
+    A running job that hasn't been updated for SUBMISSION_JOB_LEASE seconds belongs to a worker
+    that died, it's claimed again unless it has already been tried SUBMISSION_JOB_MAX_ATTEMPTS times
+    :returns: the claimed job or None if there is nothing to process
+    """
+    while True:
+        now = int(time.time())
+        with transaction.atomic():
+            job = (
+                SubmissionJob.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=SubmissionJob.PENDING)
+                    | Q(status=SubmissionJob.RUNNING, updated__lt=now - settings.SUBMISSION_JOB_LEASE)
+                )
+                .order_by('job_id')
+                .first()
+            )
+            if job is None:
+                return None
+            if job.status == SubmissionJob.RUNNING:
+                logger.warning("Job {} was abandoned by its worker during the '{}' stage".format(job.job_id, job.stage))
+                if job.attempts >= settings.SUBMISSION_JOB_MAX_ATTEMPTS:
+                    job.status = SubmissionJob.FAILED
+                    job.result = {
+                        'error': 'The hub submission was interrupted {} times, please try again later'.format(
+                            job.attempts
+                        )
+                    }
+                    job.updated = now
+                    job.save(update_fields=['status', 'result', 'updated'])
+                    continue
+            job.status = SubmissionJob.RUNNING
+            job.attempts += 1
+            job.started = now
+            job.updated = now
+            job.save(update_fields=['status', 'attempts', 'started', 'updated'])
+        return job
+
+
+def keep_lease(job, stop_event):
+    """
+    Renew the lease of the running job every third of SUBMISSION_JOB_LEASE until stop_event is set,
+    so that a long stage (e.g. fetching a big hub) doesn't let another worker claim the job
+    It runs in its own thread, with its own database connection
+    :param job: the running job
+    :param stop_event: threading.Event set once the job is done
+    """
+    try:
+        while not stop_event.wait(settings.SUBMISSION_JOB_LEASE / 3):
+            if not job.renew_lease():
+                logger.warning("Job {} has been claimed by another worker".format(job.job_id))
+                return
+    finally:
+        connection.close()
+
+
+def run_job(job):
+    """
+    Run the whole submission pipeline for the given job and store the result
+    in the same shape returned by save_and_update_document()
+    :param job: the job to process
+    :returns: the job once it's done or failed
+    """
+    logger.info("Processing job {} ({})".format(job.job_id, job.hub_url))
+    existing_hub_obj = trackhubs.translator.is_hub_exists(job.hub_url)
+    hub_existed = existing_hub_obj is not None
+    stop_event = threading.Event()
+    lease_thread = threading.Thread(target=keep_lease, args=(job, stop_event), daemon=True)
+    lease_thread.start()
+    try:
+        if hub_existed and existing_hub_obj.owner_id != job.owner_id:
+            # the hub has been registered by another user since it was submitted
+            result = {"error": "This hub is already submitted by a different user!"}
+        else:
+            result = trackhubs.translator.save_and_update_document(
+                job.hub_url, job.data_type, job.owner, job.run_hubcheck,
+                progress_callback=job.update_progress,
+                refresh_status=job.refresh_status
+            )
+        if not result:
+            result = {
+                'error': 'Something went wrong with the hub submission, please make sure that url is correct and working'
+            }
+    except SubmissionJob.LeaseLost:
+        # the other worker is processing the hub, it owns the result
+        logger.warning("Job {} has been claimed by another worker, giving up".format(job.job_id))
+        return job
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("Job {} failed".format(job.job_id))
+        # a new hub shouldn't be left half registered
+        if not hub_existed:
+            Hub.objects.filter(url=job.hub_url).delete()
+        result = {'error': 'An internal error has occurred: {}'.format(exc)}
+    finally:
+        stop_event.set()
+        lease_thread.join()
+
+    job.status = SubmissionJob.FAILED if 'error' in result else SubmissionJob.DONE
+    job.stage = 'done'
+    job.result = result
+    job.updated = int(time.time())
+    # the result isn't saved if the job has been claimed again by another worker in the meantime
+    SubmissionJob.objects.filter(job_id=job.job_id, attempts=job.attempts).update(
+        status=job.status, stage=job.stage, result=job.result, updated=job.updated
+    )
+    logger.info("Job {} {}, hubCheck metrics: {}".format(job.job_id, job.status, get_hub_check_metrics()))
+    return job
+
+
+def process_pending_jobs():
+    """
+    Process pending jobs one after the other until the queue is empty
+    :returns: the number of processed jobs
+    """
+    processed_jobs = 0
+    job = claim_next_job()
+    while job is not None:
+        run_job(job)
+        processed_jobs += 1
+        job = claim_next_job()
+    return processed_jobs
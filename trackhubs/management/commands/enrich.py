@@ -11,22 +11,49 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import logging
 import sys
 from argparse import RawTextHelpFormatter
 
-from django.core.management.base import BaseCommand
-import logging
+from django.core import management
+from django.core.management.base import BaseCommand, CommandError
 
-from trackdbs.update_trackdb import update_all_trackdbs, update_one_trackdb
+from trackdbs.update_trackdb import parse_shard, update_all_trackdbs, update_one_trackdb
 from trackhubs.tracks_status import fetch_tracks_status
 import trackhubs.models
-from django.core import management
 
 logger = logging.getLogger(__name__)
 # show logs in the console
 # logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
 
+def get_shard(shard):
+    """
+    :returns: the (i, n) tuple of the --shard option or None if it isn't set
+    """
+    if shard is None:
+        return None
+    try:
+        return parse_shard(shard)
+    except ValueError as exp:
+        raise CommandError(str(exp)) from exp
+
+
+def write_refresh_summary(command, refresh_summary):
+    """
+    Print the summary returned by update_all_trackdbs()
+    """
+    command.stdout.write(
+        "Run {run_id}: {total} trackdbs, {updated} updated, {not_found} not found, {failed} failed in {duration}s".format(
+            **dict(refresh_summary, failed=len(refresh_summary['failed']))
+        )
+    )
+    for failure in refresh_summary['failed']:
+        command.stdout.write(command.style.ERROR("Trackdb {trackdb_id} failed: {error}".format(**failure)))
+    for slow_trackdb in refresh_summary['slowest']:
+        command.stdout.write("Trackdb {trackdb_id} took {duration:.1f}s".format(**slow_trackdb))
+
+
 class Command(BaseCommand):
     help = """
         Update trackdb (bigDataUrl) status both in ES and MySQL
@@ -38,6 +65,12 @@ class Command(BaseCommand):
             $ python manage.py enrich 10001
             # Update status of all trackdbs
             $ python manage.py enrich all
+            # Update status of all trackdbs using 8 processes
+            $ python manage.py enrich all --workers 8
+            # Update status of the second half of the trackdbs (e.g. in the second of two cron jobs)
+            $ python manage.py enrich all --shard 1/2
+            # Continue the last run that has been interrupted
+            $ python manage.py enrich all --resume
         
         Trackdb Examples:
             LNCipedia 3.1: Remote Data Unavailable
@@ -60,6 +93,24 @@ class Command(BaseCommand):
             type=str,
             help="Update trackdb status by providing the <id> or 'all' \nif you want to update all trackdbs status",
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Number of processes updating the trackdbs at the same time (default: 1)",
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            default=None,
+            help="Only update the ith of n equal parts of the trackdb_id range, e.g. '0/4' for the first quarter\n"
+                 "so that several jobs can share the work",
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help="Continue the last interrupted run (of the same shard) instead of starting from the first trackdb",
+        )
 
     def handle(self, *args, **options):
         # uncomment the line below if you want to rebuild and enrich the index at the same time
@@ -69,7 +120,10 @@ class Command(BaseCommand):
         # Get the trackdb ID if provided
         trackdb_id = options['trackdb_id']
         if options['trackdb_id'].lower() == 'all':
-            update_all_trackdbs()
+            refresh_summary = update_all_trackdbs(
+                workers=options['workers'], shard=get_shard(options['shard']), resume=options['resume']
+            )
+            write_refresh_summary(self, refresh_summary)
             self.stdout.write(self.style.SUCCESS('All TrackDB are updated successfully!'))
         else:
             # Update one specific trackdb
@@ -13,11 +13,13 @@
 """
 
 import json
-import requests
 import time
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from argparse import RawTextHelpFormatter
+from trackhubs import http_client
+from trackhubs.translator import clear_assembly_info_cache
 from trackhubs.models import GenomeAssemblyDump
 from trackhubs.constants import INSDC_TO_UCSC
 
@@ -61,6 +63,8 @@ def import_ena_dump(filepath):
                     genome_assembly_dump_list = []
 
             GenomeAssemblyDump.objects.bulk_create(genome_assembly_dump_list)
+            # the other processes notice the reload within GENOME_ASSEMBLY_CACHE_TTL seconds
+            clear_assembly_info_cache()
 
             return len(data_list)
 
@@ -87,7 +91,11 @@ def fetch_assembly(assembly_source, assembly_url):
     try:
         start = time.time()
 
-        response = requests.get(assembly_url, headers={'Accept': 'application/json'})
+        # the whole ENA dump is sent in one response, hence the longer read timeout
+        response = http_client.get(
+            assembly_url, headers={'Accept': 'application/json'},
+            timeout=(settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT * 10)
+        )
         with open('assemblies_dump/'+assembly_source.lower()+'_assembly.json', 'w') as outf:
             # pretty print to JSON file
             outf.write(json.dumps(response.json(), indent=4))
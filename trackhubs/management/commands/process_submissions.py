@@ -0,0 +1,72 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import time
+from argparse import RawTextHelpFormatter
+import logging
+
+from django.core.management.base import BaseCommand
+
+from trackhubs.jobs import process_pending_jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = """
+        Process the hubs submitted using POST/PUT /api/trackhub
+        Several workers can run at the same time, each job is processed only once
+
+        Usage:
+            # Keep processing submissions as they arrive
+            $ python manage.py process_submissions
+            # Process the pending submissions then exit
+            $ python manage.py process_submissions --once
+    """
+
+    def create_parser(self, *args, **kwargs):
+        """
+        Insert newline in the help text
+        See: https://stackoverflow.com/a/35470682/4488332
+        """
+        parser = super().create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Process the pending submissions then exit",
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help="Seconds to wait before checking for new submissions (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed_jobs = process_pending_jobs()
+            self.stdout.write(self.style.SUCCESS(f"{processed_jobs} submission(s) processed"))
+            return
+
+        self.stdout.write(self.style.SUCCESS('Waiting for submissions...'))
+        while True:
+            processed_jobs = process_pending_jobs()
+            if processed_jobs:
+                logger.info("%s submission(s) processed", processed_jobs)
+            else:
+                time.sleep(options['sleep'])
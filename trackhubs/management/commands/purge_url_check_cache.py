@@ -0,0 +1,51 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from argparse import RawTextHelpFormatter
+
+from django.core.management.base import BaseCommand
+
+from trackhubs.url_check_cache import purge_cache
+
+
+class Command(BaseCommand):
+    help = """
+        Delete the cached bigDataUrl check results (see URL_CHECK_CACHE_TTL setting)
+
+        Usage:
+            # Delete the expired results
+            $ python manage.py purge_url_check_cache
+            # Delete all the results, every bigDataUrl will be checked again
+            $ python manage.py purge_url_check_cache --all
+    """
+
+    def create_parser(self, *args, **kwargs):
+        """
+        Insert newline in the help text
+        See: https://stackoverflow.com/a/35470682/4488332
+        """
+        parser = super().create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Delete all the results, not only the expired ones",
+        )
+
+    def handle(self, *args, **options):
+        deleted_results = purge_cache(expired_only=not options['all'])
+        self.stdout.write(self.style.SUCCESS(f"{deleted_results} cached url check results deleted"))
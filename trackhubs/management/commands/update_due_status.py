@@ -0,0 +1,63 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from argparse import RawTextHelpFormatter
+
+from django.core.management.base import BaseCommand
+
+from trackdbs.scheduler import update_due_trackdbs
+
+
+class Command(BaseCommand):
+    help = """
+        Update the status of the trackdbs that are due, each trackdb is checked again according to
+        its owner's check_interval (automatic, weekly or monthly), broken trackdbs more often
+        and trackdbs that haven't changed for a long time less often (see STATUS_CHECK_* settings)
+        This command is meant to be executed frequently (e.g. every hour) via cronjob
+
+        Usage:
+            # Update the status of all the trackdbs that are due
+            $ python manage.py update_due_status
+            # Update at most 500 trackdbs and stop picking new ones after 30 minutes
+            $ python manage.py update_due_status --max-trackdbs 500 --time-budget 1800
+    """
+
+    def create_parser(self, *args, **kwargs):
+        """
+        Insert newline in the help text
+        See: https://stackoverflow.com/a/35470682/4488332
+        """
+        parser = super().create_parser(*args, **kwargs)
+        parser.formatter_class = RawTextHelpFormatter
+        return parser
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-trackdbs',
+            type=int,
+            default=None,
+            help="Maximum number of trackdbs checked by this run",
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=int,
+            default=None,
+            help="Stop picking new trackdbs after this number of seconds",
+        )
+
+    def handle(self, *args, **options):
+        result = update_due_trackdbs(max_trackdbs=options['max_trackdbs'], time_budget=options['time_budget'])
+        self.stdout.write(self.style.SUCCESS(
+            "{checked} trackdbs checked ({failed} failed), {remaining} trackdbs still due".format(**result)
+        ))
@@ -16,6 +16,7 @@ from argparse import RawTextHelpFormatter
 import logging
 from django.core.management.base import BaseCommand
 from trackdbs.update_trackdb import update_all_trackdbs
+from trackhubs.management.commands.enrich import get_shard, write_refresh_summary
 
 logger = logging.getLogger(__name__)
 # show logs in the console
@@ -30,6 +31,12 @@ class Command(BaseCommand):
         Usage:
             # Update status of all trackdbs
             $ python manage.py update_status
+            # Update status of all trackdbs using 8 processes
+            $ python manage.py update_status --workers 8
+            # Update status of the first of four parts of the trackdbs (e.g. in a k8s indexed Job)
+            $ python manage.py update_status --shard 0/4
+            # Continue the last run that has been interrupted
+            $ python manage.py update_status --resume
     """
 
     def create_parser(self, *args, **kwargs):
@@ -41,10 +48,32 @@ class Command(BaseCommand):
         parser.formatter_class = RawTextHelpFormatter
         return parser
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Number of processes updating the trackdbs at the same time (default: 1)",
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            default=None,
+            help="Only update the ith of n equal parts of the trackdb_id range, e.g. '0/4' for the first quarter\n"
+                 "so that several jobs can share the work",
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help="Continue the last interrupted run (of the same shard) instead of starting from the first trackdb",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Updating all trackdbs status...'))
-        # update_all_trackdbs is SLOW, TODO: find a way to speed it up
-        update_all_trackdbs()
+        refresh_summary = update_all_trackdbs(
+            workers=options['workers'], shard=get_shard(options['shard']), resume=options['resume']
+        )
+        write_refresh_summary(self, refresh_summary)
         self.stdout.write(self.style.SUCCESS('All TrackDB status are updated successfully!'))
 
 
@@ -17,19 +17,17 @@ import sys
 from datetime import datetime
 import logging
 import time
-import hashlib
 
-import requests
 from django.conf import settings
 from django.db import models
 from django.db.models import Count
 from django_elasticsearch_dsl_drf.wrappers import dict_to_obj
 import elasticsearch
-from elasticsearch_dsl import connections
 
-from thr.settings import ELASTICSEARCH_DSL
 from users.models import CustomUser as User
 import trackhubs
+from trackhubs import http_client, reference_data
+from trackhubs.es_client import get_es_client
 from trackhubs.utils import remove_html_tags
 logger = logging.getLogger(__name__)
 
@@ -89,6 +87,24 @@ class Hub(models.Model):
         # return User.objects.filter(id=self.owner_id)
         return User.objects.values_list('username', flat=True).get(id=self.owner_id)
 
+    def get_document_fields(self):
+        """
+        Fields of the trackdb documents that come from the hub, they're pushed to every trackdb of the hub
+        when it's resubmitted since they can change even if the trackDb files don't
+        """
+        return {
+            'type': reference_data.get_name(DataType, self.data_type_id),
+            'hub': {
+                'name': self.name,
+                'shortLabel': self.shortLabel,
+                'longLabel': self.longLabel,
+                'url': self.url,
+                'description_url': self.description_url,
+                'email': self.email,
+            },
+            'owner': self.get_owner(),
+        }
+
     def count_trackdbs_in_hub(self):
         return Trackdb.objects.filter(hub_id=self.hub_id).count()
 
@@ -176,6 +192,8 @@ class Trackdb(models.Model):
     version = models.CharField(default="v1.0", max_length=10)
     created = models.IntegerField(default=int(time.time()))
     updated = models.IntegerField(null=True)
+    # last time the tracks status was checked, the status checks don't change 'updated'
+    status_updated = models.IntegerField(null=True)
     configuration = models.JSONField(null=True)
     data = models.JSONField(null=True)
     status = models.JSONField(null=True)
@@ -195,7 +213,7 @@ class Trackdb(models.Model):
         Data type for indexing.
         Used in Elasticsearch indexing.
         """
-        return self.hub.data_type.name
+        return reference_data.get_name(DataType, self.hub.data_type_id)
 
     @property
     def species_indexing(self):
@@ -400,7 +418,7 @@ class Trackdb(models.Model):
 
             # Look up division using Ensembl Rest API by using providing the assembly accession
             assembly_info_url = 'https://rest.ensembl.org/info/genomes/assembly/' + assembly_accession + ''
-            assembly_info_response = requests.get(assembly_info_url, headers={'Accept': 'application/json'}, verify=True)
+            assembly_info_response = http_client.get(assembly_info_url, headers={'Accept': 'application/json'})
 
             # genome_division can be: 'EnsemblVertebrates', 'EnsemblProtists', 'EnsemblMetazoa',
             # 'EnsemblPlants', 'EnsemblFungi' or 'EnsemblBacteria'
@@ -415,7 +433,7 @@ class Trackdb(models.Model):
                 # TODO: Ask if you we can get rid of division look up using assembly above
                 #  is fetching using info/genomes sufficient?
                 genomes_info_url = 'https://rest.ensembl.org/info/genomes/' + species_scientific_name + ''
-                genomes_info_response = requests.get(genomes_info_url, headers={'Accept': 'application/json'}, verify=True)
+                genomes_info_response = http_client.get(genomes_info_url, headers={'Accept': 'application/json'})
                 try:
                     genome_division = genomes_info_response.json().get('division')
                 except json.decoder.JSONDecodeError:
@@ -425,7 +443,7 @@ class Trackdb(models.Model):
                 # if genome_division is still None get it using taxonomy endpoint, e.g:
                 # https://rest.ensembl.org/info/genomes/taxonomy/physcomitrella_patens?content-type=application/json
                 genomes_info_url = 'https://rest.ensembl.org/info/genomes/taxonomy/' + species_scientific_name
-                genomes_info_response = requests.get(genomes_info_url, headers={'Accept': 'application/json'}, verify=True)
+                genomes_info_response = http_client.get(genomes_info_url, headers={'Accept': 'application/json'})
                 try:
                     genome_division = genomes_info_response.json()[0].get('division')
                 except json.decoder.JSONDecodeError:
@@ -481,7 +499,7 @@ class Trackdb(models.Model):
                                                                                                 short_label_stripped)
         return browser_links
 
-    def update_trackdb_document(self, hub, trackdb_data, trackdb_configuration, tracks_status, index):
+    def update_trackdb_document(self, hub, trackdb_data, trackdb_configuration, tracks_status, index, indexer=None):
         # pylint: disable=too-many-arguments
         """
         Update trackdb document in Elascticsearch with the additional data provided
@@ -491,41 +509,53 @@ class Trackdb(models.Model):
         :param trackdb_configuration: configuration object that will be added to the trackdb document
         :param tracks_status: status dictionary that will be added to the trackdb document
         :param index: index name (default: 'trackhubs')
+        :param indexer: es_bulk.BulkIndexer collecting the update, it's sent straight away if not provided
+        """
+        self.partial_update_trackdb_document({
+            **hub.get_document_fields(),
+            **self.get_extra_document_fields(),
+            'data': trackdb_data,
+            'updated': int(time.time()),
+            'status_updated': self.status_updated,
+            'configuration': trackdb_configuration,
+            'status': tracks_status
+        }, index, indexer)
+
+    def get_extra_document_fields(self):
         """
+        Fields of the trackdb document that aren't declared in search.documents.TrackdbDocument
+        The Elasticsearch autosync indexes the whole document again without them whenever the trackdb
+        is saved, so they have to be sent with any update following a save()
+        """
+        return {
+            'file_type': self.get_trackdb_file_type_count(),
+            'browser_links': self.generate_browser_links(),
+            'source': {
+                'url': self.source_url,
+                # checksum of the trackDb content computed during the ingestion
+                'checksum': self.source_checksum
+            },
+        }
+
+    def partial_update_trackdb_document(self, doc, index, indexer=None):
+        """
+        Update only the given fields of the trackdb document in Elascticsearch
+        :param doc: dictionary of the fields to update (e.g. {'status': {...}, 'updated': 1680000000})
+        :param index: index name (default: 'trackhubs')
+        :param indexer: es_bulk.BulkIndexer collecting the update, it's sent straight away if not provided
+        """
+        if indexer is not None:
+            indexer.add(index, self.trackdb_id, doc)
+            return
         try:
-            # Connect to ES and prevent Read timed out error
+            # the long timeout prevents Read timed out errors
             # https://stackoverflow.com/a/35302158/4488332
-            es_conn = connections.Elasticsearch(
-                [ELASTICSEARCH_DSL['default']['hosts']],
-                verify_certs=True,
-                timeout=600,
-                max_retries=10,
-                retry_on_timeout=True
-            )
-            es_conn.update(
+            get_es_client().update(
                 index=index,
                 id=self.trackdb_id,
                 # refresh=True,
-                body={
-                    'doc': {
-                        'owner': hub.get_owner(),
-                        'file_type': self.get_trackdb_file_type_count(),
-                        'data': trackdb_data,
-                        'browser_links': self.generate_browser_links(),
-                        'updated': int(time.time()),
-                        'source': {
-                            'url': self.source_url,
-                            # Compute checksum
-                            'checksum': hashlib.md5(self.source_url.encode('utf-8')).hexdigest()
-                        },
-                        # Get the data type based on the hub info
-                        'type': trackhubs.models.Hub.objects.filter(data_type_id=hub.data_type_id)
-                            .values('data_type__name').first()
-                            .get('data_type__name'),
-                        'configuration': trackdb_configuration,
-                        'status': tracks_status
-                    }
-                }
+                body={'doc': doc},
+                request_timeout=settings.ES_WRITE_TIMEOUT
             )
             logger.info("Trackdb id {} is updated successfully".format(self.trackdb_id))
 
@@ -560,6 +590,23 @@ class Track(models.Model):
     visibility = models.ForeignKey(Visibility, on_delete=models.CASCADE)
 
 
+class TrackStatus(models.Model):
+    """
+    Result of the last bigDataUrl check of a track, the trackdb 'status' summary is built from it
+    (see tracks_status.save_tracks_status())
+    """
+    class Meta:
+        db_table = "track_status"
+
+    track = models.OneToOneField(Track, on_delete=models.CASCADE, primary_key=True)
+    last_checked = models.IntegerField(db_index=True)
+    # 200 if the file exists, the error message otherwise
+    last_result = models.JSONField(null=True)
+    consecutive_failures = models.IntegerField(default=0, db_index=True)
+    # time of the first check of the current run of failures, None if the track isn't broken
+    first_failure = models.IntegerField(null=True, db_index=True)
+
+
 class GenomeAssemblyDump(models.Model):
     class Meta:
         db_table = "genome_assembly_dump"
@@ -567,10 +614,164 @@ class GenomeAssemblyDump(models.Model):
     genome_assembly_dump_id = models.AutoField(primary_key=True)
     accession = models.CharField(max_length=20, null=False)
     version = models.IntegerField(null=True)
-    accession_with_version = models.CharField(max_length=20, null=False)
-    assembly_name = models.CharField(max_length=255, null=False)
+    accession_with_version = models.CharField(max_length=20, null=False, db_index=True)
+    assembly_name = models.CharField(max_length=255, null=False, db_index=True)
     assembly_title = models.CharField(max_length=255, null=True)
     tax_id = models.IntegerField(null=False)
     scientific_name = models.CharField(max_length=255, null=False)
-    ucsc_synonym = models.CharField(max_length=255, null=True)
+    ucsc_synonym = models.CharField(max_length=255, null=True, db_index=True)
     api_last_updated = models.CharField(max_length=20, null=True)
+
+
+class HubCheckResult(models.Model):
+    """
+    Successful hubCheck results, cached by hub url and content checksum of the hub files
+    """
+    class Meta:
+        db_table = "hub_check_result"
+        constraints = [
+            models.UniqueConstraint(fields=['hub_url', 'checksum'], name='unique_hub_check_result'),
+        ]
+
+    hub_check_result_id = models.AutoField(primary_key=True)
+    hub_url = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=64)
+    result = models.JSONField()
+    created = models.IntegerField(db_index=True)
+
+
+class UrlCheckResult(models.Model):
+    """
+    Last result of a bigDataUrl check, shared by all the trackdbs pointing to the same file
+    (see trackhubs/url_check_cache.py)
+    """
+    class Meta:
+        db_table = "url_check_result"
+
+    url_check_result_id = models.AutoField(primary_key=True)
+    # sha256 of the url, urls can be too long to be indexed
+    url_hash = models.CharField(max_length=64, unique=True)
+    url = models.TextField()
+    # 200/None if the file exists, the error message otherwise (see tracks_status.check_response())
+    status = models.JSONField(null=True)
+    content_length = models.BigIntegerField(null=True)
+    last_modified = models.CharField(max_length=64, null=True)
+    checked_at = models.IntegerField(db_index=True)
+
+
+class SubmissionJob(models.Model):
+    """
+    Hub submission (POST/PUT /api/trackhub) waiting to be processed
+    by the 'process_submissions' management command
+    A running job whose 'updated' time is older than SUBMISSION_JOB_LEASE seconds
+    has lost its worker and is claimed again (see jobs.claim_next_job())
+    """
+    class Meta:
+        db_table = "submission_job"
+        indexes = [
+            models.Index(fields=['status', 'job_id']),
+            models.Index(fields=['status', 'updated']),
+            models.Index(fields=['hub_url', 'status']),
+        ]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    job_id = models.AutoField(primary_key=True)
+    hub_url = models.CharField(max_length=255)
+    data_type = models.CharField(max_length=45, null=True)
+    run_hubcheck = models.BooleanField(default=True)
+    refresh_status = models.BooleanField(default=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, default=PENDING)
+    stage = models.CharField(max_length=45, null=True)
+    progress = models.JSONField(null=True)
+    result = models.JSONField(null=True)
+    created = models.IntegerField()
+    updated = models.IntegerField(null=True)
+    started = models.IntegerField(null=True)
+    attempts = models.IntegerField(default=0)
+
+    class LeaseLost(Exception):
+        """
+        Raised when the running job has been claimed again by another worker
+        """
+
+    def renew_lease(self, **fields):
+        """
+        Refresh the 'updated' time of the running job (and save the given fields)
+        if it hasn't been claimed again by another worker in the meantime
+        :returns: True if the lease has been renewed
+        """
+        return SubmissionJob.objects.filter(
+            job_id=self.job_id, attempts=self.attempts, status=SubmissionJob.RUNNING
+        ).update(updated=int(time.time()), **fields) == 1
+
+    def update_progress(self, stage, progress=None):
+        """
+        Save the current stage (e.g. 'hubcheck', 'trackdbs') and progress of the job and renew its lease
+        it's passed to save_and_update_document() as progress_callback
+        :raises SubmissionJob.LeaseLost: if another worker has taken the job over, so that the ingestion stops
+        """
+        self.stage = stage
+        self.progress = progress
+        self.updated = int(time.time())
+        if not self.renew_lease(stage=stage, progress=progress):
+            raise SubmissionJob.LeaseLost("Job {} has been claimed by another worker".format(self.job_id))
+
+
+class TrackdbSchedule(models.Model):
+    """
+    Queue of the trackdbs status checks, ordered by next_check (see trackdbs/scheduler.py)
+    """
+    class Meta:
+        db_table = "trackdb_schedule"
+
+    trackdb = models.OneToOneField(Trackdb, on_delete=models.CASCADE, primary_key=True)
+    next_check = models.IntegerField(db_index=True)
+    last_checked = models.IntegerField(null=True)
+
+
+class RefreshRun(models.Model):
+    """
+    Checkpoint of a full-registry status refresh ('enrich all' or 'update_status'),
+    an interrupted run can be resumed with --resume (see trackdbs/update_trackdb.py)
+    """
+    class Meta:
+        db_table = "refresh_run"
+
+    run_id = models.AutoField(primary_key=True)
+    # the --shard option of the run ('i/n'), runs of different shards are resumed separately
+    shard = models.CharField(max_length=20, null=True)
+    total = models.IntegerField(default=0)
+    # last trackdb id of the ordered list of trackdbs before which every trackdb has been processed
+    last_trackdb_id = models.IntegerField(null=True)
+    # trackdb_id range split into shards when the run started, a resumed run keeps the same shard boundaries
+    min_trackdb_id = models.IntegerField(null=True)
+    max_trackdb_id = models.IntegerField(null=True)
+    started = models.IntegerField()
+    finished = models.IntegerField(null=True)
+
+
+class RefreshRunTrackdb(models.Model):
+    """
+    Outcome of one trackdb in a refresh run
+    """
+    class Meta:
+        db_table = "refresh_run_trackdb"
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'trackdb_id'], name='unique_refresh_run_trackdb'),
+        ]
+
+    UPDATED = 'updated'
+    NOT_FOUND = 'not_found'
+    FAILED = 'failed'
+
+    run = models.ForeignKey(RefreshRun, on_delete=models.CASCADE, related_name='trackdbs')
+    # not a foreign key, the trackdb can be deleted in the meantime
+    trackdb_id = models.IntegerField()
+    outcome = models.CharField(max_length=10)
+    error = models.TextField(null=True)
+    duration = models.FloatField()
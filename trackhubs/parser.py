@@ -13,70 +13,174 @@
 """
 
 import logging
-import urllib.request
+import urllib.error
+import urllib.parse
+
+from django.conf import settings
+
+from trackhubs import hub_files_cache
 
 logger = logging.getLogger(__name__)
 
+# maximum number of nested 'include' directives in a trackDb file
+MAX_INCLUDE_DEPTH = 10
+
 
-def parse_file_from_url(url):
+class ParserError(Exception):
     """
-    Parse the hub.txt, genomes.txt and trackdb.txt files from given hub url
+    Raised when a hub, genomes or trackDb file can't be fetched or parsed
+    """
+
+
+def iter_file_from_url(url, max_file_size=None, max_stanza_size=None, checksum=None, include_depth=0):
+    # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Parse the hub.txt, genomes.txt and trackdb.txt files from given url
+    The file is read line by line and each object is yielded as soon as it's complete,
+    so the whole file is never loaded in memory
+    'include' directives found between objects are followed, the included file
+    url is relative to the including one
     :param url: hub,genomes or trackdb url
-    :returns: an array of dictionaries, each dictionary contains one object
+    :param max_file_size: maximum size of the file in bytes (default: PARSER_MAX_FILE_SIZE setting)
+    :param max_stanza_size: maximum size of one object in bytes (default: PARSER_MAX_STANZA_SIZE setting)
+    :param checksum: optional hashlib object updated with the raw content of the file
+    and its included files
+    :param include_depth: current 'include' nesting level (used internally)
+    :returns: a generator of dictionaries, each dictionary contains one object
     either hub, genome or track
-    hub_url examples:
-    http://ftp.ebi.ac.uk/pub/databases/ensembl/encode/integration_data_jan2011/hub.txt
-    https://data.broadinstitute.org/compbio1/PhyloCSFtracks/trackHub/hub.txt
-    ftp://ftp.vectorbase.org/public_data/rnaseq_alignments/hubs/aedes_aegypti/VBRNAseq_group_SRP039093/hub.txt
-    http://urgi.versailles.inra.fr/repetdb/repetdb_trackhubs/repetdb_Melampsora_larici-populina_98AG31_v1.0/hub.txt
+    :raises ParserError: if the file can't be fetched, decoded or is too big
     """
+    max_file_size = max_file_size or settings.PARSER_MAX_FILE_SIZE
+    max_stanza_size = max_stanza_size or settings.PARSER_MAX_STANZA_SIZE
     logger.info("Parsing '{}'".format(url))
     # dict_info is where key/value of each element (it can be hub, genome or track) is stored
     # e.g. dict_info = {'track': 'JASPAR2020_TFBS_hg19', 'type': 'bigBed 6 +'}
     dict_info = {}
-    dict_info_list = []
+    stanza_size = 0
 
     try:
-        with urllib.request.urlopen(url) as file:
-            # read the whole file into a list
-            # each element represent one line from the file
-            file_content = file.read().decode('utf-8').splitlines()
-            # the length is used to check if we reached the end of the file
-            len_file_content = len(file_content)
-
-        for line_number, line in enumerate(file_content):
-            if line not in ['\n', '\r\n', ''] and not line.startswith('#'):
-                split_line = line.rstrip('\n').split(' ', 1)
-                key = split_line[0].strip()
-                dict_info[key] = split_line[1].strip()  # strip any space left in the value
-
-            # there are tracks with hashtag symbol! => ignore them!
-            # e.g http://ftp.ebi.ac.uk/pub/databases/ensembl/encode/integration_data_jan2011/hg19/trackDb.txt
-            if line.startswith('#'):
-                continue
-
-            # new line marks a new genome/track/supertrack etc
-            # in this case we check if dict_info is not empty
-            # then we append it to dict_info_list and empty the
-            # dictionary for the next element otherwise (if there is no new line)
-            # we read the next line and we repeat the process
-            # also we add the last object when we reach the EOF
-            if line in ['\n', '\r\n', ''] or line_number+1 == len_file_content:
-                # check if the dictionary contains either 'hub',
-                # 'track' or 'genome' key before appending it to the list
-                # this prevents the submitter from uploading random text file
-                is_either_hub_track_or_genome = any(i in list(dict_info.keys()) for i in ('hub', 'track', 'genome'))
-                if len(dict_info) > 0 and is_either_hub_track_or_genome:
-                    dict_info.update({'url': url})
-                    dict_info_list.append(dict_info)
-                    dict_info = {}
-                continue
+        # unchanged files are read from the local cache
+        with hub_files_cache.urlopen(url) as file:
+            for raw_line in _iter_raw_lines(file, url, max_file_size, max_stanza_size, checksum):
+                stanza_size += len(raw_line)
+
+                line = raw_line.decode('utf-8').rstrip('\r\n')
+
+                # there are tracks with hashtag symbol! => ignore them!
+                # e.g http://ftp.ebi.ac.uk/pub/databases/ensembl/encode/integration_data_jan2011/hg19/trackDb.txt
+                if line.startswith('#'):
+                    continue
+
+                if line:
+                    if stanza_size > max_stanza_size:
+                        raise ParserError("'{}' contains an object bigger than {} bytes".format(url, max_stanza_size))
+                    split_line = line.split(' ', 1)
+                    key = split_line[0].strip()
+                    # strip any space left in the value
+                    value = split_line[1].strip() if len(split_line) > 1 else ''
+                    if key == 'include' and not dict_info:
+                        yield from _iter_included_file(
+                            url, value, max_file_size, max_stanza_size, checksum, include_depth
+                        )
+                        stanza_size = 0
+                        continue
+                    dict_info[key] = value
+                    continue
+
+                # new line marks a new genome/track/supertrack etc
+                stanza = _complete_stanza(dict_info, url)
+                dict_info = {}
+                stanza_size = 0
+                if stanza:
+                    yield stanza
+
+        # also we add the last object when we reach the EOF
+        stanza = _complete_stanza(dict_info, url)
+        if stanza:
+            yield stanza
 
     except (IOError, urllib.error.HTTPError, urllib.error.URLError, ValueError, AttributeError, TypeError) as ex:
+        raise ParserError(ex) from ex
+
+
+def _iter_raw_lines(file, url, max_file_size, max_line_size, checksum):
+    # pylint: disable=too-many-arguments
+    """
+    Yield the lines of the file (keeping the line endings), the size limits are checked on the bytes
+    actually read so a file without line endings is never loaded in memory
+    The lines are read in bounded pieces, with readline(limit) if the file supports it
+    (http_client.Response yields the long lines in pieces)
+    :param max_file_size: maximum size of the file in bytes
+    :param max_line_size: maximum size of one line in bytes (a line can't be bigger than an object)
+    :param checksum: optional hashlib object updated with the raw content of the file
+    :raises ParserError: as soon as a limit is crossed
+    """
+    if hasattr(file, 'readline'):
+        piece_size = min(max_file_size, max_line_size) + 1
+        pieces = iter(lambda: file.readline(piece_size), b'')
+    else:
+        pieces = iter(file)
+    file_size = 0
+    pending = bytearray()
+    for piece in pieces:
+        if checksum is not None:
+            checksum.update(piece)
+        file_size += len(piece)
+        if file_size > max_file_size:
+            raise ParserError("'{}' is bigger than {} bytes".format(url, max_file_size))
+        pending += piece
+        if len(pending) > max_line_size:
+            raise ParserError("'{}' contains an object bigger than {} bytes".format(url, max_line_size))
+        if pending.endswith(b'\n'):
+            yield bytes(pending)
+            pending.clear()
+    # the last line may not have a line ending
+    if pending:
+        yield bytes(pending)
+
+
+def _iter_included_file(url, value, max_file_size, max_stanza_size, checksum, include_depth):
+    # pylint: disable=too-many-arguments
+    """
+    Parse the file referenced by an 'include' directive
+    e.g. 'include trackDb.broad.ra' or 'include trackDb.broad.ra alpha' (release tags are ignored)
+    """
+    if include_depth >= MAX_INCLUDE_DEPTH:
+        raise ParserError("'{}' has more than {} nested includes".format(url, MAX_INCLUDE_DEPTH))
+    if not value:
+        raise ParserError("'{}' contains an empty include directive".format(url))
+    included_url = urllib.parse.urljoin(url, value.split()[0])
+    yield from iter_file_from_url(included_url, max_file_size, max_stanza_size, checksum, include_depth + 1)
+
+
+def _complete_stanza(dict_info, url):
+    """
+    Check if the dictionary contains either 'hub', 'track' or 'genome' key
+    this prevents the submitter from uploading random text file
+    :returns: the completed object or None if it should be ignored
+    """
+    is_either_hub_track_or_genome = any(i in dict_info for i in ('hub', 'track', 'genome'))
+    if dict_info and is_either_hub_track_or_genome:
+        dict_info.update({'url': url})
+        return dict_info
+    return None
+
+
+def parse_file_from_url(url, checksum=None):
+    """
+    Parse the hub.txt, genomes.txt and trackdb.txt files from given hub url
+    :param url: hub,genomes or trackdb url
+    :param checksum: optional hashlib object updated with the raw content of the file
+    :returns: an array of dictionaries, each dictionary contains one object
+    either hub, genome or track, or None if the file couldn't be parsed
+    hub_url examples:
+    http://ftp.ebi.ac.uk/pub/databases/ensembl/encode/integration_data_jan2011/hub.txt
+    https://data.broadinstitute.org/compbio1/PhyloCSFtracks/trackHub/hub.txt
+    ftp://ftp.vectorbase.org/public_data/rnaseq_alignments/hubs/aedes_aegypti/VBRNAseq_group_SRP039093/hub.txt
+    http://urgi.versailles.inra.fr/repetdb/repetdb_trackhubs/repetdb_Melampsora_larici-populina_98AG31_v1.0/hub.txt
+    """
+    try:
+        return list(iter_file_from_url(url, checksum=checksum))
+    except ParserError as ex:
         logger.error(ex)
         return None
-    if dict_info is []:  # dict_info is empty
-        logger.error("Couldn't parse the provided text file, please make sure it exists and well formatted!")
-        return None
-
-    return dict_info_list
@@ -0,0 +1,121 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+import trackhubs
+from trackhubs.constants import DATA_TYPES, FILE_TYPES, VISIBILITY
+
+logger = logging.getLogger(__name__)
+
+# DataType, FileType and Visibility are small tables that barely change, each one is loaded once
+# in a {name: id} map shared by the whole process and reloaded after any change made by this process
+# (see apps.py), the changes made by the other processes are picked up after REFERENCE_DATA_CACHE_TTL seconds
+_names_to_ids = {}
+_ids_to_names = {}
+_loaded_at = {}
+_lock = threading.Lock()
+
+
+def get_reference_models():
+    """
+    :returns: the reference models and the names they are seeded with
+    """
+    return (
+        (trackhubs.models.DataType, DATA_TYPES),
+        (trackhubs.models.FileType, FILE_TYPES),
+        (trackhubs.models.Visibility, VISIBILITY),
+    )
+
+
+def _load(model):
+    with _lock:
+        if model not in _names_to_ids or time.monotonic() - _loaded_at[model] >= settings.REFERENCE_DATA_CACHE_TTL:
+            # if a name is stored twice, the oldest row wins (like filter(name=...).first())
+            rows = list(model.objects.order_by('-pk').values_list('name', 'pk'))
+            _names_to_ids[model] = dict(rows)
+            _ids_to_names[model] = {pk: name for name, pk in rows}
+            _loaded_at[model] = time.monotonic()
+        return _names_to_ids[model], _ids_to_names[model]
+
+
+def get_ids(model):
+    """
+    :param model: DataType, FileType or Visibility
+    :returns: the {name: id} map of the given model
+    """
+    return _load(model)[0]
+
+
+def get_id(model, name):
+    """
+    :param model: DataType, FileType or Visibility
+    :param name: e.g. 'genomics', 'bigBed' or 'hide'
+    :returns: the id of the row with the given name or None if it doesn't exist
+    """
+    return get_ids(model).get(name)
+
+
+def get_name(model, pk):
+    """
+    :param model: DataType, FileType or Visibility
+    :param pk: the row id
+    :returns: the name of the row with the given id or None if it doesn't exist
+    """
+    return _load(model)[1].get(pk)
+
+
+def clear_cache(sender=None, **kwargs):  # pylint: disable=unused-argument
+    """
+    Forget the loaded maps (all of them or only the sender's one), they are loaded again on the next lookup
+    It's connected to the post_save and post_delete signals of the reference models
+    """
+    with _lock:
+        for cache in (_names_to_ids, _ids_to_names, _loaded_at):
+            if sender is None:
+                cache.clear()
+            else:
+                cache.pop(sender, None)
+
+
+def invalidate(sender=None, **kwargs):
+    """
+    Signal handler clearing the cache now and once the current transaction is committed,
+    so that a concurrent lookup can't keep ids that aren't visible yet
+    """
+    clear_cache(sender, **kwargs)
+    transaction.on_commit(lambda: clear_cache(sender))
+
+
+def seed_reference_data(**kwargs):  # pylint: disable=unused-argument
+    """
+    Insert the DATA_TYPES, FILE_TYPES and VISIBILITY constants that are missing
+    It's connected to the post_migrate signal so the tables are filled once when the database is migrated
+    :returns: the number of inserted rows
+    """
+    created_rows = 0
+    for model, names in get_reference_models():
+        existing_names = set(model.objects.values_list('name', flat=True))
+        missing_objs = [model(name=name) for name in names if name not in existing_names]
+        model.objects.bulk_create(missing_objs)
+        created_rows += len(missing_objs)
+        clear_cache(model)
+    if created_rows:
+        logger.info("{} DataType/FileType/Visibility rows inserted".format(created_rows))
+    return created_rows
@@ -66,3 +66,21 @@ class CustomOneHubSerializer(serializers.ModelSerializer):
     def get_trackdbs(self, obj) -> list[dict]:
         # pylint: disable=no-self-use
         return obj.get_trackdbs_full_list_from_hub()
+
+
+class SubmissionJobSerializer(serializers.ModelSerializer):
+    """
+    Hub submission job serializer used for GET trackhub/jobs/:id API
+    """
+    class Meta:
+        model = models.SubmissionJob
+        fields = [
+            'job_id',
+            'hub_url',
+            'status',
+            'stage',
+            'progress',
+            'result',
+            'created',
+            'updated'
+        ]
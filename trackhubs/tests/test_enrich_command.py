@@ -16,6 +16,13 @@ from io import StringIO
 
 import pytest
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from trackdbs import update_trackdb
+from trackdbs.update_trackdb import get_trackdb_ids, iter_trackdb_ids, parse_shard
+from trackhubs import models
 from trackhubs.utils import escape_ansi
 
 
@@ -23,7 +30,8 @@ from trackhubs.utils import escape_ansi
 def test_enrich_all_success(create_trackdb_resource):
     out = StringIO()
     call_command('enrich', 'all', stdout=out)
-    assert 'All TrackDB are updated successfully!\n' == escape_ansi(out.getvalue())
+    assert escape_ansi(out.getvalue()).endswith('\nAll TrackDB are updated successfully!\n')
+    assert 'Run 1: 1 trackdbs, 1 updated, 0 not found, 0 failed' in out.getvalue()
 
 
 @pytest.mark.django_db
@@ -38,3 +46,149 @@ def test_enrich_one_fail():
     out = StringIO()
     call_command('enrich', '1', stdout=out)
     assert "No TrackDB with ID '1'!\n" == escape_ansi(out.getvalue())
+
+
+@pytest.mark.django_db
+def test_update_one_trackdb_sends_the_status_only(create_trackdb_resource, monkeypatch, settings):
+    partial_documents = []
+    monkeypatch.setattr(
+        models.Trackdb, 'partial_update_trackdb_document',
+        lambda trackdb, doc, index, indexer=None: partial_documents.append(doc)
+    )
+    indexed_trackdbs = []
+    settings.ELASTICSEARCH_DSL_AUTOSYNC = True
+    monkeypatch.setattr(
+        'search.documents.TrackdbDocument.update', lambda document, instance, **kwargs: indexed_trackdbs.append(instance)
+    )
+
+    with CaptureQueriesContext(connection) as queries:
+        update_trackdb.update_one_trackdb(create_trackdb_resource.trackdb_id)
+
+    trackdb_queries = [query['sql'] for query in queries if query['sql'].startswith('SELECT "trackdb"')]
+    assert trackdb_queries and not any('"trackdb"."configuration"' in sql for sql in trackdb_queries)
+    assert not any('"trackdb"."data"' in sql for sql in trackdb_queries)
+    assert not indexed_trackdbs
+    assert len(partial_documents) == 1
+    assert {'status', 'status_updated', 'hub', 'file_type', 'source'} <= set(partial_documents[0])
+    assert not {'data', 'configuration', 'updated'} & set(partial_documents[0])
+    trackdb = models.Trackdb.objects.get(pk=create_trackdb_resource.trackdb_id)
+    assert trackdb.status == partial_documents[0]['status']
+    assert trackdb.updated == create_trackdb_resource.updated
+
+
+@pytest.mark.parametrize(
+    'shard, expected_result',
+    [
+        ('0/1', (0, 1)),
+        ('3/4', (3, 4)),
+        ('4/4', ValueError),
+        ('1', ValueError),
+        ('a/b', ValueError),
+    ]
+)
+def test_parse_shard(shard, expected_result):
+    if isinstance(expected_result, tuple):
+        assert parse_shard(shard) == expected_result
+    else:
+        with pytest.raises(expected_result):
+            parse_shard(shard)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_trackhub_resource')
+def test_get_trackdb_ids_shards():
+    all_ids = list(get_trackdb_ids())
+    shards = [list(get_trackdb_ids((shard_index, 3))) for shard_index in range(3)]
+
+    assert len(all_ids) == 2
+    # each trackdb belongs to exactly one shard
+    assert sorted(sum(shards, [])) == all_ids
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_trackhub_resource')
+def test_iter_trackdb_ids():
+    all_ids = list(get_trackdb_ids())
+
+    assert list(iter_trackdb_ids(chunk_size=1)) == [[all_ids[0]], [all_ids[1]]]
+    assert list(iter_trackdb_ids(after=all_ids[0])) == [[all_ids[1]]]
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_trackdb_resource')
+def test_update_status_shard():
+    out = StringIO()
+    call_command('update_status', '--shard', '0/2', stdout=out)
+    assert 'All TrackDB status are updated successfully!' in escape_ansi(out.getvalue())
+
+    with pytest.raises(CommandError):
+        call_command('enrich', 'all', '--shard', '2/2')
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_trackhub_resource')
+def test_update_all_trackdbs_resume(monkeypatch):
+    trackdb_ids = list(get_trackdb_ids())
+    updated_ids = []
+    interrupted = True
+
+    def fake_update_one_trackdb(trackdb_id, **_kwargs):
+        if trackdb_id == trackdb_ids[1]:
+            # the first run is killed, the second one fails
+            if interrupted:
+                raise KeyboardInterrupt
+            raise ValueError('broken trackdb')
+        updated_ids.append(trackdb_id)
+        return trackdb_id
+
+    monkeypatch.setattr(update_trackdb, 'update_one_trackdb', fake_update_one_trackdb)
+    # the outcome of each trackdb is saved as soon as it's processed
+    monkeypatch.setattr(update_trackdb, 'REFRESH_BATCH_SIZE', 1)
+    with pytest.raises(KeyboardInterrupt):
+        update_trackdb.update_all_trackdbs()
+    refresh_run = models.RefreshRun.objects.get()
+    assert (refresh_run.last_trackdb_id, refresh_run.finished) == (trackdb_ids[0], None)
+
+    interrupted = False
+    refresh_summary = update_trackdb.update_all_trackdbs(resume=True)
+
+    # the first trackdb isn't updated again
+    assert updated_ids == [trackdb_ids[0]]
+    assert refresh_summary['run_id'] == refresh_run.run_id
+    assert (refresh_summary['total'], refresh_summary['updated']) == (2, 1)
+    assert refresh_summary['failed'] == [{'trackdb_id': trackdb_ids[1], 'error': "ValueError('broken trackdb')"}]
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_trackhub_resource')
+def test_update_all_trackdbs_resume_keeps_shard_boundaries(monkeypatch):
+    trackdb_ids = list(get_trackdb_ids())
+    updated_ids = []
+    interrupted = True
+
+    def fake_update_one_trackdb(trackdb_id, **_kwargs):
+        if interrupted:
+            raise KeyboardInterrupt
+        updated_ids.append(trackdb_id)
+        return trackdb_id
+
+    monkeypatch.setattr(update_trackdb, 'update_one_trackdb', fake_update_one_trackdb)
+    with pytest.raises(KeyboardInterrupt):
+        update_trackdb.update_all_trackdbs(shard=(1, 2))
+    refresh_run = models.RefreshRun.objects.get()
+    assert (refresh_run.min_trackdb_id, refresh_run.max_trackdb_id) == (trackdb_ids[0], trackdb_ids[1])
+
+    # a hub submitted before the run is resumed moves the current id range
+    existing_trackdb = models.Trackdb.objects.get(pk=trackdb_ids[0])
+    new_trackdb = models.Trackdb.objects.create(
+        hub=existing_trackdb.hub, assembly=existing_trackdb.assembly, species=existing_trackdb.species,
+        source_url='https://example.org/new/trackDb.txt'
+    )
+    assert new_trackdb.pk in get_trackdb_ids((1, 2))
+
+    interrupted = False
+    refresh_summary = update_trackdb.update_all_trackdbs(shard=(1, 2), resume=True)
+
+    assert refresh_summary['run_id'] == refresh_run.run_id
+    assert updated_ids == [trackdb_ids[1]]
+    assert refresh_summary['total'] == 1
@@ -0,0 +1,113 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import json
+from types import SimpleNamespace
+
+from elasticsearch.serializer import JSONSerializer
+
+from trackhubs import es_client
+from trackhubs.es_bulk import BulkIndexer
+
+
+class FakeBulkClient:
+    """
+    Answer each bulk item with the next status of its document (200 once they're all used)
+    """
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.requests = []
+        self.transport = SimpleNamespace(serializer=JSONSerializer())
+
+    def bulk(self, body, *args, **kwargs):
+        lines = [json.loads(line) for line in body.strip().split('\n')]
+        actions = list(zip(lines[::2], lines[1::2]))
+        self.requests.append([(action['update']['_id'], doc['doc']) for action, doc in actions])
+        items = []
+        for action, _ in actions:
+            doc_id = action['update']['_id']
+            status = self.statuses[doc_id].pop(0) if self.statuses.get(doc_id) else 200
+            item = {'_index': 'trackhubs', '_id': doc_id, 'status': status}
+            if status >= 300:
+                item['error'] = {'type': 'error_{}'.format(status)}
+            items.append({'update': item})
+        return {'errors': any(item['update']['status'] >= 300 for item in items), 'items': items}
+
+
+def test_bulk_indexer_batches_and_merges_updates(settings):
+    settings.ES_BULK_BACKOFF = 0
+    es_conn = FakeBulkClient({})
+    indexer = BulkIndexer(es_conn=es_conn, batch_size=2)
+
+    indexer.add('trackhubs', 1, {'status': 'ok'})
+    indexer.add('trackhubs', 1, {'updated': 10})
+    assert not es_conn.requests
+    indexer.add('trackhubs', 2, {'status': 'ko'})
+    indexer.add('trackhubs', 3, {'status': 'ok'})
+
+    assert es_conn.requests == [[(1, {'status': 'ok', 'updated': 10}), (2, {'status': 'ko'})]]
+    assert indexer.flush() == {}
+    assert es_conn.requests[1] == [(3, {'status': 'ok'})]
+
+
+def test_bulk_indexer_max_bytes_counts_merged_updates():
+    es_conn = FakeBulkClient({})
+    indexer = BulkIndexer(es_conn=es_conn, max_bytes=150)
+
+    # the same field updated again doesn't add to the batch size
+    for status in ('a', 'b', 'c'):
+        indexer.add('trackhubs', 1, {'status': status * 60})
+    assert not es_conn.requests
+
+    # the merged document is over the limit
+    indexer.add('trackhubs', 1, {'configuration': 'd' * 60})
+    assert es_conn.requests == [[(1, {'status': 'c' * 60, 'configuration': 'd' * 60})]]
+
+
+def test_bulk_indexer_retries(settings):
+    settings.ES_BULK_BACKOFF = 0
+    settings.ES_BULK_MAX_RETRIES = 2
+    es_conn = FakeBulkClient({1: [429, 503], 2: [404], 3: [500, 500, 500]})
+    indexer = BulkIndexer(es_conn=es_conn)
+    for doc_id in (1, 2, 3, 4):
+        indexer.add('trackhubs', doc_id, {'status': 'ok'})
+
+    failed_documents = indexer.flush()
+
+    # 404 isn't retried, 3 is still failing after 2 retries
+    assert failed_documents == {('trackhubs', 2): {'type': 'error_404'}, ('trackhubs', 3): {'type': 'error_500'}}
+    assert [[doc_id for doc_id, _ in request] for request in es_conn.requests] == [
+        [1, 2, 3, 4], [1, 3], [1, 3]
+    ]
+
+
+def test_get_es_client_is_shared_and_fork_safe(monkeypatch, settings):
+    settings.ES_CLIENT_MAXSIZE = 7
+    created_clients = []
+
+    def _fake_elasticsearch(hosts, **kwargs):
+        created_clients.append(kwargs)
+        return SimpleNamespace(hosts=hosts, **kwargs)
+
+    monkeypatch.setattr(es_client.elasticsearch, 'Elasticsearch', _fake_elasticsearch)
+    client = es_client.get_es_client()
+    assert es_client.get_es_client() is client
+    # the bulk indexer uses the shared client by default
+    assert BulkIndexer().get_connection() is client
+    assert len(created_clients) == 1
+    assert created_clients[0]['maxsize'] == 7
+
+    # a forked process gets its own client
+    monkeypatch.setattr(es_client.os, 'getpid', lambda: -1)
+    assert es_client.get_es_client() is not client
+    assert len(created_clients) == 2
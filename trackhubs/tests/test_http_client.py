@@ -0,0 +1,128 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import ftplib
+import urllib.error
+from types import SimpleNamespace
+
+import pytest
+import requests
+import responses
+
+from trackhubs import http_client
+# imported before conftest.py replaces http_client.urlopen with the fake one
+from trackhubs.http_client import ftp_probe, urlopen
+
+
+@responses.activate
+def test_urlopen_success():
+    fake_url = 'http://a.fake/hub/trackDb.txt'
+    responses.add(responses.GET, fake_url, body=b'track foo\ntype bigBed\n\ntrack bar', status=200)
+
+    with urlopen(fake_url) as response:
+        assert response.getcode() == 200
+        assert list(response) == [b'track foo\n', b'type bigBed\n', b'\n', b'track bar']
+
+
+def test_response_splits_long_lines():
+    chunks = [b'track foo\ntype ', b'bigBed\n', b'x' * 10, b'y' * 10, b'\n\nlast']
+    fake_response = SimpleNamespace(
+        headers={}, url='http://a.fake/trackDb.txt', iter_content=lambda chunk_size: iter(chunks)
+    )
+
+    response = http_client.Response(fake_response, max_line_length=8)
+
+    # the line without line ending is yielded in pieces as soon as they're read
+    assert list(response) == [
+        b'track foo\n', b'type bigBed\n', b'x' * 8, b'x' * 2 + b'y' * 6, b'yyyy\n', b'\n', b'last'
+    ]
+
+
+@responses.activate
+def test_urlopen_http_error():
+    fake_url = 'http://a.fake/hub/missing.bb'
+    responses.add(responses.GET, fake_url, status=404)
+
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        urlopen(fake_url)
+    assert exc_info.value.code == 404
+
+
+@responses.activate
+def test_urlopen_connection_error():
+    fake_url = 'http://a.fake/hub/hub.txt'
+    responses.add(responses.GET, fake_url, body=requests.exceptions.ConnectionError('Connection refused'))
+
+    with pytest.raises(urllib.error.URLError):
+        urlopen(fake_url)
+
+
+def test_get_session_is_shared_and_fork_safe(monkeypatch):
+    session = http_client.get_session()
+    assert http_client.get_session() is session
+
+    # a forked process gets its own session
+    monkeypatch.setattr(http_client.os, 'getpid', lambda: -1)
+    assert http_client.get_session() is not session
+
+
+@pytest.mark.parametrize(
+    'path, expected_result',
+    [
+        ('/pub/foo.cram', {'content_length': 1024, 'last_modified': 'Wed, 01 Jan 2020 12:00:00 GMT'}),
+        ('/pub/missing.cram', urllib.error.URLError),
+    ]
+)
+def test_ftp_probe(monkeypatch, path, expected_result):
+    commands = []
+
+    class FakeFTP:
+        def __init__(self, timeout=None):
+            self.timeout = timeout
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def connect(self, host, port):
+            commands.append(('connect', host, port))
+
+        def login(self, user, passwd):
+            commands.append(('login', user))
+
+        def voidcmd(self, cmd):
+            commands.append(cmd)
+
+        def size(self, filename):
+            commands.append('SIZE ' + filename)
+            if filename != '/pub/foo.cram':
+                raise ftplib.error_perm('550 Failed to change directory.')
+            return 1024
+
+        def sendcmd(self, cmd):
+            commands.append(cmd)
+            return '213 20200101120000'
+
+    monkeypatch.setattr(http_client.ftplib, 'FTP', FakeFTP)
+    fake_url = 'ftp://ftp.fake.org' + path
+
+    if isinstance(expected_result, dict):
+        assert ftp_probe(fake_url) == expected_result
+        # the file is never downloaded
+        assert not any(str(command).startswith('RETR') for command in commands)
+    else:
+        with pytest.raises(expected_result):
+            ftp_probe(fake_url)
+    assert commands[:2] == [('connect', 'ftp.fake.org', 21), ('login', 'anonymous')]
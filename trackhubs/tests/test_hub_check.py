@@ -11,10 +11,18 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import io
+import subprocess
+import threading
+import time
+
 import pytest
+import requests
+from django.core.management import call_command
 
 import trackhubs.hub_check as hub_check_module
-from trackhubs.hub_check import hub_check
+from trackhubs.hub_check import cache_hub_check, get_cached_hub_check, hub_check
+from trackhubs.models import HubCheckResult
 
 
 @pytest.fixture(autouse=True)
@@ -51,29 +59,54 @@ def test_hub_check_all_cases(monkeypatch, returncode, stdout, expected_key_in_re
     assert calls[0][0] == [str(hub_check_module.HUBCHECK_PATH), "-noTracks", "https://example.org/hub.txt"]
 
 
+def fake_download(status_code, requested_urls):
+    def fake_get(url, **kwargs):
+        requested_urls.append((url, kwargs))
+        response = requests.Response()
+        response.status_code = status_code
+        response.raw = io.BytesIO(b"\x7fELF binary")
+        return response
+    return fake_get
+
+
 def test_hub_check_downloads_binary_when_missing(tmp_path, monkeypatch):
     """
-    Test hubCheck is downloaded locally if it is missing.
+    Test hubCheck is downloaded locally (through the shared HTTP client) if it is missing.
     """
     hubcheck = tmp_path / "tools" / "hubCheck"
     hubcheck.unlink()
     calls = []
+    requested_urls = []
 
     def fake_run(command, **kwargs):
         calls.append((command, kwargs))
-        if command[0] == "curl":
-            hubcheck.touch()
-            return type("CompletedProcess", (), {"returncode": 0, "stdout": ""})
         return type("CompletedProcess", (), {"returncode": 0, "stdout": "No problems detected\n"})
 
     monkeypatch.setattr(hub_check_module, "HUBCHECK_PATH", hubcheck)
+    monkeypatch.setattr(hub_check_module.sys, "platform", "linux")
     monkeypatch.setattr(hub_check_module.subprocess, "run", fake_run)
+    monkeypatch.setattr(hub_check_module.http_client, "get", fake_download(200, requested_urls))
 
     actual_result = hub_check("https://example.org/hub.txt")
 
     assert "success" in actual_result
-    assert calls[0][0][0] == "curl"
-    assert calls[1][0] == [str(hubcheck), "-noTracks", "https://example.org/hub.txt"]
+    assert requested_urls == [(hub_check_module.HUBCHECK_DOWNLOAD_URLS["linux"], {'stream': True})]
+    assert hubcheck.read_bytes() == b"\x7fELF binary"
+    assert [path.name for path in hubcheck.parent.iterdir()] == ["hubCheck"]
+    assert calls[0][0] == [str(hubcheck), "-noTracks", "https://example.org/hub.txt"]
+
+
+def test_hub_check_binary_download_fails(tmp_path, monkeypatch):
+    hubcheck = tmp_path / "tools" / "hubCheck"
+    hubcheck.unlink()
+    monkeypatch.setattr(hub_check_module.sys, "platform", "linux")
+    monkeypatch.setattr(hub_check_module.http_client, "get", fake_download(404, []))
+
+    actual_result = hub_check("https://example.org/hub.txt")
+
+    assert "Couldn't download hubCheck" in actual_result["error"]
+    # no partial download is left behind
+    assert list(hubcheck.parent.iterdir()) == []
 
 
 def test_hub_check_makes_existing_binary_executable(monkeypatch):
@@ -93,3 +126,101 @@ def test_hub_check_makes_existing_binary_executable(monkeypatch):
 
     assert "success" in actual_result
     assert hub_check_module.HUBCHECK_PATH.stat().st_mode & 0o700 == 0o700
+
+
+@pytest.mark.django_db
+def test_hub_check_cache(settings):
+    hub_url = "https://example.org/hub.txt"
+    cache_hub_check(hub_url, "checksum", {'success': 'hubCheck done! Nothing to report!'})
+    cache_hub_check(hub_url, "other_checksum", {'error': 'Error in hub', 'details': []})
+
+    assert get_cached_hub_check(hub_url, "checksum") == {'success': 'hubCheck done! Nothing to report!'}
+    # errors aren't cached
+    assert get_cached_hub_check(hub_url, "other_checksum") is None
+
+    settings.HUBCHECK_CACHE_TTL = -1
+    assert get_cached_hub_check(hub_url, "checksum") is None
+
+
+@pytest.mark.django_db
+def test_hub_check_cache_keeps_the_last_content_only():
+    hub_url = "https://example.org/hub.txt"
+    cache_hub_check(hub_url, "checksum", {'success': 'hubCheck done! Nothing to report!'})
+    cache_hub_check("https://example.org/other_hub.txt", "checksum", {'success': 'hubCheck done! Nothing to report!'})
+    cache_hub_check(hub_url, "new_checksum", {'success': 'hubCheck done! Nothing to report!'})
+
+    assert get_cached_hub_check(hub_url, "checksum") is None
+    assert get_cached_hub_check(hub_url, "new_checksum") is not None
+    assert HubCheckResult.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_purge_hub_check_cache_command(settings):
+    settings.HUBCHECK_CACHE_TTL = 60
+    for hub_url in ("https://example.org/hub.txt", "https://example.org/old_hub.txt"):
+        cache_hub_check(hub_url, "checksum", {'success': 'hubCheck done! Nothing to report!'})
+    HubCheckResult.objects.filter(hub_url="https://example.org/old_hub.txt").update(created=int(time.time()) - 61)
+
+    call_command('purge_hub_check_cache')
+    assert list(HubCheckResult.objects.values_list('hub_url', flat=True)) == ["https://example.org/hub.txt"]
+
+    call_command('purge_hub_check_cache', '--all')
+    assert not HubCheckResult.objects.exists()
+
+
+def test_hub_check_timeout(settings, monkeypatch):
+    """
+    Test a hubCheck run that takes too long is reported as an error
+    """
+    settings.HUBCHECK_TIMEOUT = 5
+
+    def fake_run(command, **kwargs):
+        # subprocess.run() kills the process before raising TimeoutExpired
+        raise subprocess.TimeoutExpired(command, kwargs['timeout'])
+
+    monkeypatch.setattr(hub_check_module.subprocess, "run", fake_run)
+    timeouts = hub_check_module.get_hub_check_metrics()['timeouts']
+
+    actual_result = hub_check("https://example.org/hub.txt")
+
+    assert actual_result == {
+        'error': 'hubCheck timed out after 5 seconds on hub https://example.org/hub.txt',
+        'details': [],
+    }
+    assert hub_check_module.get_hub_check_metrics()['timeouts'] == timeouts + 1
+
+
+def test_hub_check_concurrency_cap(settings, monkeypatch):
+    """
+    Test no more than HUBCHECK_MAX_PROCESSES hubCheck processes run at the same time
+    """
+    settings.HUBCHECK_MAX_PROCESSES = 2
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def fake_run(command, **kwargs):
+        with lock:
+            running.append(command)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(command)
+        return type("CompletedProcess", (), {"returncode": 0, "stdout": "No problems detected\n"})
+
+    monkeypatch.setattr(hub_check_module.subprocess, "run", fake_run)
+    runs = hub_check_module.get_hub_check_metrics()['runs']
+
+    threads = [
+        threading.Thread(target=hub_check, args=("https://example.org/{}/hub.txt".format(number),))
+        for number in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    metrics = hub_check_module.get_hub_check_metrics()
+    assert max(max_running) == 2
+    assert metrics['runs'] == runs + 5
+    assert metrics['waiting'] == 0 and metrics['running'] == 0
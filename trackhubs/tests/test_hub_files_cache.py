@@ -0,0 +1,68 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import os
+
+import pytest
+import responses
+
+from trackhubs import http_client, hub_files_cache
+# imported before conftest.py replaces http_client.urlopen with the fake one
+from trackhubs.http_client import urlopen
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, settings, monkeypatch):
+    settings.HUB_FILES_CACHE_DIR = str(tmp_path)
+    monkeypatch.setattr(http_client, 'urlopen', urlopen)
+    return tmp_path
+
+
+@responses.activate
+def test_urlopen_reuses_cached_body_when_not_modified():
+    fake_url = 'http://a.fake/hub/trackDb.txt'
+    conditional_requests = []
+
+    def callback(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            conditional_requests.append(request.url)
+            return 304, {}, ''
+        return 200, {'ETag': '"v1"'}, 'track foo\ntype bigBed\n'
+
+    responses.add_callback(responses.GET, fake_url, callback=callback)
+
+    with hub_files_cache.urlopen(fake_url) as response:
+        assert list(response) == [b'track foo\n', b'type bigBed\n']
+    with hub_files_cache.urlopen(fake_url) as response:
+        assert list(response) == [b'track foo\n', b'type bigBed\n']
+    assert conditional_requests == [fake_url]
+
+
+@responses.activate
+def test_urlopen_without_validators_is_not_cached(cache_dir):
+    fake_url = 'http://a.fake/hub/hub.txt'
+    responses.add(responses.GET, fake_url, body='hub foo\n', status=200)
+
+    with hub_files_cache.urlopen(fake_url) as response:
+        assert list(response) == [b'hub foo\n']
+    assert not os.listdir(cache_dir)
+
+
+def test_evict_cache(cache_dir):
+    for number in range(3):
+        cached_file = cache_dir / 'cached_{}'.format(number)
+        cached_file.write_bytes(b'x' * 10)
+        os.utime(cached_file, (number, number))
+
+    assert hub_files_cache.evict_cache(max_size=15) == 2
+    assert os.listdir(cache_dir) == ['cached_2']
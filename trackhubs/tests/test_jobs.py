@@ -0,0 +1,132 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import time
+
+import pytest
+
+from trackhubs.jobs import claim_next_job, run_job, submit_hub
+from trackhubs.models import Hub, SubmissionJob
+
+HUB_URL = 'https://example.org/hub.txt'
+
+
+@pytest.fixture
+def submitter(django_user_model):
+    return django_user_model.objects.create_user(username='submitter', password='test-password')
+
+
+@pytest.mark.django_db
+def test_submit_hub_returns_the_queued_job(submitter, django_user_model):
+    job = submit_hub(HUB_URL, 'genomics', submitter)
+    # the pending job takes the parameters of the latest submission
+    assert submit_hub(HUB_URL, 'epigenomics', submitter, run_hubcheck=False).job_id == job.job_id
+    job.refresh_from_db()
+    assert (job.data_type, job.run_hubcheck) == ('epigenomics', False)
+
+    assert claim_next_job().job_id == job.job_id
+    assert submit_hub(HUB_URL, 'genomics', submitter).job_id == job.job_id
+    assert SubmissionJob.objects.count() == 1
+
+    # another user or a finished job get a new job
+    other_user = django_user_model.objects.create_user(username='otheruser', password='test-password')
+    assert submit_hub(HUB_URL, None, other_user).job_id != job.job_id
+    SubmissionJob.objects.filter(pk=job.job_id).update(status=SubmissionJob.DONE)
+    assert submit_hub(HUB_URL, None, submitter).job_id != job.job_id
+
+
+@pytest.mark.django_db
+def test_claim_next_job_requeues_abandoned_jobs(monkeypatch, settings, submitter):
+    settings.SUBMISSION_JOB_LEASE = 60
+    settings.SUBMISSION_JOB_MAX_ATTEMPTS = 2
+    job = submit_hub(HUB_URL, None, submitter)
+    assert claim_next_job().attempts == 1
+    # still running
+    assert claim_next_job() is None
+
+    # the worker died
+    SubmissionJob.objects.filter(pk=job.job_id).update(updated=int(time.time()) - 61)
+    reclaimed_job = claim_next_job()
+    assert (reclaimed_job.job_id, reclaimed_job.status, reclaimed_job.attempts) == (
+        job.job_id, SubmissionJob.RUNNING, 2
+    )
+
+    # the result of the first worker is dropped
+    monkeypatch.setattr(
+        'trackhubs.translator.save_and_update_document', lambda *args, **kwargs: {'success': 'late result'}
+    )
+    job.attempts = 1
+    run_job(job)
+    assert SubmissionJob.objects.get(pk=job.job_id).result is None
+
+    # too many attempts
+    SubmissionJob.objects.filter(pk=job.job_id).update(updated=int(time.time()) - 61)
+    assert claim_next_job() is None
+    job.refresh_from_db()
+    assert job.status == SubmissionJob.FAILED
+    assert 'interrupted 2 times' in job.result['error']
+
+
+@pytest.mark.django_db
+def test_run_job_checks_the_hub_owner_again(monkeypatch, submitter, django_user_model, create_datatype_resource):
+    other_user = django_user_model.objects.create_user(username='otheruser', password='test-password')
+    job = submit_hub(HUB_URL, None, other_user)
+    # the hub has been registered by another job in the meantime
+    Hub.objects.create(name='hub', url=HUB_URL, owner=submitter, data_type=create_datatype_resource)
+    monkeypatch.setattr(
+        'trackhubs.translator.save_and_update_document',
+        lambda *args, **kwargs: pytest.fail("the hub of another user shouldn't be ingested")
+    )
+
+    run_job(claim_next_job())
+
+    job.refresh_from_db()
+    assert (job.status, job.result) == (
+        SubmissionJob.FAILED, {'error': 'This hub is already submitted by a different user!'}
+    )
+    assert Hub.objects.get(url=HUB_URL).owner == submitter
+
+
+@pytest.mark.django_db
+def test_run_job_keeps_its_lease(monkeypatch, settings, submitter):
+    settings.SUBMISSION_JOB_LEASE = 0.03
+    submit_hub(HUB_URL, None, submitter)
+    job = claim_next_job()
+    renewed_leases = []
+    monkeypatch.setattr(SubmissionJob, 'renew_lease', lambda job: renewed_leases.append(job.job_id) or True)
+    # a long stage without any progress report
+    monkeypatch.setattr(
+        'trackhubs.translator.save_and_update_document', lambda *args, **kwargs: time.sleep(0.2) or {'success': 'ok'}
+    )
+
+    assert run_job(job).status == SubmissionJob.DONE
+    assert len(renewed_leases) >= 2
+
+
+@pytest.mark.django_db
+def test_run_job_stops_when_the_job_is_claimed_again(monkeypatch, submitter, create_datatype_resource):
+    submit_hub(HUB_URL, None, submitter)
+    job = claim_next_job()
+    Hub.objects.create(name='hub', url=HUB_URL, owner=submitter, data_type=create_datatype_resource)
+
+    def fake_save_and_update_document(*args, progress_callback=None, **kwargs):
+        # another worker has taken the job over
+        SubmissionJob.objects.filter(pk=job.job_id).update(attempts=2, result={'success': 'second worker'})
+        progress_callback('trackdbs')
+        pytest.fail("the ingestion should stop")
+
+    monkeypatch.setattr('trackhubs.translator.save_and_update_document', fake_save_and_update_document)
+    run_job(job)
+
+    assert SubmissionJob.objects.get(pk=job.job_id).result == {'success': 'second worker'}
+    assert Hub.objects.filter(url=HUB_URL).exists()
@@ -12,9 +12,12 @@
    limitations under the License.
 """
 
+import hashlib
+import io
 import logging
 import pytest
-from trackhubs.parser import parse_file_from_url
+from trackhubs import http_client
+from trackhubs.parser import ParserError, iter_file_from_url, parse_file_from_url
 
 # disable logging when running tests
 logging.disable(logging.CRITICAL)
@@ -97,3 +100,72 @@ def test_parse_trackdbs_success(project_dir):
 def test_parse_url_fail(test_url, expected_result):
     actual_result = parse_file_from_url(test_url)
     assert actual_result == expected_result
+
+
+def test_iter_file_from_url_yields_objects():
+    fake_genomes_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/genomes.txt'
+    stanzas = iter_file_from_url(fake_genomes_url)
+
+    assert next(stanzas) == {'genome': 'hg19', 'trackDb': 'hg19/trackDb.txt', 'url': fake_genomes_url}
+    assert next(stanzas) == {'genome': 'hg38', 'trackDb': 'hg38/trackDb.txt', 'url': fake_genomes_url}
+
+
+@pytest.mark.parametrize(
+    'max_file_size, max_stanza_size',
+    [
+        (50, None),
+        (None, 20),
+    ]
+)
+def test_iter_file_from_url_size_limits(max_file_size, max_stanza_size):
+    fake_trackdbs_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hg19/trackDb.txt'
+    with pytest.raises(ParserError):
+        list(iter_file_from_url(fake_trackdbs_url, max_file_size=max_file_size, max_stanza_size=max_stanza_size))
+
+
+@pytest.mark.parametrize(
+    'max_file_size, max_stanza_size',
+    [
+        (1000, 10000),
+        (10000, 1000),
+    ]
+)
+def test_iter_file_from_url_size_limits_without_line_endings(settings, monkeypatch, max_file_size, max_stanza_size):
+    settings.HUB_FILES_CACHE_DIR = ''
+    read_sizes = []
+
+    class FakeFile(io.BytesIO):
+        def readline(self, size=-1):
+            line = super().readline(size)
+            read_sizes.append(len(line))
+            return line
+
+        def __iter__(self):
+            return iter(self.readline, b'')
+
+    monkeypatch.setattr(
+        http_client, 'urlopen', lambda url, *args, **kwargs: FakeFile(b'track ' + b'x' * 1000000)
+    )
+
+    with pytest.raises(ParserError):
+        list(iter_file_from_url(
+            'http://a.fake/hub/hg38/trackDb.txt', max_file_size=max_file_size, max_stanza_size=max_stanza_size
+        ))
+    # the file isn't read further than the smallest limit
+    assert sum(read_sizes) <= 1001
+
+
+def test_iter_file_from_url_follows_includes(settings, monkeypatch):
+    settings.HUB_FILES_CACHE_DIR = ''
+    files = {
+        'http://a.fake/hub/hg38/trackDb.txt': b'track foo\ntype bigBed\n\ninclude extra/trackDb.ra alpha\n',
+        'http://a.fake/hub/hg38/extra/trackDb.ra': b'track bar\ntype bigWig\n',
+    }
+    monkeypatch.setattr(http_client, 'urlopen', lambda url, *args, **kwargs: io.BytesIO(files[url]))
+
+    checksum = hashlib.sha256()
+    stanzas = list(iter_file_from_url('http://a.fake/hub/hg38/trackDb.txt', checksum=checksum))
+
+    assert [stanza['track'] for stanza in stanzas] == ['foo', 'bar']
+    assert stanzas[1]['url'] == 'http://a.fake/hub/hg38/extra/trackDb.ra'
+    assert checksum.hexdigest() == hashlib.sha256(b''.join(files.values())).hexdigest()
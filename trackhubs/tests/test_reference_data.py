@@ -0,0 +1,57 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import pytest
+
+from trackhubs import models, reference_data
+from trackhubs.constants import VISIBILITY
+
+
+@pytest.mark.django_db
+def test_reference_data_is_seeded_once():
+    # the tables are filled by the post_migrate signal
+    assert set(reference_data.get_ids(models.Visibility)) == set(VISIBILITY)
+    assert reference_data.seed_reference_data() == 0
+
+
+@pytest.mark.django_db
+def test_lookups_are_served_from_memory(django_assert_num_queries):
+    with django_assert_num_queries(1):
+        hide_id = reference_data.get_id(models.Visibility, 'hide')
+        assert reference_data.get_id(models.Visibility, 'pack') is not None
+        assert reference_data.get_name(models.Visibility, hide_id) == 'hide'
+
+
+@pytest.mark.django_db
+def test_cache_is_invalidated_by_signals():
+    assert reference_data.get_id(models.FileType, 'newType') is None
+
+    new_file_type = models.FileType.objects.create(name='newType')
+    assert reference_data.get_id(models.FileType, 'newType') == new_file_type.pk
+
+    new_file_type.delete()
+    assert reference_data.get_id(models.FileType, 'newType') is None
+
+
+@pytest.mark.django_db
+def test_cache_expires(settings, django_assert_num_queries):
+    settings.REFERENCE_DATA_CACHE_TTL = 300
+    assert reference_data.get_id(models.FileType, 'newType') is None
+
+    # changed by another process, the signals aren't received here
+    new_file_type_id = models.FileType.objects.bulk_create([models.FileType(name='newType')])[0].pk
+    assert reference_data.get_id(models.FileType, 'newType') is None
+
+    settings.REFERENCE_DATA_CACHE_TTL = 0
+    with django_assert_num_queries(1):
+        assert reference_data.get_id(models.FileType, 'newType') == new_file_type_id
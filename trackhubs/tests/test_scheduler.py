@@ -0,0 +1,126 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import time
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from trackdbs import update_trackdb
+from trackdbs.scheduler import claim_due_trackdbs, get_check_interval, sync_schedule, update_due_trackdbs
+from trackhubs import models
+from trackhubs.utils import escape_ansi
+
+DAY = 24 * 60 * 60
+NOW = 1000 * DAY
+
+
+@pytest.mark.parametrize(
+    'check_interval, failing, last_change, expected_result',
+    [
+        ('automatic', False, NOW - DAY, DAY),
+        ('Weekly', False, NOW - DAY, 7 * DAY),
+        ('monthly', True, NOW - DAY, 15 * DAY),
+        ('automatic', True, NOW - DAY, DAY // 2),
+        # unchanged for a long time
+        ('weekly', False, NOW - 365 * DAY, 14 * DAY),
+        ('unknown', False, None, DAY),
+    ]
+)
+def test_get_check_interval(check_interval, failing, last_change, expected_result):
+    assert get_check_interval(check_interval, failing, last_change, NOW) == expected_result
+
+
+def test_get_check_interval_minimum(settings):
+    settings.STATUS_CHECK_MIN_INTERVAL = DAY
+    assert get_check_interval('automatic', True, NOW - DAY, NOW) == DAY
+
+
+@pytest.mark.django_db
+def test_update_due_trackdbs(create_trackhub_resource, monkeypatch):
+    owner = create_trackhub_resource.owner
+    owner.check_interval = 'weekly'
+    owner.save()
+    trackdb_ids = sorted(models.Trackdb.objects.values_list('trackdb_id', flat=True))
+    updated_ids = []
+    monkeypatch.setattr(
+        update_trackdb, 'update_one_trackdb', lambda trackdb_id, indexer=None: updated_ids.append(trackdb_id)
+    )
+
+    actual_result = update_due_trackdbs(max_trackdbs=1)
+
+    assert actual_result == {'checked': 1, 'failed': 0, 'remaining': 1}
+    schedule = models.TrackdbSchedule.objects.get(trackdb_id=updated_ids[0])
+    assert schedule.next_check - schedule.last_checked == 7 * DAY
+
+    # only the trackdb that is still due is checked
+    actual_result = update_due_trackdbs()
+
+    assert actual_result == {'checked': 1, 'failed': 0, 'remaining': 0}
+    assert sorted(updated_ids) == trackdb_ids
+
+
+@pytest.mark.django_db
+def test_update_due_trackdbs_skips_claimed_trackdbs(create_trackhub_resource, monkeypatch):
+    trackdb_ids = sorted(models.Trackdb.objects.values_list('trackdb_id', flat=True))
+    updated_ids = []
+    monkeypatch.setattr(
+        update_trackdb, 'update_one_trackdb', lambda trackdb_id, indexer=None: updated_ids.append(trackdb_id)
+    )
+    sync_schedule()
+    # another run is checking the first trackdb
+    assert claim_due_trackdbs(int(time.time()), 1) == trackdb_ids[:1]
+
+    actual_result = update_due_trackdbs()
+
+    assert actual_result == {'checked': 1, 'failed': 0, 'remaining': 0}
+    assert updated_ids == trackdb_ids[1:]
+
+
+@pytest.mark.django_db
+def test_update_due_trackdbs_counts_elasticsearch_failures(create_trackhub_resource, monkeypatch):
+    owner = create_trackhub_resource.owner
+    owner.check_interval = 'weekly'
+    owner.save()
+    trackdb_ids = sorted(models.Trackdb.objects.values_list('trackdb_id', flat=True))
+
+    def fake_update_one_trackdb(trackdb_id, indexer=None):
+        indexer.add('trackhubs', trackdb_id, {'status': {}})
+        return trackdb_id
+
+    monkeypatch.setattr(update_trackdb, 'update_one_trackdb', fake_update_one_trackdb)
+    monkeypatch.setattr(
+        'trackhubs.es_bulk.BulkIndexer.flush', lambda indexer: {('trackhubs', trackdb_ids[0]): 'rejected'}
+    )
+
+    actual_result = update_due_trackdbs()
+
+    assert actual_result == {'checked': 2, 'failed': 1, 'remaining': 0}
+    intervals = {
+        schedule.trackdb_id: schedule.next_check - schedule.last_checked
+        for schedule in models.TrackdbSchedule.objects.all()
+    }
+    # the trackdb whose document is outdated is checked again sooner
+    assert intervals == {trackdb_ids[0]: 7 * DAY // 2, trackdb_ids[1]: 7 * DAY}
+
+
+@pytest.mark.django_db
+def test_update_due_status_command(create_trackdb_resource, monkeypatch):
+    monkeypatch.setattr(update_trackdb, 'update_one_trackdb', lambda trackdb_id, indexer=None: None)
+    models.TrackdbSchedule.objects.create(trackdb=create_trackdb_resource, next_check=int(time.time()) + DAY)
+    out = StringIO()
+
+    call_command('update_due_status', stdout=out)
+
+    assert escape_ansi(out.getvalue()) == '0 trackdbs checked (0 failed), 0 trackdbs still due\n'
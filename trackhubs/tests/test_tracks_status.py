@@ -13,8 +13,23 @@
 """
 
 import logging
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
-from trackhubs.tracks_status import fix_big_data_url, check_response
+import requests
+import responses
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from trackhubs import http_client, models, tracks_status
+# imported before conftest.py replaces http_client.urlopen with the fake one
+from trackhubs.http_client import urlopen
+from trackhubs.tracks_status import (
+    HOST_UNREACHABLE, fix_big_data_url, check_response, check_urls, fetch_tracks_status, probe_url,
+    save_tracks_status
+)
 
 # disable logging when running tests
 logging.disable(logging.CRITICAL)
@@ -44,3 +59,265 @@ def test_fix_big_data_url(big_data_url, trackdb_url, expected_result):
 def test_check_response(big_data_url, expected_result):
     actual_result = check_response(big_data_url)
     assert actual_result == expected_result
+
+
+def test_check_urls_per_host_limit(settings, monkeypatch):
+    settings.STATUS_CHECK_MAX_PER_HOST = 2
+    running = {}
+    max_running = {}
+    lock = threading.Lock()
+
+    def fake_probe_url(url, timeout=None):
+        host = url.split('/')[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            max_running[host] = max(max_running.get(host, 0), running[host])
+        time.sleep(0.01)
+        with lock:
+            running[host] -= 1
+        return {'status': 200, 'content_length': None, 'last_modified': None}
+
+    monkeypatch.setattr(tracks_status, 'probe_url', fake_probe_url)
+    urls = ['http://{}.fake/{}.bb'.format(host, number) for host in ('a', 'b') for number in range(6)]
+
+    actual_result = check_urls(urls + urls[:3])
+
+    assert {url: result['status'] for url, result in actual_result.items()} == {url: 200 for url in urls}
+    assert max_running == {'a.fake': 2, 'b.fake': 2}
+
+
+def test_check_urls_slow_host_doesnt_hold_the_pool(settings, monkeypatch):
+    settings.STATUS_CHECK_MAX_PER_HOST = 1
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(tracks_status, '_get_executor', lambda: executor)
+    slow_host_released = threading.Event()
+
+    def fake_probe_url(url, timeout=None):
+        if 'slow.fake' in url:
+            slow_host_released.wait(5)
+        return {'status': 200, 'content_length': None, 'last_modified': None}
+
+    monkeypatch.setattr(tracks_status, 'probe_url', fake_probe_url)
+    # several trackdbs pointing to the same slow host are checked at the same time
+    slow_checks = [
+        threading.Thread(target=check_urls, args=(['http://slow.fake/{}/{}.bb'.format(trackdb, number)
+                                                   for number in range(3)],))
+        for trackdb in range(3)
+    ]
+    for slow_check in slow_checks:
+        slow_check.start()
+    time.sleep(0.1)
+
+    fast_check = threading.Thread(target=check_urls, args=(['http://fast.fake/foo.bb'],))
+    fast_check.start()
+    fast_check.join(2)
+    assert not fast_check.is_alive()
+
+    slow_host_released.set()
+    for slow_check in slow_checks:
+        slow_check.join(5)
+        assert not slow_check.is_alive()
+    executor.shutdown()
+
+
+def test_probe_url_gives_back_the_half_open_trial(settings, monkeypatch):
+    settings.STATUS_CHECK_BREAKER_RESET = 60
+    breaker = tracks_status._get_host_breaker('a.fake')
+    breaker.opened_at = time.time() - 61
+
+    def fake_probe_http(url, timeout):
+        raise ValueError('unexpected')
+
+    monkeypatch.setattr(tracks_status, '_probe_http', fake_probe_http)
+    with pytest.raises(ValueError):
+        probe_url('http://a.fake/foo.bb')
+
+    # the host can be tried again
+    assert breaker.allow_request()
+
+
+@pytest.mark.django_db
+def test_fetch_tracks_status():
+    tracks = [
+        models.Track(name='ok', big_data_url='http://expdata.cmmt.ubc.ca/JASPAR/downloads/UCSC_tracks/2020/JASPAR2020_hg38.bb'),
+        models.Track(name='forbidden', big_data_url='http://some.org/random/url/foo.cram'),
+        models.Track(name='no_data'),
+    ]
+    actual_result = fetch_tracks_status(tracks, 'http://some.org/random/url/trackDb.txt')
+
+    assert actual_result['message'] == 'Remote Data Unavailable'
+    assert actual_result['tracks'] == {
+        'total': 3,
+        'with_data': {
+            'total': 2,
+            'total_ko': 1,
+            'ko': {'forbidden': ['http://some.org/random/url/foo.cram', '403: Forbidden']}
+        }
+    }
+
+
+@responses.activate
+def test_probe_url_head(monkeypatch):
+    monkeypatch.setattr(http_client, 'urlopen', urlopen)
+    fake_url = 'http://a.fake/data/foo.bb'
+    responses.add(responses.HEAD, fake_url, status=200, headers={
+        'Content-Length': '123456789', 'Last-Modified': 'Wed, 01 Jan 2020 12:00:00 GMT'
+    })
+
+    assert probe_url(fake_url) == {
+        'status': 200, 'content_length': 123456789, 'last_modified': 'Wed, 01 Jan 2020 12:00:00 GMT'
+    }
+    assert [call.request.method for call in responses.calls] == ['HEAD']
+
+
+@responses.activate
+def test_probe_url_falls_back_to_range_request(monkeypatch):
+    monkeypatch.setattr(http_client, 'urlopen', urlopen)
+    fake_url = 'http://a.fake/data/foo.bam'
+    responses.add(responses.HEAD, fake_url, status=405)
+    responses.add(responses.GET, fake_url, status=206, body=b'x', headers={'Content-Range': 'bytes 0-0/5000'})
+
+    assert probe_url(fake_url) == {'status': 200, 'content_length': 5000, 'last_modified': None}
+    assert responses.calls[1].request.headers['Range'] == 'bytes=0-0'
+
+
+def test_check_urls_circuit_breaker(settings, monkeypatch):
+    settings.STATUS_CHECK_MAX_PER_HOST = 1
+    settings.STATUS_CHECK_BREAKER_THRESHOLD = 2
+    settings.STATUS_CHECK_BREAKER_RESET = 60
+    probed_urls = []
+    host_is_down = True
+
+    def fake_probe_http(url, timeout):
+        probed_urls.append(url)
+        if host_is_down and url.startswith('http://down.fake'):
+            cause = requests.exceptions.ConnectionError('Connection refused')
+            raise urllib.error.URLError(cause) from cause
+        if 'missing' in url:
+            raise urllib.error.HTTPError(url, 404, 'Not Found', {}, None)
+        return 200, {}
+
+    monkeypatch.setattr(tracks_status, '_probe_http', fake_probe_http)
+    down_urls = ['http://down.fake/{}.bb'.format(number) for number in range(5)]
+    up_urls = ['http://up.fake/missing{}.bb'.format(number) for number in range(3)] + ['http://up.fake/foo.bb']
+
+    actual_result = check_urls(down_urls + up_urls)
+
+    # 404 errors don't open the circuit
+    assert sorted(probed_urls) == sorted(down_urls[:2] + up_urls)
+    assert [actual_result[url]['status'] for url in down_urls] == ['Connection refused'] * 2 + [HOST_UNREACHABLE] * 3
+    assert actual_result['http://up.fake/foo.bb']['status'] == 200
+
+    # half-open: one url is tried again after STATUS_CHECK_BREAKER_RESET seconds
+    tracks_status._get_host_breaker('down.fake').opened_at -= 61
+    host_is_down = False
+    probed_urls.clear()
+    actual_result = check_urls(down_urls)
+
+    assert sorted(probed_urls) == down_urls
+    assert all(result['status'] == 200 for result in actual_result.values())
+
+
+@pytest.mark.django_db
+def test_save_tracks_status(create_trackdb_resource, create_visibility_resource):
+    trackdb = create_trackdb_resource
+    for name, big_data_url in (('ok', 'ok.bb'), ('broken', 'broken.bb'), ('no_data', None)):
+        models.Track.objects.create(
+            name=name, big_data_url=big_data_url, trackdb=trackdb, visibility=create_visibility_resource
+        )
+
+    def fake_status(last_update, broken):
+        ko = {'broken': ['http://some.random/url/for/broken.bb', '404: Not Found']} if broken else {}
+        return tracks_status.build_tracks_status(3, 2, ko, last_update)
+
+    save_tracks_status(trackdb, fake_status(1000, broken=True))
+    actual_result = save_tracks_status(trackdb, fake_status(2000, broken=True))
+
+    assert actual_result == fake_status(2000, broken=True)
+    broken_track_status = models.TrackStatus.objects.get(track__name='broken')
+    assert (broken_track_status.consecutive_failures, broken_track_status.first_failure) == (2, 1000)
+    assert models.TrackStatus.objects.get(track__name='ok').last_result == 200
+    assert not models.TrackStatus.objects.filter(track__name='no_data').exists()
+
+    # the track is fixed
+    actual_result = save_tracks_status(trackdb, fake_status(3000, broken=False))
+
+    assert actual_result == fake_status(3000, broken=False)
+    broken_track_status.refresh_from_db()
+    assert (broken_track_status.consecutive_failures, broken_track_status.first_failure) == (0, None)
+
+
+@pytest.mark.django_db
+def test_save_tracks_status_keeps_the_history_of_unchecked_tracks(
+        create_trackdb_resource, create_visibility_resource, monkeypatch):
+    trackdb = create_trackdb_resource
+    tracks = [
+        models.Track.objects.create(
+            name=name, big_data_url=name + '.bb', trackdb=trackdb, visibility=create_visibility_resource
+        )
+        for name in ('probed', 'reused', 'skipped')
+    ]
+    full_urls = {track.name: fix_big_data_url(track.big_data_url, trackdb.source_url) for track in tracks}
+    previous_status = save_tracks_status(trackdb, tracks_status.build_tracks_status(
+        3, 3, {name: [url, '404: Not Found'] for name, url in full_urls.items()}, 1000
+    ))
+    # the host of 'skipped' is unreachable, its url isn't checked
+    monkeypatch.setattr(tracks_status, 'probe_url', lambda url, timeout=None: {
+        'status': HOST_UNREACHABLE if 'skipped' in url else '404: Not Found',
+        'content_length': None, 'last_modified': None
+    })
+
+    status = fetch_tracks_status(
+        tracks, trackdb.source_url, previous_status=previous_status,
+        unchanged_tracks={('reused', 'reused.bb')}, use_url_cache=False
+    )
+    assert status['not_checked'] == ['reused', 'skipped']
+    actual_result = save_tracks_status(trackdb, status)
+
+    assert 'not_checked' not in actual_result
+    assert actual_result['tracks']['with_data']['total_ko'] == 3
+    history = {
+        track_status.track.name: (track_status.consecutive_failures, track_status.last_checked)
+        for track_status in models.TrackStatus.objects.select_related('track')
+    }
+    assert history == {'probed': (2, status['last_update']), 'reused': (1, 1000), 'skipped': (1, 1000)}
+
+
+@pytest.mark.django_db
+def test_save_tracks_status_on_mysql(create_trackdb_resource, create_visibility_resource, monkeypatch):
+    """
+    MySQL upserts on any unique key and rejects unique_fields
+    """
+    models.Track.objects.create(
+        name='ok', big_data_url='ok.bb', trackdb=create_trackdb_resource, visibility=create_visibility_resource
+    )
+    monkeypatch.setattr(connection.features, 'supports_update_conflicts_with_target', False)
+    bulk_create_options = []
+    monkeypatch.setattr(
+        models.TrackStatus.objects, 'bulk_create', lambda objs, **kwargs: bulk_create_options.append(kwargs)
+    )
+    save_tracks_status(create_trackdb_resource, tracks_status.build_tracks_status(1, 1, {}, 1000))
+
+    assert bulk_create_options[0]['update_conflicts']
+    assert 'unique_fields' not in bulk_create_options[0]
+
+
+@pytest.mark.django_db
+def test_fetch_tracks_status_queryset(create_trackdb_resource, create_visibility_resource, monkeypatch):
+    trackdb = create_trackdb_resource
+    for name, big_data_url in (('ok', 'ok.bb'), ('no_data', None)):
+        models.Track.objects.create(
+            name=name, big_data_url=big_data_url, trackdb=trackdb, visibility=create_visibility_resource
+        )
+    monkeypatch.setattr(tracks_status, 'probe_url', lambda url, timeout=None: {
+        'status': 200, 'content_length': None, 'last_modified': None
+    })
+
+    with CaptureQueriesContext(connection) as queries:
+        actual_result = fetch_tracks_status(models.Track.objects.filter(trackdb=trackdb), trackdb.source_url)
+
+    assert actual_result['tracks'] == {'total': 2, 'with_data': {'total': 1, 'total_ko': 0}}
+    # the track objects aren't loaded, only the columns needed
+    track_queries = [query['sql'] for query in queries.captured_queries if '"track"' in query['sql']]
+    assert len(track_queries) == 2
+    assert all('additional_properties' not in sql for sql in track_queries)
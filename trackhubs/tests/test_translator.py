@@ -36,18 +36,21 @@ def test_save_datatype_filetype_visibility():
 
 @pytest.mark.django_db
 def test_get_datatype_filetype_visibility():
-    actual_datatype_obj = models.DataType.objects.create(name='genomics')
-    expected_datatype_obj = translator.get_datatype_filetype_visibility('genomics', models.DataType)
+    # the constants are already seeded, new rows are picked up as soon as they're saved
+    actual_datatype_obj = models.DataType.objects.create(name='metagenomics')
+    expected_datatype_obj = translator.get_datatype_filetype_visibility('metagenomics', models.DataType)
     assert actual_datatype_obj == expected_datatype_obj
 
-    actual_filetype_obj = models.FileType.objects.create(name='bam')
-    expected_filetype_obj = translator.get_datatype_filetype_visibility('bam', models.FileType)
+    actual_filetype_obj = models.FileType.objects.create(name='fakeType')
+    expected_filetype_obj = translator.get_datatype_filetype_visibility('fakeType 6 +', models.FileType, True)
     assert actual_filetype_obj == expected_filetype_obj
 
-    actual_visibility_obj = models.Visibility.objects.create(name='hide')
-    expected_visibility_obj = translator.get_datatype_filetype_visibility('hide', models.Visibility)
+    actual_visibility_obj = models.Visibility.objects.create(name='hidden')
+    expected_visibility_obj = translator.get_datatype_filetype_visibility('hidden', models.Visibility)
     assert actual_visibility_obj == expected_visibility_obj
 
+    assert translator.get_datatype_filetype_visibility('unknown', models.Visibility) is None
+
 
 @pytest.mark.django_db
 def test_save_hub(create_hub_resource):
@@ -80,6 +83,61 @@ def test_save_assembly(create_assembly_resource):
     assert expected_assembly_info['name'] == create_assembly_resource.name
 
 
+@pytest.mark.parametrize(
+    'genome_assembly_name, expected_accession',
+    [
+        ('GRCh38', 'GCA_000001405.15'),  # assembly_name
+        ('hg19', 'GCA_000001405.1'),  # ucsc_synonym
+        ('GCA_000001405.15', 'GCA_000001405.15'),  # accession_with_version
+        ('hg38', 'GCA_000001405.15'),  # ucsc_synonym wins over the UCSC_TO_INSDC mapping
+        ('unknown', None),
+    ]
+)
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_get_assembly_info_from_dump(genome_assembly_name, expected_accession, django_assert_num_queries):
+    # the generation check and the lookup itself
+    with django_assert_num_queries(2):
+        assembly_info = translator.get_assembly_info_from_dump(genome_assembly_name)
+    assert getattr(assembly_info, 'accession_with_version', None) == expected_accession
+
+    # the result is memoized, unless the name is unknown
+    with django_assert_num_queries(0 if expected_accession else 1):
+        assert translator.get_assembly_info_from_dump(genome_assembly_name) == assembly_info
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_get_assembly_info_from_dump_precedence():
+    # a row whose assembly name is another row's UCSC synonym is picked first
+    models.GenomeAssemblyDump.objects.create(
+        accession='GCA_000000001', version=1, accession_with_version='GCA_000000001.1',
+        assembly_name='hg19', tax_id=1, scientific_name='Fake species'
+    )
+    assert translator.get_assembly_info_from_dump('hg19').accession_with_version == 'GCA_000000001.1'
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_species_and_assemblies(django_assert_max_num_queries):
+    # one lookup, then for species and assemblies: existing rows, bulk insert and new ids
+    with django_assert_max_num_queries(8):
+        species_by_genome, assemblies_by_genome = translator.save_species_and_assemblies(['hg19', 'GRCh38'])
+
+    assert models.Species.objects.count() == 1
+    assert species_by_genome['hg19'] == species_by_genome['GRCh38']
+    assert species_by_genome['hg19'].taxon_id == 9606
+    assert assemblies_by_genome['hg19'].name == 'GRCh37'
+    assert assemblies_by_genome['GRCh38'].accession == 'GCA_000001405.15'
+
+    # existing rows are reused
+    _, assemblies_by_genome_again = translator.save_species_and_assemblies(['hg19'])
+    assert assemblies_by_genome_again['hg19'].pk == assemblies_by_genome['hg19'].pk
+    assert models.Assembly.objects.count() == 2
+
+    assert 'error' in translator.save_species_and_assemblies(['hg19', 'unknown'])
+
+
 @pytest.mark.django_db
 def test_save_trackdb(create_trackdb_resource):
     expected_trackdb_info = {
@@ -107,6 +165,149 @@ def test_save_track(create_track_resource):
     assert expected_track_info['bigDataUrl'] == create_track_resource.big_data_url
 
 
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_filetype_resource', 'create_visibility_resource')
+def test_bulk_update_or_create_tracks(create_trackdb_resource):
+    models.Visibility.objects.create(name='hide')
+    tracks_info = [
+        {
+            'track': 'parent_track on',
+            'shortLabel': 'Parent track',
+            'type': 'bam',
+        },
+        {
+            'track': 'child_track',
+            'shortLabel': 'Child track',
+            'longLabel': 'Child track long label',
+            'type': 'bam 6 +',
+            'visibility': 'pack',
+            'bigDataUrl': 'child_track.bam',
+        },
+    ]
+    saved_tracks, tracks_changes = translator.bulk_update_or_create_tracks(
+        tracks_info, create_trackdb_resource, batch_size=1
+    )
+
+    assert [track.name for track in saved_tracks] == ['parent_track', 'child_track']
+    assert all(track.track_id is not None for track in saved_tracks)
+    assert saved_tracks[0].visibility.name == 'hide'
+    assert saved_tracks[1].visibility.name == 'pack'
+    assert saved_tracks[1].file_type.name == 'bam'
+    assert saved_tracks[1].big_data_url == 'child_track.bam'
+    assert tracks_changes == {'created': 2, 'updated': 0, 'deleted': 0}
+
+    # resubmitting the same trackdb updates the existing rows instead of duplicating them
+    tracks_info[1]['shortLabel'] = 'Updated child track'
+    updated_tracks, tracks_changes = translator.bulk_update_or_create_tracks(tracks_info, create_trackdb_resource)
+
+    assert models.Track.objects.filter(trackdb=create_trackdb_resource).count() == 2
+    assert updated_tracks[1].track_id == saved_tracks[1].track_id
+    assert updated_tracks[1].shortLabel == 'Updated child track'
+    assert tracks_changes == {'created': 0, 'updated': 1, 'deleted': 0}
+
+    # tracks removed from the trackDb file are deleted
+    _, tracks_changes = translator.bulk_update_or_create_tracks(tracks_info[1:], create_trackdb_resource)
+
+    assert list(models.Track.objects.filter(trackdb=create_trackdb_resource).values_list('name', flat=True)) == [
+        'child_track'
+    ]
+    assert tracks_changes == {'created': 0, 'updated': 0, 'deleted': 1}
+
+
+@pytest.mark.django_db
+def test_add_tracks_parents(create_trackdb_resource, create_track_resource, create_child_track_resource):
+    # a track with the same name in another trackdb must not be picked as parent
+    other_trackdb = models.Trackdb.objects.create(
+        assembly=create_trackdb_resource.assembly,
+        hub=create_trackdb_resource.hub,
+        species=create_trackdb_resource.species,
+        source_url='http://another.random/url/for/trackDb.txt'
+    )
+    models.Track.objects.create(
+        name='JASPAR2020_TFBS_hg19', trackdb=other_trackdb, visibility=create_track_resource.visibility
+    )
+    tracks_info = [
+        {'track': 'Child track name', 'parent': 'JASPAR2020_TFBS_hg19 off'},
+        {'track': 'JASPAR2020_TFBS_hg19'},
+    ]
+    child_tracks = translator.add_tracks_parents(tracks_info, [create_child_track_resource, create_track_resource])
+
+    create_child_track_resource.refresh_from_db()
+    assert child_tracks == [create_child_track_resource]
+    assert create_child_track_resource.parent_id == create_track_resource.track_id
+
+
+def test_build_trackdb_configuration():
+    tracks_info = [
+        {'track': 'subsubtrack', 'parent': 'subtrack', 'url': 'https://url/to/trackDb.txt'},
+        {'track': 'supertrack', 'superTrack': 'on', 'url': 'https://url/to/trackDb.txt'},
+        {'track': 'subtrack', 'parent': 'supertrack on', 'url': 'https://url/to/trackDb.txt'},
+    ]
+    actual_result = translator.build_trackdb_configuration(tracks_info)
+
+    assert list(actual_result.keys()) == ['subsubtrack', 'supertrack', 'subtrack']
+    assert 'url' not in actual_result['subsubtrack']
+    assert actual_result['supertrack']['members']['subtrack']['members']['subsubtrack'] == {
+        'track': 'subsubtrack', 'parent': 'subtrack'
+    }
+
+
+def test_iter_fetched_trackdbs():
+    base_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS'
+    trackdbs_urls = [base_url + '/hg19/trackDb.txt', base_url + '/hg38/trackDb.txt', base_url + '/hg38/trackDb.txt']
+    actual_result = dict(translator.iter_fetched_trackdbs(trackdbs_urls, max_workers=2))
+
+    assert set(actual_result.keys()) == set(trackdbs_urls[:2])
+    tracks_info, tracks_status, checksum = actual_result[base_url + '/hg38/trackDb.txt']
+    assert [track['track'] for track in tracks_info] == ['JASPAR2020_TFBS_hg38']
+    assert tracks_status['tracks']['with_data']['total'] == 1
+    assert tracks_status['message'] == 'All is Well'
+    assert len(checksum) == 64
+
+
+def test_iter_fetched_trackdbs_bounds_the_pending_results(monkeypatch):
+    fetched_urls = []
+    monkeypatch.setattr(
+        translator, 'fetch_trackdb', lambda url, *args: fetched_urls.append(url) or ([], None, url)
+    )
+    trackdbs_urls = [f'http://a.fake/{number}/trackDb.txt' for number in range(10)]
+
+    fetched_trackdbs = translator.iter_fetched_trackdbs(trackdbs_urls, max_workers=2)
+    next(fetched_trackdbs)
+
+    # the other trackDb files are fetched as the results are consumed
+    assert len(fetched_urls) <= 3
+    fetched_trackdbs.close()
+    assert len(fetched_urls) <= 3
+
+
+def test_fetch_trackdb_unchanged_content():
+    trackdb_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hg38/trackDb.txt'
+    _, _, checksum = translator.fetch_trackdb(trackdb_url)
+
+    # the tracks status is checked again only if it's requested
+    assert translator.fetch_trackdb(trackdb_url, {'checksum': checksum})[1] is None
+    assert translator.fetch_trackdb(trackdb_url, {'checksum': checksum}, refresh_status=True)[1] is not None
+
+
+def test_fetch_trackdb_checks_new_big_data_urls_only(monkeypatch):
+    trackdb_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hg38/trackDb.txt'
+    tracks_info, _, _ = translator.fetch_trackdb(trackdb_url)
+    track = tracks_info[0]
+    big_data_url = track['bigDataUrl']
+    previous_status = {'tracks': {'with_data': {'ko': {
+        'JASPAR2020_TFBS_hg38': [translator.fix_big_data_url(big_data_url, trackdb_url), '404: Not Found']
+    }}}}
+
+    monkeypatch.setattr(
+        'trackhubs.tracks_status.probe_url', lambda url: pytest.fail(f"{url} shouldn't be checked")
+    )
+    _, tracks_status, _ = translator.fetch_trackdb(trackdb_url, {
+        'checksum': 'outdated', 'status': previous_status, 'tracks': {('JASPAR2020_TFBS_hg38', big_data_url)}
+    })
+    assert tracks_status['tracks']['with_data']['total_ko'] == 1
+
+
 @pytest.mark.parametrize(
     'string_with_spaces, expected_result',
     [
@@ -163,6 +364,195 @@ def test_save_and_update_document_success(project_dir, create_user_resource, cre
     assert actual_result == expected_result
 
 
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_skips_unchanged_trackdbs(
+        monkeypatch, create_user_resource):
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+    assert models.Trackdb.objects.filter(source_checksum__isnull=True).count() == 0
+
+    def fail(*args, **kwargs):
+        raise AssertionError("unchanged trackdbs shouldn't be saved again")
+
+    monkeypatch.setattr(translator, 'bulk_update_or_create_tracks', fail)
+    monkeypatch.setattr(translator, 'fetch_tracks_status', fail)
+    actual_result = translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+    assert actual_result == {'success': 'The hub is submitted/updated successfully'}
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_pushes_hub_changes_to_unchanged_trackdbs(
+        monkeypatch, settings, create_user_resource):
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+    models.Hub.objects.filter(url=fake_hub_url).update(shortLabel='Outdated label')
+    models.Trackdb.objects.update(updated=1, status_updated=1)
+
+    partial_documents = {}
+    monkeypatch.setattr(
+        models.Trackdb, 'partial_update_trackdb_document',
+        lambda trackdb, doc, index, indexer=None: partial_documents.setdefault(trackdb.trackdb_id, {}).update(doc)
+    )
+    # the status refresh doesn't index the whole document again
+    indexed_trackdbs = []
+    settings.ELASTICSEARCH_DSL_AUTOSYNC = True
+    monkeypatch.setattr(
+        'search.documents.TrackdbDocument.update', lambda document, instance, **kwargs: indexed_trackdbs.append(instance)
+    )
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='epigenomics', current_user=user, run_hubcheck=False, refresh_status=True
+    )
+
+    hub = models.Hub.objects.get(url=fake_hub_url)
+    assert hub.shortLabel != 'Outdated label'
+    assert set(partial_documents) == set(models.Trackdb.objects.values_list('trackdb_id', flat=True))
+    for doc in partial_documents.values():
+        assert doc['type'] == 'epigenomics'
+        assert doc['hub']['shortLabel'] == hub.shortLabel
+        assert doc['owner'] == user.username
+        assert 'status' in doc
+        # a status check isn't a change of the trackdb
+        assert 'updated' not in doc and doc['status_updated'] > 1
+    assert not indexed_trackdbs
+    assert set(models.Trackdb.objects.values_list('updated', flat=True)) == {1}
+    assert 1 not in models.Trackdb.objects.values_list('status_updated', flat=True)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_applies_changes_only(
+        monkeypatch, create_user_resource):
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+    tracks_ids = set(models.Track.objects.values_list('track_id', flat=True))
+    models.Trackdb.objects.update(source_checksum='outdated')
+
+    partial_documents = []
+    monkeypatch.setattr(
+        models.Trackdb, 'partial_update_trackdb_document', lambda trackdb, doc, index, indexer=None: partial_documents.append(doc)
+    )
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+
+    # the tracks are kept as they are and the unchanged fields aren't sent to Elasticsearch
+    assert set(models.Track.objects.values_list('track_id', flat=True)) == tracks_ids
+    assert len(partial_documents) == 2
+    assert all('data' not in doc and 'configuration' not in doc for doc in partial_documents)
+    assert all(len(doc['source']['checksum']) == 64 for doc in partial_documents)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_with_autosync(
+        monkeypatch, settings, create_user_resource):
+    """
+    The autosync replaces the whole document when a trackdb is saved, the partial update sent after it
+    has to bring back the fields that aren't in TrackdbDocument
+    """
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+    models.Trackdb.objects.update(source_checksum='outdated')
+
+    documents = {}
+    settings.ELASTICSEARCH_DSL_AUTOSYNC = True
+    monkeypatch.setattr(
+        'search.documents.TrackdbDocument.update',
+        lambda document, instance, **kwargs: documents.__setitem__(instance.trackdb_id, {'indexed': True})
+    )
+    monkeypatch.setattr(
+        models.Trackdb, 'partial_update_trackdb_document',
+        lambda trackdb, doc, index, indexer=None: documents[trackdb.trackdb_id].update(doc)
+    )
+    translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+
+    assert len(documents) == 2
+    for doc in documents.values():
+        assert {'owner', 'file_type', 'browser_links', 'source', 'type', 'hub'} <= set(doc)
+        assert doc['file_type']
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_caches_hub_check(
+        monkeypatch, create_user_resource):
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    checked_hubs = []
+
+    def fake_hub_check(hub_url):
+        checked_hubs.append(hub_url)
+        return {'success': 'hubCheck done! Nothing to report!'}
+
+    monkeypatch.setattr(translator, 'hub_check', fake_hub_check)
+    for _ in range(2):
+        actual_result = translator.save_and_update_document(
+            hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=True
+        )
+        assert actual_result == {'success': 'The hub is submitted/updated successfully'}
+
+    # the unchanged hub isn't checked again
+    assert checked_hubs == [fake_hub_url]
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_hub_check_error(
+        monkeypatch, create_user_resource):
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    monkeypatch.setattr(translator, 'hub_check', lambda hub_url: {'error': 'Error in hub', 'details': []})
+
+    actual_result = translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=True
+    )
+
+    assert actual_result == {'error': 'Error in hub', 'details': []}
+    assert not models.Hub.objects.filter(url=fake_hub_url).exists()
+    assert not models.HubCheckResult.objects.exists()
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('create_genome_assembly_dump_resource')
+def test_save_and_update_document_trackdb_error_discards_new_hub(
+        monkeypatch, settings, create_user_resource):
+    user, _ = create_user_resource
+    fake_hub_url = 'https://raw.githubusercontent.com/Ensembl/thr/master/samples/JASPAR_TFBS/hub.txt'
+    # the hg19 trackDb file is saved before the hg38 one is found broken
+    settings.GENOMES_MAX_WORKERS = 1
+    fetch_trackdb = translator.fetch_trackdb
+    monkeypatch.setattr(
+        translator, 'fetch_trackdb',
+        lambda url, *args: (None, None, None) if 'hg38' in url else fetch_trackdb(url, *args)
+    )
+
+    actual_result = translator.save_and_update_document(
+        hub_url=fake_hub_url, data_type='genomics', current_user=user, run_hubcheck=False
+    )
+
+    assert 'hg38/trackDb.txt' in actual_result['error']
+    assert not models.Hub.objects.filter(url=fake_hub_url).exists()
+    assert not models.Trackdb.objects.exists()
+
+
 @pytest.mark.parametrize(
     'hub_url, expected_error_key_result',
     [
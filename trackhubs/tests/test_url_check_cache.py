@@ -0,0 +1,113 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import time
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from trackhubs import models, tracks_status, url_check_cache
+from trackhubs.tracks_status import fetch_tracks_status
+
+
+def _result(status=200, content_length=None):
+    return {'status': status, 'content_length': content_length, 'last_modified': None}
+
+
+@pytest.mark.django_db
+def test_cached_results_expire(settings):
+    settings.URL_CHECK_CACHE_TTL = 60
+    url_check_cache.save_results({'http://a.fake/foo.bb': _result(), 'http://a.fake/bar.bb': _result('404: Not Found')})
+    models.UrlCheckResult.objects.filter(url='http://a.fake/bar.bb').update(checked_at=int(time.time()) - 61)
+
+    actual_result = url_check_cache.get_cached_results(['http://a.fake/foo.bb', 'http://a.fake/bar.bb'])
+
+    assert actual_result == {'http://a.fake/foo.bb': _result()}
+
+
+@pytest.mark.django_db
+def test_save_results_replaces_and_evict_cache(settings, django_assert_num_queries):
+    settings.URL_CHECK_CACHE_TTL = 60
+    settings.URL_CHECK_CACHE_MAX_ENTRIES = 2
+    url_check_cache.save_results({'http://a.fake/1.bb': _result(), 'http://a.fake/2.bb': _result()})
+    models.UrlCheckResult.objects.filter(url='http://a.fake/1.bb').update(checked_at=int(time.time()) - 20)
+    models.UrlCheckResult.objects.filter(url='http://a.fake/2.bb').update(checked_at=int(time.time()) - 10)
+    # checked again, it becomes the most recent one
+    url_check_cache.save_results({'http://a.fake/1.bb': _result(content_length=5)})
+    # the table isn't counted on every save
+    with django_assert_num_queries(1):
+        url_check_cache.save_results({'http://a.fake/3.bb': _result()})
+    url_check_cache.save_results({'http://a.fake/expired.bb': _result()})
+    models.UrlCheckResult.objects.filter(url='http://a.fake/expired.bb').update(checked_at=int(time.time()) - 61)
+    assert models.UrlCheckResult.objects.count() == 4
+
+    assert url_check_cache.evict_cache() == 2
+
+    assert set(models.UrlCheckResult.objects.values_list('url', flat=True)) == {'http://a.fake/1.bb', 'http://a.fake/3.bb'}
+    assert models.UrlCheckResult.objects.get(url='http://a.fake/1.bb').content_length == 5
+
+
+@pytest.mark.django_db
+def test_save_results_on_mysql(monkeypatch):
+    """
+    MySQL upserts on any unique key and rejects unique_fields
+    """
+    monkeypatch.setattr(connection.features, 'supports_update_conflicts_with_target', False)
+    bulk_create_options = []
+    monkeypatch.setattr(
+        models.UrlCheckResult.objects, 'bulk_create',
+        lambda objs, **kwargs: bulk_create_options.append(kwargs)
+    )
+    url_check_cache.save_results({'http://a.fake/foo.bb': _result()})
+
+    assert bulk_create_options[0]['update_conflicts']
+    assert 'unique_fields' not in bulk_create_options[0]
+
+
+@pytest.mark.django_db
+def test_fetch_tracks_status_reuses_cached_results(monkeypatch):
+    probed_urls = []
+
+    def fake_probe_url(url, timeout=None):
+        probed_urls.append(url)
+        return _result('404: Not Found' if 'missing' in url else 200)
+
+    monkeypatch.setattr(tracks_status, 'probe_url', fake_probe_url)
+    trackdb_url = 'http://a.fake/hub/hg38/trackDb.txt'
+    tracks = [
+        models.Track(name='foo', big_data_url='foo.bb'),
+        models.Track(name='same_foo', big_data_url='http://a.fake/hub/hg38/foo.bb'),
+        models.Track(name='missing', big_data_url='missing.bb'),
+    ]
+
+    first_status = fetch_tracks_status(tracks, trackdb_url)
+    # another trackdb pointing to the same files
+    second_status = fetch_tracks_status(tracks[:1] + tracks[2:], 'http://a.fake/hub/hg38/trackDb_copy.txt')
+
+    assert probed_urls == ['http://a.fake/hub/hg38/foo.bb', 'http://a.fake/hub/hg38/missing.bb']
+    assert first_status['tracks']['with_data']['total_ko'] == 1
+    assert second_status['tracks']['with_data']['ko'] == {'missing': ['http://a.fake/hub/hg38/missing.bb', '404: Not Found']}
+
+
+@pytest.mark.django_db
+def test_purge_url_check_cache_command(settings):
+    settings.URL_CHECK_CACHE_TTL = 60
+    url_check_cache.save_results({'http://a.fake/foo.bb': _result(), 'http://a.fake/bar.bb': _result()})
+    models.UrlCheckResult.objects.filter(url='http://a.fake/bar.bb').update(checked_at=int(time.time()) - 61)
+
+    call_command('purge_url_check_cache')
+    assert list(models.UrlCheckResult.objects.values_list('url', flat=True)) == ['http://a.fake/foo.bb']
+
+    call_command('purge_url_check_cache', '--all')
+    assert not models.UrlCheckResult.objects.exists()
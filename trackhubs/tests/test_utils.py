@@ -13,7 +13,11 @@
 """
 
 import pytest
-from trackhubs.utils import str2obj, escape_ansi, remove_html_tags
+from django.db import connection
+from django.db.backends.mysql.features import DatabaseFeatures as MySQLFeatures
+
+from trackhubs.models import UrlCheckResult
+from trackhubs.utils import str2obj, escape_ansi, remove_html_tags, get_upsert_options
 
 
 @pytest.mark.parametrize(
@@ -69,3 +73,24 @@ def test_escape_ansi(string_line, expected_result):
 def test_remove_html_tags(html_text, expected_result):
     actual_result = remove_html_tags(html_text)
     assert actual_result == expected_result
+
+
+@pytest.mark.parametrize('supports_update_conflicts_with_target', [
+    MySQLFeatures.supports_update_conflicts_with_target,
+    True,  # SQLite, PostgreSQL
+])
+def test_get_upsert_options(monkeypatch, supports_update_conflicts_with_target):
+    monkeypatch.setattr(
+        connection.features, 'supports_update_conflicts_with_target', supports_update_conflicts_with_target
+    )
+    options = get_upsert_options(['url_hash'], ['status', 'checked_at'])
+
+    assert options['update_conflicts'] and options['update_fields'] == ['status', 'checked_at']
+    assert ('unique_fields' in options) == supports_update_conflicts_with_target
+    # the check bulk_create() runs on this backend, it raises NotSupportedError if the options aren't accepted
+    get_field = UrlCheckResult._meta.get_field  # pylint: disable=protected-access
+    UrlCheckResult.objects.all()._check_bulk_create_options(  # pylint: disable=protected-access
+        ignore_conflicts=False, update_conflicts=options['update_conflicts'],
+        update_fields=[get_field(name) for name in options['update_fields']],
+        unique_fields=[get_field(name) for name in options.get('unique_fields', [])]
+    )
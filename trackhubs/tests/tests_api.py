@@ -14,6 +14,8 @@
 
 import pytest
 
+from trackhubs.jobs import process_pending_jobs, submit_hub
+
 
 def test_post_trackhub_success(project_dir, api_client, create_user_resource, create_genome_assembly_dump_resource):
     _, token = create_user_resource
@@ -29,7 +31,14 @@ def test_post_trackhub_success(project_dir, api_client, create_user_resource, cr
     }
     response = api_client.post('/api/trackhub', submitted_hub, format='json')
     # print("## Response message: {}".format(response.content.decode()))
-    assert response.status_code == 201
+    assert response.status_code == 202
+
+    # the hub is registered once the submission is processed by the worker
+    assert process_pending_jobs() == 1
+    response = api_client.get(response.json()['uri'])
+    assert response.status_code == 200
+    assert response.json()['status'] == 'done'
+    assert response.json()['result'] == {'success': 'The hub is submitted/updated successfully'}
 
 
 def test_post_trackhub_bad_url(api_client, create_user_resource):
@@ -39,7 +48,24 @@ def test_post_trackhub_bad_url(api_client, create_user_resource):
         'url': 'https://some.random/bad/url/hub.txt'
     }
     response = api_client.post('/api/trackhub', submitted_hub, format='json')
-    assert response.status_code == 400
+    assert response.status_code == 202
+
+    process_pending_jobs()
+    response = api_client.get(response.json()['uri'])
+    assert response.json()['status'] == 'failed'
+    assert 'error' in response.json()['result']
+
+
+def test_get_submission_job_of_another_user(api_client, create_user_resource, django_user_model):
+    _, token = create_user_resource
+    other_user = django_user_model.objects.create_user(username='otheruser', password='test-password')
+    job = submit_hub('https://some.random/url/hub.txt', None, other_user)
+
+    api_client.credentials(HTTP_AUTHORIZATION='Token ' + str(token))
+    response = api_client.get('/api/trackhub/jobs/{}'.format(job.job_id))
+    assert response.status_code == 403
+    response = api_client.get('/api/trackhub/jobs/144')
+    assert response.status_code == 404
 
 
 def test_post_trackhub_no_url_field(project_dir, api_client, create_user_resource):
@@ -14,14 +14,27 @@
 
 import sys
 import logging
+import os
+import threading
 import time
-import urllib.request
-import urllib.response
 import urllib.error
+import urllib.parse
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
+from django.db.models import Max, QuerySet
+
+import trackhubs
+from trackhubs import http_client, url_check_cache
+from trackhubs.utils import get_upsert_options
 
 logger = logging.getLogger(__name__)
+# number of track_status rows written per query
+STATUS_BATCH_SIZE = 1000
 # Make Python loggers output all messages to stdout
 # logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 
@@ -48,78 +61,442 @@ def fix_big_data_url(big_data_url, trackdb_url):
         return trackdb_base_url + '/' + big_data_url
 
 
-def check_response(url):
+# servers that don't accept HEAD requests (signed URLs are often only valid for GET)
+HEAD_NOT_SUPPORTED_CODES = (403, 405, 501)
+
+
+def _get_content_length(headers):
     """
-    Check the response
+    :returns: the size of the file from the Content-Range (e.g. 'bytes 0-0/12345') or Content-Length header
+    """
+    content_range = headers.get('Content-Range')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = headers.get('Content-Length')
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+
+def _probe_http(url, timeout):
+    """
+    Probe the file with a HEAD request, or with a GET request of its first byte
+    if the server doesn't accept HEAD requests, the body is never downloaded
+    """
+    try:
+        with http_client.urlopen(url, method='HEAD', timeout=timeout) as response:
+            return response.getcode(), response.headers
+    except urllib.error.HTTPError as exp:
+        if exp.code not in HEAD_NOT_SUPPORTED_CODES:
+            raise
+    with http_client.urlopen(url, headers={'Range': 'bytes=0-0'}, timeout=timeout) as response:
+        # 206 Partial Content means the file is there
+        return (200 if response.getcode() == 206 else response.getcode()), response.headers
+
+
+# status of the bigDataUrls that aren't checked because their host is down
+HOST_UNREACHABLE = 'Host unreachable'
+
+
+def is_connection_error(exp):
+    """
+    :param exp: urllib.error.URLError raised by http_client
+    :returns: True if the host couldn't be reached at all (connection refused, timeout, ...),
+    False if the server answered (e.g. file not found)
+    """
+    cause = exp.__cause__ or exp.reason
+    if isinstance(cause, requests.exceptions.RequestException):
+        return isinstance(cause, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return isinstance(cause, (OSError, EOFError))
+
+
+class HostCircuitBreaker:
+    """
+    Stop checking the urls of a host after STATUS_CHECK_BREAKER_THRESHOLD consecutive connection failures (open),
+    STATUS_CHECK_BREAKER_RESET seconds later one url is checked again (half-open): the host is checked normally
+    again if it succeeds (closed), otherwise it stays open for another STATUS_CHECK_BREAKER_RESET seconds
+    """
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        :returns: False if the url shouldn't be checked because the host is down
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.time() - self.opened_at < settings.STATUS_CHECK_BREAKER_RESET:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        """
+        Give the half-open trial back when the check ended without telling anything about the host
+        (unexpected error), another url can then be tried straight away
+        """
+        with self._lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= settings.STATUS_CHECK_BREAKER_THRESHOLD:
+                if self.opened_at is None:
+                    logger.warning("'{}' is unreachable, its urls won't be checked for {} seconds".format(
+                        self.host, settings.STATUS_CHECK_BREAKER_RESET
+                    ))
+                self.opened_at = time.time()
+                self.trial_running = False
+
+
+def probe_url(url, timeout=None):
+    """
+    Check that the remote file exists without downloading it: HTTP(S) files are probed
+    with HEAD (or a one byte Range GET) and FTP files with SIZE/MDTM
+    The url isn't checked if its host has been unreachable recently (see HostCircuitBreaker)
     :param url: the full big_data_url URL
-    :returns: 200/None (HTTP/FTP) if everything went well else it returns
-    string containing the error code and message
-    NOTE:
-    check_url makes sure that the URL is 'valid' (it starts with http, ftp ...)
-    check_response makes sure that the file exists
+    :param timeout: timeout in seconds (default: STATUS_CHECK_TIMEOUT setting)
+    :returns: dictionary with the 'status' (see check_response()) and the 'content_length'
+    and 'last_modified' of the file if the server sent them
     """
+    timeout = timeout or settings.STATUS_CHECK_TIMEOUT
+    probe_result = {'status': None, 'content_length': None, 'last_modified': None}
+    breaker = _get_host_breaker(urllib.parse.urlsplit(url).netloc.lower())
+    if not breaker.allow_request():
+        probe_result['status'] = HOST_UNREACHABLE
+        return probe_result
     try:
-        response = urllib.request.urlopen(url)
-        return response.getcode()
+        connection_failed = _probe(url, timeout, probe_result)
+    except BaseException:
+        # a half-open breaker would stay open for good if its trial wasn't given back
+        breaker.release_trial()
+        raise
+    if connection_failed:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return probe_result
+
+
+def _probe(url, timeout, probe_result):
+    """
+    Fill probe_result (see probe_url()) with the status of the url
+    :returns: True if the host couldn't be reached
+    """
+    try:
+        if url.lower().startswith('ftp://'):
+            probe_result.update(http_client.ftp_probe(url, timeout=timeout))
+        else:
+            status, headers = _probe_http(url, timeout)
+            probe_result.update({
+                'status': status,
+                'content_length': _get_content_length(headers),
+                'last_modified': headers.get('Last-Modified')
+            })
     except urllib.error.HTTPError as exp:
         # Return code error (e.g. 404, 501, ...)
         logger.error('HTTPError: {}'.format(exp.code))
-        return "{}: {}".format(exp.code, exp.reason)
+        probe_result['status'] = "{}: {}".format(exp.code, exp.reason)
     except urllib.error.URLError as exp:
         # Not an HTTP-specific error (e.g. connection refused, FTP errors)
         logger.error('URLError: {}'.format(exp.reason))
-        return "{}".format(exp.reason)
+        probe_result['status'] = "{}".format(exp.reason)
+        return is_connection_error(exp)
+    return False
+
+
+def check_response(url, timeout=None):
+    """
+    Check the response
+    :param url: the full big_data_url URL
+    :param timeout: timeout in seconds (default: STATUS_CHECK_TIMEOUT setting)
+    :returns: 200/None (HTTP/FTP) if everything went well else it returns
+    string containing the error code and message
+    NOTE:
+    check_url makes sure that the URL is 'valid' (it starts with http, ftp ...)
+    check_response makes sure that the file exists
+    """
+    return probe_url(url, timeout)['status']
+
 
+# the checks of all the trackdbs share one thread pool (STATUS_CHECK_MAX_WORKERS threads),
+# one semaphore per host (STATUS_CHECK_MAX_PER_HOST slots) and one circuit breaker per host
+_executor = None
+_executor_pid = None
+_host_slots = {}
+_host_breakers = {}
+_lock = threading.Lock()
+# notified every time a host slot is given back (see check_urls())
+_slot_released = threading.Condition()
 
-def fetch_tracks_status(tracks, trackdb_url):
+
+def _get_executor():
+    """
+    Return the thread pool shared by the whole process, it's created again after a fork
     """
-    Create the tracks status dictionary
-    :param tracks: all tracks belonging to one trackdb
+    global _executor, _executor_pid, _host_slots, _host_breakers, _slot_released  # pylint: disable=global-statement
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=settings.STATUS_CHECK_MAX_WORKERS,
+                                           thread_name_prefix='tracks-status')
+            _executor_pid = os.getpid()
+            _host_slots = {}
+            _host_breakers = {}
+            _slot_released = threading.Condition()
+        return _executor
+
+
+def _get_host_breaker(host):
+    with _lock:
+        if host not in _host_breakers:
+            _host_breakers[host] = HostCircuitBreaker(host)
+        return _host_breakers[host]
+
+
+def _get_host_slots(host):
+    with _lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(settings.STATUS_CHECK_MAX_PER_HOST)
+        return _host_slots[host]
+
+
+def check_urls(urls):
+    """
+    Check all the given URLs concurrently, at most STATUS_CHECK_MAX_PER_HOST URLs
+    of the same host are checked at the same time (whatever the number of trackdbs checked at once)
+    A URL is only handed to the thread pool once it holds one of its host's slots, the calling thread
+    waits for the busy hosts so a slow host never holds more than its slots in the pool
+    :param urls: list of full URLs, duplicates are checked once
+    :returns: dictionary mapping each URL to the probe_url() result
+    """
+    urls_by_host = defaultdict(deque)
+    for url in dict.fromkeys(urls):
+        urls_by_host[urllib.parse.urlsplit(url).netloc.lower()].append(url)
+
+    results = {}
+
+    def check_url(url, host_slots):
+        try:
+            results[url] = probe_url(url)
+        finally:
+            host_slots.release()
+            with _slot_released:
+                _slot_released.notify_all()
+
+    executor = _get_executor()
+    futures = []
+    pending_hosts = {host: (_get_host_slots(host), host_urls) for host, host_urls in urls_by_host.items()}
+    with _slot_released:
+        while pending_hosts:
+            submitted = False
+            for host, (host_slots, host_urls) in list(pending_hosts.items()):
+                while host_urls and host_slots.acquire(blocking=False):
+                    futures.append(executor.submit(check_url, host_urls.popleft(), host_slots))
+                    submitted = True
+                if not host_urls:
+                    del pending_hosts[host]
+            if pending_hosts and not submitted:
+                # all the slots of the remaining hosts are taken (maybe by other trackdbs)
+                _slot_released.wait()
+    for future in futures:
+        future.result()
+    return results
+
+
+def fetch_tracks_status(tracks, trackdb_url, previous_status=None, unchanged_tracks=None, use_url_cache=True):
+    """
+    Create the tracks status dictionary, the bigDataUrls are checked concurrently (see check_urls())
+    unless they have been checked recently (see url_check_cache.py)
+    :param tracks: all tracks belonging to one trackdb, a list of Track objects or a Track queryset
+    (only the name and bigDataUrl columns are read and the tracks are fetched in chunks)
     :param trackdb_url: the trackdb url (e.g http://lncipedia.org/trackhub/hg38/trackDb.txt),
     it's used by fix_big_data_url() function
+    :param previous_status: the status dictionary computed the last time this trackdb was checked
+    :param unchanged_tracks: set of (name, bigDataUrl) tuples of the tracks already checked in previous_status,
+    their result is reused instead of checking their bigDataUrl again
+    :param use_url_cache: reuse and store the results in the url_check_result table,
+    it should be False when the database can't be used (e.g. in a separate thread)
     :returns: status dictionary
     """
     total_tracks_with_data = 0
-    total_tracks_with_data_ko = 0
     broken_tracks_info = {}
+    # names of the tracks whose bigDataUrl hasn't been probed by this check
+    not_checked_tracks = []
+    unchanged_tracks = unchanged_tracks or set()
+    previous_broken_tracks_info = (previous_status or {}).get('tracks', {}).get('with_data', {}).get('ko', {})
+
+    if isinstance(tracks, QuerySet):
+        total_tracks = tracks.count()
+        names_and_urls = tracks.filter(big_data_url__isnull=False).values_list(
+            'name', 'big_data_url'
+        ).iterator(chunk_size=STATUS_BATCH_SIZE)
+    else:
+        total_tracks = len(tracks)
+        names_and_urls = ((track.name, track.big_data_url) for track in tracks if track.big_data_url is not None)
+    tracks_with_data = [
+        # get the full url for the bigDataUrl
+        (name, big_data_url, fix_big_data_url(big_data_url, trackdb_url))
+        for name, big_data_url in names_and_urls
+    ]
+    # make sure they're working, each url is checked once even if several tracks point to it
+    urls_to_check = list(dict.fromkeys(
+        big_data_full_url for name, big_data_url, big_data_full_url in tracks_with_data
+        if (name, big_data_url) not in unchanged_tracks
+    ))
+    checked_urls = url_check_cache.get_cached_results(urls_to_check) if use_url_cache else {}
+    new_results = check_urls([url for url in urls_to_check if url not in checked_urls])
+    if use_url_cache:
+        # the urls of unreachable hosts haven't been checked
+        url_check_cache.save_results({
+            url: result for url, result in new_results.items() if result['status'] != HOST_UNREACHABLE
+        })
+    checked_urls.update(new_results)
+
+    for name, big_data_url, big_data_full_url in tracks_with_data:
+        total_tracks_with_data += 1
+        if (name, big_data_url) in unchanged_tracks:
+            # the previous result is still valid, only broken tracks are listed in the status
+            previous_result = previous_broken_tracks_info.get(name)
+            if previous_result and previous_result[0] == big_data_full_url:
+                big_data_exists = previous_result[1]
+            else:
+                big_data_exists = 200
+            not_checked_tracks.append(name)
+        else:
+            big_data_exists = checked_urls[big_data_full_url]['status']
+            if big_data_exists == HOST_UNREACHABLE:
+                not_checked_tracks.append(name)
+        logger.debug("Response of {}: {} ".format(big_data_full_url, big_data_exists))
+        # if it's not the case
+        if big_data_exists != 200 and big_data_exists is not None:
+            # fill broken tracks info with the required data
+            broken_tracks_info[name] = [big_data_full_url, big_data_exists]
+
+    tracks_status_dict = build_tracks_status(total_tracks, total_tracks_with_data, broken_tracks_info)
+    logger.info("tracks_status_dict: {} ".format(tracks_status_dict))
+    if not_checked_tracks:
+        # the history of these tracks isn't changed by save_tracks_status(), which removes the key
+        tracks_status_dict['not_checked'] = not_checked_tracks
+
+    return tracks_status_dict
 
-    for track in tracks:
-        if track.big_data_url is not None:
-            total_tracks_with_data += 1
-            # get the full url for the bigDataUrl
-            big_data_full_url = fix_big_data_url(track.big_data_url, trackdb_url)
-            # make sure it's working
-            big_data_exists = check_response(big_data_full_url)
-            # TODO: to avoid timeout issues when running `enrich all` command
-            #  comment the line above and replace it with the one below
-            # big_data_exists = 200  # skip check big_data_url
-            logger.debug("Response of {}: {} ".format(big_data_full_url, big_data_exists))
-            # if it's not the case
-            if big_data_exists != 200 and big_data_exists is not None:
-                total_tracks_with_data_ko += 1
-                # fill broken tracks info with the required data
-                broken_tracks_info[track.name] = [big_data_full_url, big_data_exists]
 
+def build_tracks_status(total_tracks, total_tracks_with_data, broken_tracks_info, last_update=None):
+    """
+    Create the status dictionary stored in the trackdb 'status' field
+    :param total_tracks: number of tracks of the trackdb
+    :param total_tracks_with_data: number of tracks having a bigDataUrl
+    :param broken_tracks_info: dictionary mapping the name of each broken track to its [bigDataUrl, error]
+    :param last_update: time of the check (default: now)
+    :returns: status dictionary
+    """
     tracks_status_dict = {
-        'last_update': int(time.time()),
+        'last_update': last_update or int(time.time()),
         'tracks': {
-            'total': len(tracks),
+            'total': total_tracks,
             'with_data': {
                 'total': total_tracks_with_data,
-                'total_ko': total_tracks_with_data_ko
+                'total_ko': len(broken_tracks_info)
             }
         }
     }
 
-    if total_tracks_with_data_ko > 0:
+    if broken_tracks_info:
         tracks_status_dict['message'] = 'Remote Data Unavailable'
         # add ko_info to status
         tracks_status_dict['tracks']['with_data']['ko'] = broken_tracks_info
-    elif total_tracks_with_data_ko == 0:
-        tracks_status_dict['message'] = 'All is Well'
     else:
-        tracks_status_dict['message'] = 'Unchecked'
+        tracks_status_dict['message'] = 'All is Well'
+    return tracks_status_dict
 
-    logger.info("tracks_status_dict: {} ".format(tracks_status_dict))
 
-    return tracks_status_dict
+def save_tracks_status(trackdb, tracks_status):
+    """
+    Record the result of each track having a bigDataUrl in the track_status table,
+    only the rows of the given trackdb are written
+    :param trackdb: the saved trackdb object, its tracks should be saved too
+    :param tracks_status: the status dictionary returned by fetch_tracks_status(), the rows of its
+    'not_checked' tracks (reused results or hosts skipped by the circuit breaker) are only created if they
+    don't exist, so their failures and last check aren't advanced
+    :returns: the status dictionary of the trackdb derived from the track_status table
+    (see get_tracks_status())
+    """
+    broken_tracks_info = tracks_status['tracks']['with_data'].get('ko', {})
+    not_checked_tracks = set(tracks_status.pop('not_checked', ()))
+    checked_at = tracks_status['last_update']
+    # (consecutive_failures, first_failure) of the tracks that were already broken
+    previous_failures = {
+        track_id: (consecutive_failures, first_failure)
+        for track_id, consecutive_failures, first_failure in trackhubs.models.TrackStatus.objects.filter(
+            track__trackdb_id=trackdb.trackdb_id, consecutive_failures__gt=0
+        ).values_list('track_id', 'consecutive_failures', 'first_failure')
+    }
+    tracks_with_data = trackhubs.models.Track.objects.filter(
+        trackdb_id=trackdb.trackdb_id, big_data_url__isnull=False
+    ).values_list('track_id', 'name')
+
+    rows = []
+    not_checked_rows = []
+    for track_id, name in tracks_with_data.iterator():
+        if name in not_checked_tracks:
+            consecutive_failures = 1 if name in broken_tracks_info else 0
+            not_checked_rows.append(trackhubs.models.TrackStatus(
+                track_id=track_id, last_checked=checked_at,
+                last_result=broken_tracks_info[name][1] if consecutive_failures else 200,
+                consecutive_failures=consecutive_failures, first_failure=checked_at if consecutive_failures else None
+            ))
+        elif name in broken_tracks_info:
+            consecutive_failures, first_failure = previous_failures.get(track_id, (0, checked_at))
+            rows.append(trackhubs.models.TrackStatus(
+                track_id=track_id, last_checked=checked_at, last_result=broken_tracks_info[name][1],
+                consecutive_failures=consecutive_failures + 1, first_failure=first_failure
+            ))
+        else:
+            rows.append(trackhubs.models.TrackStatus(
+                track_id=track_id, last_checked=checked_at, last_result=200,
+                consecutive_failures=0, first_failure=None
+            ))
+    trackhubs.models.TrackStatus.objects.bulk_create(
+        rows,
+        batch_size=STATUS_BATCH_SIZE,
+        **get_upsert_options(['track'], ['last_checked', 'last_result', 'consecutive_failures', 'first_failure'])
+    )
+    trackhubs.models.TrackStatus.objects.bulk_create(
+        not_checked_rows, batch_size=STATUS_BATCH_SIZE, ignore_conflicts=True
+    )
+    return get_tracks_status(trackdb, last_update=checked_at)
+
+
+def get_tracks_status(trackdb, last_update=None):
+    """
+    Build the status dictionary of a trackdb from its track_status rows
+    :param trackdb: the trackdb object
+    :param last_update: time of the last check (default: the most recent check of its tracks)
+    :returns: status dictionary (see build_tracks_status())
+    """
+    tracks = trackhubs.models.Track.objects.filter(trackdb_id=trackdb.trackdb_id)
+    broken_tracks = trackhubs.models.TrackStatus.objects.filter(
+        track__trackdb_id=trackdb.trackdb_id, consecutive_failures__gt=0
+    ).order_by('track_id').values_list('track__name', 'track__big_data_url', 'last_result')
+    broken_tracks_info = {
+        name: [fix_big_data_url(big_data_url, trackdb.source_url), last_result]
+        for name, big_data_url, last_result in broken_tracks
+    }
+    if last_update is None:
+        last_update = trackhubs.models.TrackStatus.objects.filter(
+            track__trackdb_id=trackdb.trackdb_id
+        ).aggregate(last_update=Max('last_checked'))['last_update']
+    return build_tracks_status(
+        tracks.count(), tracks.filter(big_data_url__isnull=False).count(), broken_tracks_info, last_update
+    )
@@ -12,21 +12,28 @@
    limitations under the License.
 """
 
+import hashlib
 import json
 import logging
 import sys
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from django.utils.html import escape
 
-import django
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max, Q
 
 import trackhubs
-from trackhubs.constants import DATA_TYPES, FILE_TYPES, VISIBILITY, UCSC_TO_INSDC
-from trackhubs.hub_check import hub_check
-from trackhubs.models import Trackdb, GenomeAssemblyDump
-from trackhubs.parser import parse_file_from_url
-from trackhubs.tracks_status import fetch_tracks_status, fix_big_data_url
+from trackhubs import reference_data
+from trackhubs.constants import DATA_TYPES, UCSC_TO_INSDC
+from trackhubs.hub_check import cache_hub_check, get_cached_hub_check, hub_check
+from trackhubs.models import GenomeAssemblyDump
+from trackhubs.parser import ParserError, iter_file_from_url, parse_file_from_url
+from trackhubs.es_bulk import BulkIndexer
+from trackhubs.tracks_status import fetch_tracks_status, fix_big_data_url, save_tracks_status
 from thr.settings.base import ELASTICSEARCH_INDEX_NAMES
 
 User = get_user_model()
@@ -55,8 +62,11 @@ def get_datatype_filetype_visibility(unique_col, object_name, file_type=False):
         # trim the type in case we have extra info e.g 'type bigBed 6 +'
         unique_col = get_first_word(unique_col)
 
-    existing_obj = object_name.objects.filter(name=unique_col).first()
-    return existing_obj
+    # the id is taken from the in-process map, so unknown names don't hit the database
+    obj_id = reference_data.get_id(object_name, unique_col)
+    if obj_id is None:
+        return None
+    return object_name.objects.filter(pk=obj_id).first()
 
 
 def get_obj_if_exist(unique_col, object_name, file_type=False):
@@ -84,15 +94,13 @@ def save_datatype_filetype_visibility(name_list, object_name):
     in their corresponding table
     name_list: list of the values to be stored
     object_name: either DataType, FileType or Visibility
-    TODO: this function should be executed once just after creating the database
+    NOTE: the tables are seeded once the database is migrated (see reference_data.seed_reference_data())
     """
-    name_list_obj = []
-    for name in name_list:
-        if not object_name.objects.filter(name=name).exists():
-            obj = object_name(name=name)
-            name_list_obj.append(obj)
+    existing_names = set(object_name.objects.values_list('name', flat=True))
+    name_list_obj = [object_name(name=name) for name in name_list if name not in existing_names]
 
     object_name.objects.bulk_create(name_list_obj)
+    reference_data.clear_cache(object_name)
 
 
 def update_or_create_hub(hub_dict, data_type, current_user):
@@ -117,7 +125,7 @@ def update_or_create_hub(hub_dict, data_type, current_user):
             'url': hub_dict['url'],
             'description_url': hub_dict.get('descriptionUrl'),
             'email': hub_dict.get('email'),
-            'data_type': trackhubs.models.DataType.objects.filter(name=data_type).first(),
+            'data_type_id': reference_data.get_id(trackhubs.models.DataType, data_type),
             'owner_id': current_user.id
         }
     )
@@ -141,6 +149,8 @@ def update_or_create_trackdb(url, hub, assembly, species):
             'public': True,
             'created': int(time.time()),
             'updated': int(time.time()),
+            # the tracks status is checked with the content
+            'status_updated': int(time.time()),
             'assembly': assembly,
             'hub': hub,
             'species': species,
@@ -179,13 +189,105 @@ def update_or_create_track(track_dict, trackdb, file_type, visibility):
             'html': track_dict.get('html'),
             'parent': None,  # track id will go here later on using add_parent_id() function
             'trackdb': trackdb,
-            'file_type': trackhubs.models.FileType.objects.filter(name=file_type).first(),
-            'visibility': trackhubs.models.Visibility.objects.filter(name=visibility).first()
+            'file_type_id': reference_data.get_id(trackhubs.models.FileType, file_type),
+            'visibility_id': reference_data.get_id(trackhubs.models.Visibility, visibility)
         }
     )
     return track_obj
 
 
+def bulk_update_or_create_tracks(tracks_info, trackdb, batch_size=None):
+    # pylint: disable=too-many-locals
+    """
+    Apply the difference between the parsed tracks and the tracks stored for one trackdb
+    using set-based inserts, updates and deletes instead of calling update_or_create_track() once per track
+    Existing tracks are matched by name and bigDataUrl within the given trackdb, only the new tracks
+    are inserted, only the tracks whose fields have changed are updated and the tracks that aren't
+    in the trackDb file anymore are deleted
+    :param tracks_info: list of track dictionaries parsed from the trackDb file
+    :param trackdb: trackdb object associated with these tracks
+    :param batch_size: number of rows written per query (default: TRACKS_BULK_BATCH_SIZE setting)
+    :returns: a tuple of the list of the saved track objects, in the same order as tracks_info,
+    and a dictionary with the number of 'created', 'updated' and 'deleted' tracks
+    """
+    batch_size = batch_size or settings.TRACKS_BULK_BATCH_SIZE
+    track_model = trackhubs.models.Track
+
+    # the foreign keys are resolved from the in-process maps instead of once per track
+    file_types = reference_data.get_ids(trackhubs.models.FileType)
+    visibilities = reference_data.get_ids(trackhubs.models.Visibility)
+
+    existing_tracks = {
+        (track.name, track.big_data_url): track
+        for track in track_model.objects.filter(trackdb=trackdb)
+    }
+
+    tracks_to_create = {}
+    tracks_to_update = {}
+    tracks_keys = []
+    for track_dict in tracks_info:
+        # save name only without 'on' or 'off' settings
+        track_name = get_first_word(track_dict['track'])
+        track_key = (track_name, track_dict.get('bigDataUrl'))
+        tracks_keys.append(track_key)
+
+        file_type_id = None
+        if 'type' in track_dict:
+            file_type_id = file_types.get(get_first_word(track_dict['type']))
+        track_values = {
+            'name': track_name,
+            'shortLabel': track_dict.get('shortLabel'),
+            'longLabel': track_dict.get('longLabel'),
+            'big_data_url': track_dict.get('bigDataUrl'),
+            'html': track_dict.get('html'),
+            'file_type_id': file_type_id,
+            'visibility_id': visibilities.get(track_dict.get('visibility', 'hide'), visibilities.get('hide')),
+        }
+
+        track_obj = existing_tracks.get(track_key)
+        if track_obj is None:
+            # track id will go here later on using add_tracks_parents() function
+            track_obj = tracks_to_create.setdefault(track_key, track_model(trackdb=trackdb))
+        elif any(getattr(track_obj, field) != value for field, value in track_values.items()):
+            tracks_to_update[track_key] = track_obj
+        else:
+            continue
+
+        for field, value in track_values.items():
+            setattr(track_obj, field, value)
+
+    parsed_keys = set(tracks_keys)
+    deleted_ids = [track.track_id for track_key, track in existing_tracks.items() if track_key not in parsed_keys]
+
+    track_model.objects.bulk_create(tracks_to_create.values(), batch_size=batch_size)
+    track_model.objects.bulk_update(
+        tracks_to_update.values(),
+        fields=['name', 'shortLabel', 'longLabel', 'big_data_url', 'html', 'file_type', 'visibility'],
+        batch_size=batch_size
+    )
+    for start in range(0, len(deleted_ids), batch_size):
+        ids_batch = deleted_ids[start:start + batch_size]
+        # the kept children of a deleted track lose their parent (instead of being deleted in cascade),
+        # add_tracks_parents() sets the new one
+        track_model.objects.filter(trackdb=trackdb, parent_id__in=ids_batch).update(parent=None)
+        track_model.objects.filter(track_id__in=ids_batch).delete()
+
+    tracks_changes = {
+        'created': len(tracks_to_create),
+        'updated': len(tracks_to_update),
+        'deleted': len(deleted_ids)
+    }
+    logger.info("Trackdb id {} tracks changes: {}".format(trackdb.trackdb_id, tracks_changes))
+
+    # MySQL doesn't return the ids of bulk inserted rows, so we fetch them back in one query
+    if tracks_to_create or deleted_ids:
+        existing_tracks = {
+            (track.name, track.big_data_url): track
+            for track in track_model.objects.filter(trackdb=trackdb)
+        }
+    return [existing_tracks[track_key] for track_key in tracks_keys], tracks_changes
+
+
 def get_first_word(tabbed_info):
     """
     Get the first word in a sentence, this is useful when
@@ -210,13 +312,70 @@ def add_parent_id(parent_name, current_track):
     # get the track parent name only without extra configuration
     # e.g. 'uniformDnasePeaks off' becomes 'uniformDnasePeaks'
     parent_name_only = get_first_word(parent_name).strip()
-    # IDEA: DRY create get where function
-    parent_track = trackhubs.models.Track.objects.filter(name=parent_name_only).first()
+    # look for the parent in the same trackdb only, other hubs may have a track with the same name
+    parent_track = trackhubs.models.Track.objects.filter(
+        name=parent_name_only, trackdb_id=current_track.trackdb_id
+    ).first()
     current_track.parent_id = parent_track.track_id
     current_track.save()
     return parent_track
 
 
+def add_tracks_parents(tracks_info, saved_tracks, batch_size=None):
+    """
+    Resolve the parent of every track by name within the current trackdb
+    and save the parent ids that have changed in one bulk update
+    :param tracks_info: list of track dictionaries parsed from the trackDb file
+    :param saved_tracks: list of the saved track objects, in the same order as tracks_info
+    :param batch_size: number of rows written per query (default: TRACKS_BULK_BATCH_SIZE setting)
+    :returns: list of the track objects whose parent has changed
+    """
+    batch_size = batch_size or settings.TRACKS_BULK_BATCH_SIZE
+    tracks_by_name = {track_obj.name: track_obj for track_obj in saved_tracks}
+
+    changed_tracks = []
+    for track, track_obj in zip(tracks_info, saved_tracks):
+        parent_track = None
+        if 'parent' in track:
+            # e.g. 'uniformDnasePeaks off' becomes 'uniformDnasePeaks'
+            parent_track = tracks_by_name.get(get_first_word(track['parent']))
+            if parent_track is None:
+                logger.warning("Couldn't find the parent '{}' of track '{}'".format(track['parent'], track_obj.name))
+        parent_id = parent_track.track_id if parent_track is not None else None
+        if track_obj.parent_id != parent_id:
+            track_obj.parent = parent_track
+            changed_tracks.append(track_obj)
+
+    trackhubs.models.Track.objects.bulk_update(changed_tracks, fields=['parent'], batch_size=batch_size)
+    return changed_tracks
+
+
+def build_trackdb_configuration(tracks_info):
+    """
+    Build the trackdb configuration object from the parsed tracks, each track is added
+    to the 'members' of its parent regardless of how deep it is nested
+    e.g. {'parent_track': {'track': 'parent_track', 'members': {'child_track': {'track': 'child_track', ...}}}}
+    :param tracks_info: list of track dictionaries parsed from the trackDb file
+    :returns: the configuration object
+    """
+    trackdb_configuration = {}
+    tracks_by_name = {}
+    for track in tracks_info:
+        track.pop('url', None)
+        trackdb_configuration[track['track']] = track
+        tracks_by_name[get_first_word(track['track'])] = track
+
+    # parents and children share the same dictionaries, so adding a track to its parent
+    # members also adds it to the parent copy nested in the grandparent (and so on)
+    for track in tracks_info:
+        if 'parent' in track:
+            parent_track = tracks_by_name.get(get_first_word(track['parent']))
+            if parent_track is not None:
+                parent_track.setdefault('members', {})[track['track']] = track
+
+    return trackdb_configuration
+
+
 def get_parents(track):
     """
     Get parent and grandparent (if any) of a given track
@@ -239,89 +398,415 @@ def get_parents(track):
     return parent_track, grandparent_track
 
 
-def get_assembly_info_from_dump(genome_assembly_name):
+# process-wide memo of the resolved genome assembly names, it's emptied when the genome_assembly_dump
+# table is reloaded by 'import_assemblies' (see get_assembly_dump_generation())
+# unknown names aren't memoized, so it can't hold more names than the table has
+_assembly_info_cache = {}
+_assembly_info_cache_generation = None
+_assembly_info_cache_checked = 0
+_assembly_info_cache_lock = threading.Lock()
+
+
+def get_assembly_dump_generation():
     """
-    Get the assembly information from 'genome_assembly_dump' table
-    based on the assemblies submitted by the user
-    :param genome_assembly_name: genome assembly name extracted from genomes.txt file
-    :returns: assembly info object if found or None otherwise
+    'import_assemblies' deletes and inserts the whole genome_assembly_dump table,
+    so the highest (indexed) id changes every time the table is reloaded
+    :returns: the current generation of the genome_assembly_dump table
     """
-    assembly_info_from_dump = GenomeAssemblyDump.objects.filter(assembly_name=genome_assembly_name).first()
-    assembly_info_from_dump_ucsc_synonym = GenomeAssemblyDump.objects.filter(ucsc_synonym=genome_assembly_name).first()
-    assembly_info_from_dump_accession = GenomeAssemblyDump.objects.filter(accession_with_version=genome_assembly_name).first()
+    return GenomeAssemblyDump.objects.aggregate(generation=Max('pk'))['generation']
 
+
+def clear_assembly_info_cache():
+    """
+    Forget all the resolved genome assembly names
+    """
+    global _assembly_info_cache_generation, _assembly_info_cache_checked  # pylint: disable=global-statement
+    with _assembly_info_cache_lock:
+        _assembly_info_cache.clear()
+        _assembly_info_cache_generation = None
+        _assembly_info_cache_checked = 0
+
+
+def _check_assembly_info_cache():
+    """
+    Empty the memo if the genome_assembly_dump table has been reloaded by another process,
+    this is checked at most once every GENOME_ASSEMBLY_CACHE_TTL seconds
+    """
+    global _assembly_info_cache_generation, _assembly_info_cache_checked  # pylint: disable=global-statement
+    if time.time() - _assembly_info_cache_checked < settings.GENOME_ASSEMBLY_CACHE_TTL:
+        return
+    generation = get_assembly_dump_generation()
+    with _assembly_info_cache_lock:
+        if generation != _assembly_info_cache_generation:
+            _assembly_info_cache.clear()
+            _assembly_info_cache_generation = generation
+        _assembly_info_cache_checked = time.time()
+
+
+def query_assemblies_info_from_dump(genome_assembly_names):
+    """
+    Look for the given genome assemblies in 'genome_assembly_dump' table using one query over indexed columns,
+    the candidates are ranked in Python with the following precedence:
+    assembly_name > ucsc_synonym > accession_with_version > accession mapped in UCSC_TO_INSDC
+    :param genome_assembly_names: genome assembly names extracted from genomes.txt file
+    :returns: dictionary mapping each name to its assembly info object, or None if it's not found
+    """
+    genome_assembly_names = set(genome_assembly_names)
+    if not genome_assembly_names:
+        return {}
     # if assembly doesn't have a UCSC synonym we grab assembly_info by using the accession ID present in constants.py
     # which is mapped to genome_assembly_name fetched from genomes.txt file
     # e.g: "amel5" maps to "GCA_000002195.1"
-    assembly_info_from_dump_mapped_accession = GenomeAssemblyDump.objects.filter(
-        accession_with_version=UCSC_TO_INSDC.get(genome_assembly_name)
-    ).first()
+    mapped_accessions = {
+        name: UCSC_TO_INSDC[name] for name in genome_assembly_names if UCSC_TO_INSDC.get(name)
+    }
+    candidates = GenomeAssemblyDump.objects.filter(
+        Q(assembly_name__in=genome_assembly_names)
+        | Q(ucsc_synonym__in=genome_assembly_names)
+        | Q(accession_with_version__in=genome_assembly_names | set(mapped_accessions.values()))
+    ).order_by('pk')
+
+    # the first (lowest id) row of each column value
+    by_column = {'assembly_name': {}, 'ucsc_synonym': {}, 'accession_with_version': {}}
+    for dump in candidates:
+        for column, rows in by_column.items():
+            rows.setdefault(getattr(dump, column), dump)
+
+    assemblies_info = {}
+    for name in genome_assembly_names:
+        assemblies_info[name] = (
+            by_column['assembly_name'].get(name)
+            or by_column['ucsc_synonym'].get(name)
+            or by_column['accession_with_version'].get(name)
+            or by_column['accession_with_version'].get(mapped_accessions.get(name))
+        )
+    return assemblies_info
 
-    if assembly_info_from_dump:
-        return assembly_info_from_dump
-    if assembly_info_from_dump_ucsc_synonym:
-        return assembly_info_from_dump_ucsc_synonym
-    elif assembly_info_from_dump_accession:
-        return assembly_info_from_dump_accession
-    elif assembly_info_from_dump_mapped_accession:
-        return assembly_info_from_dump_mapped_accession
-    return None
+
+def get_assemblies_info_from_dump(genome_assembly_names):
+    """
+    Get the assembly information from 'genome_assembly_dump' table of all the given genome assemblies,
+    the names that haven't been resolved yet by this process are looked up in a single query
+    (the unknown ones are looked up again every time)
+    :param genome_assembly_names: genome assembly names extracted from genomes.txt file
+    :returns: dictionary mapping each name to its assembly info object, or None if it's not found
+    """
+    _check_assembly_info_cache()
+    with _assembly_info_cache_lock:
+        assemblies_info = {
+            name: _assembly_info_cache[name] for name in genome_assembly_names if name in _assembly_info_cache
+        }
+
+    missing_names = set(genome_assembly_names) - set(assemblies_info)
+    if missing_names:
+        queried_assemblies_info = query_assemblies_info_from_dump(missing_names)
+        with _assembly_info_cache_lock:
+            _assembly_info_cache.update(
+                (name, assembly_info) for name, assembly_info in queried_assemblies_info.items()
+                if assembly_info is not None
+            )
+        assemblies_info.update(queried_assemblies_info)
+    return assemblies_info
 
 
-def save_assembly(genome_assembly_name):
+def get_assembly_info_from_dump(genome_assembly_name):
     """
     Get the assembly information from 'genome_assembly_dump' table
-    based on the assemblies submitted by the user
+    based on the assemblies submitted by the user, the result is memoized per process
     :param genome_assembly_name: genome assembly name extracted from genomes.txt file
     :returns: assembly info object if found or None otherwise
     """
-    assembly_info_from_dump = get_assembly_info_from_dump(genome_assembly_name)
-    existing_assembly_obj = trackhubs.models.Assembly.objects.filter(name=assembly_info_from_dump.assembly_name).first()
+    return get_assemblies_info_from_dump([genome_assembly_name])[genome_assembly_name]
+
+
+def save_species_and_assemblies(genome_assembly_names):
+    """
+    Resolve all the genome assemblies of a hub at once and save the missing species
+    and assemblies with one bulk insert each
+    :param genome_assembly_names: genome assembly names extracted from genomes.txt file
+    :returns: a tuple of two dictionaries mapping each genome assembly name to its Species and Assembly objects,
+    or an error dictionary if one of the genome assemblies doesn't exist
+    """
+    assemblies_info = get_assemblies_info_from_dump(genome_assembly_names)
+    for name in genome_assembly_names:
+        if assemblies_info[name] is None:
+            return {"error": "Assembly '{}' doesn't exist".format(escape(name))}
+
+    species_model = trackhubs.models.Species
+    assembly_model = trackhubs.models.Assembly
+    dumps = list(assemblies_info.values())
+    taxon_ids = {dump.tax_id for dump in dumps}
+    assemblies_names = {dump.assembly_name for dump in dumps}
+
+    # if a row is stored twice, the oldest one wins (like filter(...).first())
+    def get_existing_species():
+        return {
+            species.taxon_id: species
+            for species in species_model.objects.filter(taxon_id__in=taxon_ids).order_by('-pk')
+        }
+
+    def get_existing_assemblies():
+        return {
+            assembly.name: assembly
+            for assembly in assembly_model.objects.filter(name__in=assemblies_names).order_by('-pk')
+        }
+
+    existing_species = get_existing_species()
+    new_species = {
+        dump.tax_id: species_model(taxon_id=dump.tax_id, scientific_name=dump.scientific_name)
+        for dump in dumps if dump.tax_id not in existing_species
+    }
+    existing_assemblies = get_existing_assemblies()
+    new_assemblies = {
+        dump.assembly_name: assembly_model(
+            accession=dump.accession_with_version,
+            name=dump.assembly_name,
+            long_name=dump.assembly_name,
+            ucsc_synonym=dump.ucsc_synonym
+        )
+        for dump in dumps if dump.assembly_name not in existing_assemblies
+    }
+
+    # MySQL doesn't return the ids of bulk inserted rows, so we fetch them back
+    if new_species:
+        species_model.objects.bulk_create(new_species.values())
+        existing_species = get_existing_species()
+    if new_assemblies:
+        assembly_model.objects.bulk_create(new_assemblies.values())
+        existing_assemblies = get_existing_assemblies()
+
+    species_by_genome = {name: existing_species[dump.tax_id] for name, dump in assemblies_info.items()}
+    assemblies_by_genome = {name: existing_assemblies[dump.assembly_name] for name, dump in assemblies_info.items()}
+    return species_by_genome, assemblies_by_genome
+
 
-    if existing_assembly_obj:
-        return existing_assembly_obj
+def fetch_trackdb(trackdb_url, known_trackdb=None, refresh_status=False):
+    """
+    Fetch and parse one trackDb file (and its included files) then check its tracks status
+    The database isn't used here, so it can safely run in a separate thread
+    :param trackdb_url: trackdb url
+    :param known_trackdb: what was stored during the previous ingestion of this trackDb (if any),
+    a dictionary with its 'checksum', tracks 'status' and the set of its (name, bigDataUrl) 'tracks'
+    :param refresh_status: check the status of all the tracks even if the content hasn't changed
+    :returns: a tuple of the parsed tracks, their status dictionary and the content checksum,
+    the status is None if the content is unchanged and refresh_status is False,
+    (None, None, None) is returned if the trackDb file couldn't be parsed
+    """
+    known_trackdb = known_trackdb or {}
+    checksum = hashlib.sha256()
+    # the trackDb file is streamed, only the track objects are kept in memory
+    try:
+        tracks_info = [
+            track for track in iter_file_from_url(trackdb_url, checksum=checksum) if 'track' in track
+        ]
+    except ParserError as ex:
+        logger.error(ex)
+        return None, None, None
+
+    checksum = checksum.hexdigest()
+    if checksum == known_trackdb.get('checksum') and not refresh_status:
+        logger.info("'{}' hasn't changed since the last ingestion".format(trackdb_url))
+        return tracks_info, None, checksum
+
+    # unsaved track objects are enough to check the bigDataUrls
+    tracks = [
+        trackhubs.models.Track(name=get_first_word(track['track']), big_data_url=track.get('bigDataUrl'))
+        for track in tracks_info
+    ]
+    if refresh_status:
+        tracks_status = fetch_tracks_status(tracks, trackdb_url, use_url_cache=False)
     else:
-        new_assembly_obj = trackhubs.models.Assembly(
-            accession=assembly_info_from_dump.accession_with_version,
-            name=assembly_info_from_dump.assembly_name,
-            long_name=assembly_info_from_dump.assembly_name,
-            ucsc_synonym=assembly_info_from_dump.ucsc_synonym
+        # only the new or changed bigDataUrls are checked
+        tracks_status = fetch_tracks_status(
+            tracks, trackdb_url,
+            previous_status=known_trackdb.get('status'),
+            unchanged_tracks=known_trackdb.get('tracks'),
+            use_url_cache=False
         )
-        new_assembly_obj.save()
-        return new_assembly_obj
+    return tracks_info, tracks_status, checksum
 
 
-def save_species(genome_assembly_name):
+def iter_fetched_trackdbs(trackdbs_urls, known_trackdbs=None, refresh_status=False, max_workers=None):
+    """
+    Fetch, parse and check the status of all the trackDb files of a hub using a bounded thread pool,
+    each result is yielded as soon as it's ready so that it can be saved while the other files are fetched
+    At most max_workers trackDb files are being fetched or waiting to be consumed, so the memory used
+    doesn't grow with the number of genomes of the hub
+    :param trackdbs_urls: list of trackdb urls
+    :param known_trackdbs: dictionary mapping trackdb urls to what was stored during the previous ingestion
+    (see fetch_trackdb())
+    :param refresh_status: check the status of all the tracks, including the unchanged ones
+    :param max_workers: maximum number of trackDb files processed at the same time
+    (default: GENOMES_MAX_WORKERS setting)
+    :returns: a generator of (trackdb url, fetch_trackdb() result) tuples, in the order they're fetched
+    """
+    unique_urls = list(dict.fromkeys(trackdbs_urls))
+    if not unique_urls:
+        return
+    known_trackdbs = known_trackdbs or {}
+    max_workers = min(max_workers or settings.GENOMES_MAX_WORKERS, len(unique_urls))
+    remaining_urls = iter(unique_urls)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def submit_next_url():
+            url = next(remaining_urls, None)
+            if url is not None:
+                futures[executor.submit(fetch_trackdb, url, known_trackdbs.get(url), refresh_status)] = url
+
+        for _ in range(max_workers):
+            submit_next_url()
+        try:
+            while futures:
+                done_futures, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    url = futures.pop(future)
+                    submit_next_url()
+                    yield url, future.result()
+        finally:
+            # the caller has stopped (e.g. a trackDb file couldn't be parsed)
+            for future in futures:
+                future.cancel()
+
+
+def get_known_trackdbs(trackdbs):
+    """
+    Collect what fetch_trackdb() needs to know about the previous ingestion of the given trackdbs
+    :param trackdbs: dictionary mapping trackdb urls to the stored trackdb objects
+    :returns: dictionary mapping trackdb urls to their 'checksum', 'status' and (name, bigDataUrl) 'tracks'
     """
-    Save species using the provided genome assembly information from the submitted hub
-    along with the data stored in 'genome_assembly_dump' table
-    :param genome_assembly_name: genomes information extracted from genomes.txt file
-    :returns: either species object or, if it's not found or/and cannot be created it
-    returns an error message
-    TODO: make sure it loops through all species in genome.txt
+    known_trackdbs = {
+        url: {'checksum': trackdb.source_checksum, 'status': trackdb.status, 'tracks': set()}
+        for url, trackdb in trackdbs.items()
+    }
+    trackdbs_urls = {trackdb.trackdb_id: url for url, trackdb in trackdbs.items()}
+    stored_tracks = trackhubs.models.Track.objects.filter(
+        trackdb_id__in=trackdbs_urls.keys()
+    ).values_list('trackdb_id', 'name', 'big_data_url')
+    for trackdb_id, name, big_data_url in stored_tracks.iterator():
+        known_trackdbs[trackdbs_urls[trackdb_id]]['tracks'].add((name, big_data_url))
+    return known_trackdbs
+
+
+def refresh_trackdb_status(trackdb_obj, tracks_status, es_index_name, indexer=None):
     """
-    assembly_info_from_dump = get_assembly_info_from_dump(genome_assembly_name)
+    Update only the tracks status of a trackdb whose content hasn't changed
+    The row is updated with a query rather than save() so that the Elasticsearch autosync
+    doesn't index the whole document again (dropping the fields that aren't in TrackdbDocument)
+    :param trackdb_obj: the unchanged trackdb
+    :param tracks_status: the new status dictionary
+    :param es_index_name: Elasticsearch index name
+    :param indexer: es_bulk.BulkIndexer collecting the ES update
+    """
+    tracks_status = save_tracks_status(trackdb_obj, tracks_status)
+    trackdb_obj.status = tracks_status
+    # 'updated' is kept for the content changes (the scheduler checks the stable trackdbs less often)
+    trackdb_obj.status_updated = int(time.time())
+    trackhubs.models.Trackdb.objects.filter(trackdb_id=trackdb_obj.trackdb_id).update(
+        status=tracks_status, status_updated=trackdb_obj.status_updated
+    )
+    trackdb_obj.partial_update_trackdb_document(
+        {'status': tracks_status, 'status_updated': trackdb_obj.status_updated},
+        es_index_name, indexer
+    )
 
-    if assembly_info_from_dump is None:
-        return {"error": "Assembly '{}' doesn't exist".format(escape(genome_assembly_name))}
 
-    try:
-        existing_species_obj = trackhubs.models.Species.objects.filter(taxon_id=assembly_info_from_dump.tax_id).first()
-        if existing_species_obj:
-            return existing_species_obj
+def get_hub_checksum(hub_files_checksum, trackdbs_checksums):
+    """
+    Combine the checksum of the hub.txt and genomes.txt files with the checksums of the trackDb files
+    :param hub_files_checksum: checksum of the hub.txt and genomes.txt content
+    :param trackdbs_checksums: checksums of the trackDb files, in the genomes.txt order
+    :returns: the checksum of the whole hub content
+    """
+    checksum = hashlib.sha256(hub_files_checksum.encode('utf-8'))
+    for trackdb_checksum in trackdbs_checksums:
+        checksum.update('\n{}'.format(trackdb_checksum).encode('utf-8'))
+    return checksum.hexdigest()
+
+
+def start_hub_check(hub_url):
+    """
+    Run hubCheck in the background so the hub files can be fetched and parsed in the meantime
+    :param hub_url: the hub url provided by the submitter
+    :returns: a future holding the hub_check() result
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    hub_check_future = executor.submit(hub_check, hub_url)
+    # the thread exits as soon as hubCheck is done
+    executor.shutdown(wait=False)
+    return hub_check_future
 
-        new_species = trackhubs.models.Species(
-            taxon_id=assembly_info_from_dump.tax_id,
-            scientific_name=assembly_info_from_dump.scientific_name
-        )
-        new_species.save()
-        return new_species
 
-    except django.db.utils.OperationalError:
-        logger.exception('Error trying to connect to the database')
+def report_progress(progress_callback, stage, progress=None):
+    """
+    Call progress_callback (if any) with the current ingestion stage and progress
+    """
+    if progress_callback is not None:
+        progress_callback(stage, progress)
+
+
+def save_trackdb(trackdb_url, hub_obj, assembly_obj, species_obj, fetched_trackdb, existing_trackdb_obj,
+                 es_index_name, indexer):
+    # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Save a new or changed trackdb, its tracks and their status in one transaction
+    then queue the update of its Elasticsearch document
+    :param trackdb_url: trackdb url
+    :param hub_obj: the saved hub
+    :param assembly_obj: the genome assembly of the trackdb
+    :param species_obj: the species of the trackdb
+    :param fetched_trackdb: the (tracks, tracks status, checksum) tuple returned by fetch_trackdb()
+    :param existing_trackdb_obj: the stored trackdb if it isn't new, None otherwise
+    :param es_index_name: Elasticsearch index name
+    :param indexer: es_bulk.BulkIndexer collecting the ES update
+    """
+    tracks_info, tracks_status, checksum = fetched_trackdb
+    with transaction.atomic():
+        # Save the initial data
+        trackdb_obj = update_or_create_trackdb(trackdb_url, hub_obj, assembly_obj, species_obj)
+
+        # only the tracks that have been added, changed or removed are written
+        saved_tracks, _ = bulk_update_or_create_tracks(tracks_info, trackdb_obj)
+        add_tracks_parents(tracks_info, saved_tracks)
+        tracks_status = save_tracks_status(trackdb_obj, tracks_status)
+
+        trackdb_data = [{'id': track_obj.name, 'name': track_obj.longLabel} for track_obj in saved_tracks]
+        trackdb_configuration = build_trackdb_configuration(tracks_info)
+
+        # update MySQL, the JSON columns are rewritten only if they have changed
+        changed_fields = {
+            field: value
+            for field, value in (
+                ('configuration', trackdb_configuration), ('status', tracks_status), ('data', trackdb_data)
+            )
+            if getattr(trackdb_obj, field) != value
+        }
+        for field, value in changed_fields.items():
+            setattr(trackdb_obj, field, value)
+        trackdb_obj.source_checksum = checksum
+        trackdb_obj.save(update_fields=list(changed_fields) + ['source_checksum'])
+
+    # Update Elasticsearch trackdb document
+    if existing_trackdb_obj is None:
+        trackdb_obj.update_trackdb_document(
+            hub_obj, trackdb_data,
+            trackdb_configuration, tracks_status,
+            es_index_name, indexer
+        )
+    else:
+        # only the changed fields of the trackDb content are sent to update an existing document,
+        # plus the fields dropped by the autosync when the trackdb has been saved
+        changed_fields.update(hub_obj.get_document_fields())
+        changed_fields.update(trackdb_obj.get_extra_document_fields())
+        changed_fields['updated'] = int(time.time())
+        changed_fields['status_updated'] = trackdb_obj.status_updated
+        trackdb_obj.partial_update_trackdb_document(changed_fields, es_index_name, indexer)
+    return trackdb_obj
 
 
-def save_and_update_document(hub_url, data_type, current_user, run_hubcheck=True):
+def save_and_update_document(hub_url, data_type, current_user, run_hubcheck=True, progress_callback=None,
+                             refresh_status=False):
+    # pylint: disable=too-many-arguments,too-many-locals
     """
     Save everything in MySQL DB then Elasticsearch and
     update both after constructing the required objects
@@ -329,6 +814,9 @@ def save_and_update_document(hub_url, data_type, current_user, run_hubcheck=True
     :param data_type: the data type provided by the user (if any, default is 'genomics')
     :param current_user: the submitter (current user) id
     :param run_hubcheck: run hubCheck utility or not (default is True)
+    :param progress_callback: function called with the current stage and progress (e.g. SubmissionJob.update_progress)
+    :param refresh_status: check the tracks status of the trackDb files that haven't changed since
+    the last submission, unchanged trackDb files are skipped otherwise
     :returns: the hub information if the submission was successful otherwise it returns an error
     """
     # Get es_index_name from settings
@@ -336,19 +824,9 @@ def save_and_update_document(hub_url, data_type, current_user, run_hubcheck=True
 
     base_url = hub_url[:hub_url.rfind('/')]
 
-    # TODO: this three lines should be moved somewhere else where they are executed only once
-    # See Providing initial data for models: https://docs.djangoproject.com/en/2.2/howto/initial-data/
-    save_datatype_filetype_visibility(DATA_TYPES, trackhubs.models.DataType)
-    save_datatype_filetype_visibility(FILE_TYPES, trackhubs.models.FileType)
-    save_datatype_filetype_visibility(VISIBILITY, trackhubs.models.Visibility)
-
-    # run the UCSC hubCheck tool found in kent tools on the submitted hub
-    if run_hubcheck:
-        hub_check_result = hub_check(hub_url)
-        if 'error' in hub_check_result.keys():
-            return hub_check_result
-
-    hub_info_array = parse_file_from_url(hub_url)
+    report_progress(progress_callback, 'parsing')
+    hub_files_checksum = hashlib.sha256()
+    hub_info_array = parse_file_from_url(hub_url, checksum=hub_files_checksum)
 
     if not hub_info_array:
         # We return a structured error so tests can assert on a stable error shape.
@@ -368,120 +846,112 @@ def save_and_update_document(hub_url, data_type, current_user, run_hubcheck=True
             data_type = 'genomics'
 
         genome_url = base_url + '/' + hub_info['genomesFile']
-        genomes_trackdbs_info = parse_file_from_url(genome_url)
+        genomes_trackdbs_info = parse_file_from_url(genome_url, checksum=hub_files_checksum)
+        if not genomes_trackdbs_info:
+            return {"error": "Couldn't parse '{}', please make sure it exists and is well formatted".format(
+                escape(genome_url))}
         logger.debug("genomes_trackdbs_info: {}".format(json.dumps(genomes_trackdbs_info, indent=4)))
 
-        hub_obj = update_or_create_hub(hub_info, data_type, current_user)
-
-        for genome_trackdb in genomes_trackdbs_info:
-            logger.debug("genomes_trackdb: {}".format(json.dumps(genome_trackdb, indent=4)))
-
-            error_or_species_obj = save_species(genome_trackdb['genome'])
-            if not isinstance(error_or_species_obj, trackhubs.models.Species):
-                # delete the hub from MySQL
-                hub_obj.delete()
-                # An error message is shown if the returned result is not an instance of Species
-                return error_or_species_obj
-
-            # we got the assembly_name from genomes_trackdb['genome']
-            assembly_obj = save_assembly(genome_trackdb['genome'])
-
-            # Save the initial data
-            trackdb_url = base_url + '/' + genome_trackdb['trackDb']
-            trackdb_obj = update_or_create_trackdb(trackdb_url, hub_obj, assembly_obj, error_or_species_obj)
-
-            trackdbs_info = parse_file_from_url(trackdb_url)
-            # logger.debug("trackdbs_info: {}".format(json.dumps(trackdbs_info, indent=4)))
-
-            trackdb_data = []
-            trackdb_configuration = {}
-            for track in trackdbs_info:
-                # print("track: {}".format(json.dumps(track, indent=4)))
-
-                if 'track' in track:
-                    # default value
-                    visibility = 'hide'
-                    file_type = None
-                    # get the file type and visibility
-                    # TODO: if file_type in FILE_TYPES Good, Else Error
-                    if 'type' in track:
-                        file_type = get_datatype_filetype_visibility(track['type'], trackhubs.models.FileType,
-                                                                     file_type=True).name
-                    if 'visibility' in track:
-                        visibility = get_datatype_filetype_visibility(track['visibility'],
-                                                                      trackhubs.models.Visibility).name
-
-                    track_obj = update_or_create_track(track, trackdb_obj, file_type, visibility)
-                    trackdb_data.append(
-                        {
-                            'id': track_obj.name,
-                            'name': track_obj.longLabel
-                        }
+        # the trackDb files are fetched, parsed and checked concurrently, each one is saved as soon as it's ready
+        report_progress(progress_callback, 'fetching')
+        trackdbs_urls = [base_url + '/' + genome_trackdb['trackDb'] for genome_trackdb in genomes_trackdbs_info]
+        genomes_by_trackdb_url = {}
+        for trackdb_url, genome_trackdb in zip(trackdbs_urls, genomes_trackdbs_info):
+            genomes_by_trackdb_url.setdefault(trackdb_url, []).append(genome_trackdb)
+        # trackDb files whose content hasn't changed since the last submission of this hub are skipped
+        existing_trackdbs = {
+            trackdb.source_url: trackdb
+            for trackdb in trackhubs.models.Trackdb.objects.filter(source_url__in=trackdbs_urls, hub__url=hub_url)
+        }
+        hub_existed = is_hub_exists(hub_url) is not None
+
+        # run the UCSC hubCheck tool found in kent tools on the submitted hub while the trackDb files are fetched,
+        # unless this content has already been checked (assuming the trackDb files haven't changed either)
+        hub_check_future = None
+        hub_check_result = None
+        if run_hubcheck:
+            expected_hub_checksum = get_hub_checksum(
+                hub_files_checksum.hexdigest(),
+                [getattr(existing_trackdbs.get(url), 'source_checksum', None) for url in trackdbs_urls]
+            )
+            if get_cached_hub_check(hub_url, expected_hub_checksum) is None:
+                hub_check_future = start_hub_check(hub_url)
+
+        hub_obj = None
+        error = None
+        trackdbs_checksums = {}
+        saved_genomes = 0
+        # the trackdb documents of all the genomes are sent to Elasticsearch together once they're saved
+        indexer = BulkIndexer()
+        fetched_trackdbs = iter_fetched_trackdbs(
+            trackdbs_urls,
+            known_trackdbs=get_known_trackdbs(existing_trackdbs),
+            refresh_status=refresh_status
+        )
+        for trackdb_url, (tracks_info, tracks_status, checksum) in fetched_trackdbs:
+            if tracks_info is None:
+                error = {"error": "Couldn't parse '{}', please make sure it exists and is well formatted".format(
+                    escape(trackdb_url))}
+                break
+            trackdbs_checksums[trackdb_url] = checksum
+            existing_trackdb_obj = existing_trackdbs.get(trackdb_url)
+            unchanged = existing_trackdb_obj is not None and existing_trackdb_obj.source_checksum == checksum
+
+            # nothing is written to the database until hubCheck has passed, the cached result
+            # only applies as long as the trackDb files are unchanged
+            if run_hubcheck and hub_check_result is None and (hub_check_future is not None or not unchanged):
+                report_progress(progress_callback, 'hubcheck')
+                if hub_check_future is None:
+                    hub_check_future = start_hub_check(hub_url)
+                hub_check_result = hub_check_future.result()
+                if 'error' in hub_check_result.keys():
+                    error = hub_check_result
+                    break
+
+            if hub_obj is None:
+                # all the genome assemblies are resolved at once, the species and assemblies are saved before
+                # the hub so a hub with an unknown genome assembly is never registered
+                species_and_assemblies = save_species_and_assemblies(
+                    list(dict.fromkeys(genome_trackdb['genome'] for genome_trackdb in genomes_trackdbs_info))
+                )
+                if isinstance(species_and_assemblies, dict):
+                    error = species_and_assemblies
+                    break
+                species_by_genome, assemblies_by_genome = species_and_assemblies
+                hub_obj = update_or_create_hub(hub_info, data_type, current_user)
+                # the data type, labels and owner of the hub are pushed to all its trackdb documents
+                hub_document_fields = hub_obj.get_document_fields()
+
+            for genome_trackdb in genomes_by_trackdb_url[trackdb_url]:
+                report_progress(progress_callback, 'trackdbs', {'done': saved_genomes, 'total': len(trackdbs_urls)})
+                logger.debug("genomes_trackdb: {}".format(json.dumps(genome_trackdb, indent=4)))
+                if unchanged:
+                    if tracks_status is not None:
+                        refresh_trackdb_status(existing_trackdb_obj, tracks_status, es_index_name, indexer)
+                    # the hub metadata may have changed even if the trackDb file hasn't
+                    existing_trackdb_obj.partial_update_trackdb_document(hub_document_fields, es_index_name, indexer)
+                else:
+                    save_trackdb(
+                        trackdb_url, hub_obj, assemblies_by_genome[genome_trackdb['genome']],
+                        species_by_genome[genome_trackdb['genome']], (tracks_info, tracks_status, checksum),
+                        existing_trackdb_obj, es_index_name, indexer
                     )
-
-                    # if the track is parent we prepare the configuration object
-                    # if any(k in track for k in ('compositeTrack', 'superTrack', 'container')):
-                    # logger.debug("'{}' is parent".format(track['track']))
-
-                    # prepare the configuration object
-                    # the if above commented out because regardless of whether the track is a parent or not
-                    # this fix seems to work, but looks too good to be true, however I can't see any side effect
-                    # the commented if above is left there just in case if it turns out I need it in the future
-                    trackdb_configuration[track['track']] = track
-                    trackdb_configuration[track['track']].pop('url', None)
-
-                    # if the track is a child, add the parent id and update
-                    # the configuration to include the current track
-                    if 'parent' in track:
-                        add_parent_id(track['parent'], track_obj)
-                        parent_track_obj, grandparent_track_obj = get_parents(track_obj)
-
-                        if grandparent_track_obj is None:  # Then we are in the first level (subtrack)
-                            if 'members' not in trackdb_configuration[parent_track_obj.name]:
-                                trackdb_configuration[parent_track_obj.name].update({
-                                    'members': {
-                                        track['track']: track
-                                    }
-                                })
-                            else:
-                                trackdb_configuration[parent_track_obj.name]['members'].update({
-                                    track['track']: track
-                                })
-
-                        else:  # we are in the second level (subsubtrack)
-                            if 'members' not in trackdb_configuration[grandparent_track_obj.name]['members'][
-                                parent_track_obj.name]:
-                                trackdb_configuration[grandparent_track_obj.name]['members'][
-                                    parent_track_obj.name].update({
-                                    'members': {
-                                        track['track']: track
-                                    }
-                                })
-                            else:
-                                trackdb_configuration[grandparent_track_obj.name]['members'][parent_track_obj.name][
-                                    'members'].update({
-                                    track['track']: track
-                                })
-
-            # Handle track status
-            # Get all tracks belonging to the current trackdb_obj
-            all_tracks = trackhubs.models.Track.objects.filter(trackdb_id=trackdb_obj.trackdb_id)
-            # Fetch tracks status and get the status dict that will be loaded to MySQL and Elasticsearch below
-            tracks_status = fetch_tracks_status(all_tracks, trackdb_url)
-
-            # update MySQL
-            current_trackdb = Trackdb.objects.get(trackdb_id=trackdb_obj.trackdb_id)
-            current_trackdb.configuration = trackdb_configuration
-            current_trackdb.status = tracks_status
-            current_trackdb.data = trackdb_data
-            current_trackdb.save()
-            # Update Elasticsearch trackdb document
-            trackdb_obj.update_trackdb_document(
-                hub_obj, trackdb_data,
-                trackdb_configuration, tracks_status,
-                es_index_name
+                saved_genomes += 1
+        fetched_trackdbs.close()
+
+        if error is not None and not hub_existed and hub_obj is not None:
+            # a new hub shouldn't be left half registered
+            hub_obj.delete()
+            return error
+        # the trackdbs saved before an error are kept up to date in Elasticsearch too
+        indexer.flush()
+        if error is not None:
+            return error
+        if hub_check_result is not None:
+            hub_checksum = get_hub_checksum(
+                hub_files_checksum.hexdigest(), [trackdbs_checksums[url] for url in trackdbs_urls]
             )
-
+            cache_hub_check(hub_url, hub_checksum, hub_check_result)
         return {'success': 'The hub is submitted/updated successfully'}
 
     return None
@@ -0,0 +1,123 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+
+from trackhubs.models import UrlCheckResult
+from trackhubs.utils import get_upsert_options
+
+logger = logging.getLogger(__name__)
+
+# number of urls looked up or saved per query
+BATCH_SIZE = 500
+
+
+def get_url_hash(url):
+    """
+    :returns: the key of the given url in the url_check_result table
+    """
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+def get_cached_results(urls):
+    """
+    :param urls: list of full bigDataUrls
+    :returns: dictionary mapping the urls checked less than URL_CHECK_CACHE_TTL seconds ago
+    to their probe_url() result (see tracks_status.py)
+    """
+    if not settings.URL_CHECK_CACHE_TTL:
+        return {}
+    urls_by_hash = {get_url_hash(url): url for url in urls}
+    url_hashes = list(urls_by_hash)
+    min_checked_at = int(time.time()) - settings.URL_CHECK_CACHE_TTL
+    cached_results = {}
+    for start in range(0, len(url_hashes), BATCH_SIZE):
+        rows = UrlCheckResult.objects.filter(
+            url_hash__in=url_hashes[start:start + BATCH_SIZE], checked_at__gte=min_checked_at
+        ).values('url_hash', 'url', 'status', 'content_length', 'last_modified')
+        for row in rows:
+            # ignore (very unlikely) hash collisions
+            if urls_by_hash[row['url_hash']] == row['url']:
+                cached_results[row['url']] = {
+                    'status': row['status'],
+                    'content_length': row['content_length'],
+                    'last_modified': row['last_modified']
+                }
+    return cached_results
+
+
+def save_results(results):
+    """
+    Store (or replace) the results of the given checks, the cache size is kept under control
+    by evict_cache() which runs once at the end of each status refresh
+    :param results: dictionary mapping full bigDataUrls to their probe_url() result
+    """
+    if not settings.URL_CHECK_CACHE_TTL or not results:
+        return
+    checked_at = int(time.time())
+    UrlCheckResult.objects.bulk_create(
+        [
+            UrlCheckResult(
+                url_hash=get_url_hash(url),
+                url=url,
+                status=result['status'],
+                content_length=result['content_length'],
+                last_modified=result['last_modified'],
+                checked_at=checked_at
+            )
+            for url, result in results.items()
+        ],
+        batch_size=BATCH_SIZE,
+        **get_upsert_options(['url_hash'], ['url', 'status', 'content_length', 'last_modified', 'checked_at'])
+    )
+
+
+def evict_cache(max_entries=None):
+    """
+    Delete the expired results (an indexed range on checked_at), then the oldest ones
+    until there are at most max_entries left
+    It counts the whole table, so it's run once per status refresh rather than after every save
+    :param max_entries: maximum size of the cache (default: URL_CHECK_CACHE_MAX_ENTRIES setting)
+    :returns: the number of deleted results
+    """
+    max_entries = max_entries or settings.URL_CHECK_CACHE_MAX_ENTRIES
+    expired_results = purge_cache(expired_only=True)
+    excess = UrlCheckResult.objects.count() - max_entries
+    if excess <= 0:
+        if expired_results:
+            logger.info("{} expired url check results deleted".format(expired_results))
+        return expired_results
+    oldest_ids = list(
+        UrlCheckResult.objects.order_by('checked_at', 'pk').values_list('pk', flat=True)[:excess]
+    )
+    deleted_results = expired_results
+    for start in range(0, len(oldest_ids), BATCH_SIZE):
+        deleted_results += UrlCheckResult.objects.filter(pk__in=oldest_ids[start:start + BATCH_SIZE]).delete()[0]
+    logger.info("{} cached url check results evicted".format(deleted_results))
+    return deleted_results
+
+
+def purge_cache(expired_only=True):
+    """
+    :param expired_only: delete only the results older than URL_CHECK_CACHE_TTL, otherwise delete them all
+    :returns: the number of deleted results
+    """
+    results = UrlCheckResult.objects.all()
+    if expired_only:
+        results = results.filter(checked_at__lt=int(time.time()) - settings.URL_CHECK_CACHE_TTL)
+    return results.delete()[0]
@@ -3,6 +3,8 @@ import json
 import logging
 import re
 
+from django.db import connection
+
 logger = logging.getLogger(__name__)
 
 
@@ -49,3 +51,18 @@ def remove_html_tags(text):
     import re
     clean = re.compile('<.*?>')
     return re.sub(clean, '', text)
+
+
+def get_upsert_options(unique_fields, update_fields):
+    """
+    bulk_create() arguments turning the INSERT into an upsert (existing rows are updated)
+    MySQL doesn't accept unique_fields, its ON DUPLICATE KEY UPDATE applies to any unique key,
+    whereas SQLite and PostgreSQL need them for their ON CONFLICT (...) DO UPDATE
+    :param unique_fields: fields of the unique key identifying the existing rows
+    :param update_fields: fields updated when the row already exists
+    :returns: dictionary of keyword arguments for bulk_create()
+    """
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = unique_fields
+    return options
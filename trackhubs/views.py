@@ -15,16 +15,27 @@
 import elasticsearch
 from django.db import transaction
 from django.http import Http404
-from elasticsearch_dsl import connections
+from drf_spectacular.utils import extend_schema
 from rest_framework import status, authentication, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from thr.settings import ELASTICSEARCH_DSL
-from trackhubs.serializers import CustomOneHubSerializer, CustomHubListSerializer
-from trackhubs.models import Hub
+from trackhubs.es_client import get_es_client
+from trackhubs.serializers import CustomOneHubSerializer, CustomHubListSerializer, SubmissionJobSerializer
+from trackhubs.models import Hub, SubmissionJob
+import trackhubs.jobs
 import trackhubs.translator
-from drf_spectacular.utils import extend_schema
+
+
+def job_accepted_response(job):
+    """
+    Response returned when a hub submission is queued
+    """
+    return {
+        'success': 'The hub submission is accepted and will be processed shortly',
+        'job_id': job.job_id,
+        'uri': '/api/trackhub/jobs/{}'.format(job.job_id),
+    }
 
 
 class TrackHubList(APIView):
@@ -60,6 +71,7 @@ class TrackHubList(APIView):
             data_type = data.get('type')
             current_user = request.user
             run_hubcheck = data.get('run_hubcheck', True)
+            refresh_status = data.get('refresh_status', False)
 
             # Verification steps
             # Before we submit the hub we make sure that the hub doesn't exist already
@@ -77,15 +89,9 @@ class TrackHubList(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-            result = trackhubs.translator.save_and_update_document(hub_url, data_type, current_user, run_hubcheck)
-            if not result:
-                return Response(
-                    {'error': 'Something went wrong with the hub submission, please make sure that url is correct and working'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            if 'error' in result:
-                return Response(result, status=status.HTTP_400_BAD_REQUEST)
-            return Response(result, status=status.HTTP_201_CREATED)
+            # the hub is processed in the background by the 'process_submissions' command
+            job = trackhubs.jobs.submit_hub(hub_url, data_type, current_user, run_hubcheck, refresh_status)
+            return Response(job_accepted_response(job), status=status.HTTP_202_ACCEPTED)
         return Response(
             {"error": "Something went wrong with the hub submission, please make sure that 'url' field exists"},
             status=status.HTTP_400_BAD_REQUEST
@@ -132,17 +138,10 @@ class TrackHubDetail(APIView):
                     assemblies = data.get('assemblies')
                     data_type = data.get('type')
                     run_hubcheck = data.get('run_hubcheck', True)
+                    refresh_status = data.get('refresh_status', False)
 
-                    result = trackhubs.translator.save_and_update_document(hub_url, data_type, current_user, run_hubcheck)
-                    if not result:
-                        return Response(
-                            {
-                                'error': 'Something went wrong with the hub submission, please make sure that url is correct and working'},
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    if 'error' in result:
-                        return Response(result, status=status.HTTP_400_BAD_REQUEST)
-                    return Response(result, status=status.HTTP_201_CREATED)
+                    job = trackhubs.jobs.submit_hub(hub_url, data_type, current_user, run_hubcheck, refresh_status)
+                    return Response(job_accepted_response(job), status=status.HTTP_202_ACCEPTED)
 
                 return Response(
                     {"error": "Something went wrong with the hub submission, please make sure that 'url' field exists"},
@@ -168,10 +167,7 @@ class TrackHubDetail(APIView):
         hub_original_owner_id = hub.owner_id
         if current_user_id == hub_original_owner_id:
             try:
-                es = connections.Elasticsearch(
-                    [ELASTICSEARCH_DSL['default']['hosts']],
-                    verify_certs=True
-                )
+                es = get_es_client()
                 for trackdb_id in trackdbs_ids_list:
                     es.delete(index='trackhubs', id=trackdb_id)
             except elasticsearch.exceptions.NotFoundError:
@@ -201,3 +197,33 @@ class TrackHubDetail(APIView):
         hub.delete()
 
         return Response({"success": "Hub '{}' is deleted successfully".format(hub.name)}, status=status.HTTP_200_OK)
+
+
+class SubmissionJobDetail(APIView):
+    """
+    Retrieve the status of a hub submission
+    """
+    authentication_classes = [authentication.TokenAuthentication]
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = SubmissionJobSerializer
+
+    @staticmethod
+    def get_job(primary_key):
+        try:
+            return SubmissionJob.objects.get(pk=primary_key)
+        except SubmissionJob.DoesNotExist as job_not_found:
+            raise Http404 from job_not_found
+
+    def get(self, request, pk):
+        """
+        Return the stage, progress and, once it's done, the result of the submission
+        """
+        # pylint: disable=invalid-name
+        job = self.get_job(pk)
+        if job.owner_id != request.user.id:
+            return Response(
+                {"error": "This submission belongs to a different user!"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer = SubmissionJobSerializer(job)
+        return Response(serializer.data)